@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Image encode/decode benchmarks for the work vlm_prompt and generate_image do per request:
+base64 for the API payloads, PIL decode, and re-encoding for each model profile.
+"""
+
+import argparse
+import base64
+import io
+import random
+
+from PIL import Image
+
+import common  # noqa: F401  (sets up the environment before the app modules load)
+from common import measure, report
+
+
+def photo(width, height, format, seed=0):
+    """Noisy gradient image; noise keeps the encoders from compressing it unrealistically well.
+    A different seed gives a different tint, so the bytes differ even where the noise would not"""
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    noise = Image.effect_noise((width, height), 40).convert('RGB')
+    image = Image.blend(image, noise, 0.35)
+    rng = random.Random(seed)
+    tint = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    image = Image.blend(image, tint, 0.2)
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, quality=90)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    from image_asset import ImageAsset
+    from image_processor import PROFILES, _process
+
+    inputs = {
+        'webcam_jpeg_1280x720': photo(1280, 720, 'JPEG'),
+        'reference_png_1200x1600': photo(1200, 1600, 'PNG'),
+        'reference_jpeg_2400x3200': photo(2400, 3200, 'JPEG'),
+    }
+
+    results = {}
+    for name, data in inputs.items():
+        encoded = base64.b64encode(data).decode('utf-8')
+        case = {'bytes': len(data)}
+        # Fresh ImageAsset per call: the lazily cached properties would otherwise hide the cost
+        case['b64_encode'] = measure(lambda: ImageAsset(data).b64, args.runs)
+        case['b64_decode'] = measure(lambda: ImageAsset.from_b64(encoded).data, args.runs)
+        case['pil_decode'] = measure(lambda: ImageAsset(data).image.load(), args.runs)
+        case['as_png'] = measure(lambda: ImageAsset(data).as_png(), args.runs)
+        for profile in ('vlm', 'gemini', 'preview'):
+            case[f'prepare_{profile}'] = measure(lambda: _process(ImageAsset(data), PROFILES[profile]), args.runs)
+        results[name] = case
+
+    report('codec', results)
+
+
+if __name__ == "__main__":
+    main()
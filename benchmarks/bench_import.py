@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Import-time benchmark for models.py.
+Compares a cold `import models` (clients built lazily) against eagerly importing
+the provider SDKs the way models.py used to, each in a fresh interpreter.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'import_models': "import models",
+    'import_models_and_build_clients': "import models; models.get_client('gemini_client'); models.get_client('openrouter_client')",
+    'eager_sdk_imports': "from google import genai; from google.genai import types; from openai import OpenAI",
+}
+
+TIMER = """
+import time
+start = time.perf_counter()
+try:
+    exec({code!r})
+    print(time.perf_counter() - start)
+except Exception as e:
+    print('error: %s' % e)
+"""
+
+
+def time_import(code, runs):
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", TIMER.format(code=code)],
+            cwd=REPO_ROOT, capture_output=True, text=True,
+        )
+        output = result.stdout.strip().splitlines()[-1] if result.stdout.strip() else "error: no output"
+        if output.startswith("error"):
+            return {'error': output[len("error: "):]}
+        timings.append(float(output) * 1000)
+    return {
+        'runs': runs,
+        'median_ms': round(statistics.median(timings), 2),
+        'min_ms': round(min(timings), 2),
+        'max_ms': round(max(timings), 2),
+    }
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = {name: time_import(code, runs) for name, code in CASES.items()}
+    print(json.dumps({'benchmark': 'import_time', 'results': results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Full-pipeline benchmark: N concurrent booth sessions against the stub server.
+Each session runs main.py's own stages (pipeline.PIPELINE_STEPS: reference search,
+VLM prompt, parallel candidate generation) through a JobQueue, with the same
+per-provider limits as the app.
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+import common  # noqa: F401  (sets up the environment before the app modules load)
+from common import SCRATCH_DIR, quiet, report, start_stub
+from bench_codec import photo
+
+
+def run_sessions(queue, steps, sessions, label):
+    from image_asset import ImageAsset
+    from jobs import DONE
+    from stage_cache import StageCache
+
+    # A distinct photo per session, as at the booth, so per-image caches cannot short-circuit the run
+    webcams = [ImageAsset(photo(1280, 720, 'JPEG', seed=i)) for i in range(sessions)]
+    started = time.perf_counter()
+    stage_cache = StageCache()  # As in main.py: one per process, shared by every session
+    job_ids = [queue.submit(steps, {'char_prompt': f"character {label} {i}", 'webcam': webcams[i], 'stage_cache': stage_cache})
+               for i in range(sessions)]
+    jobs = [queue.get(job_id) for job_id in job_ids]
+    while not all(job.finished for job in jobs):
+        time.sleep(0.01)
+    wall = time.perf_counter() - started
+
+    durations = sorted(job.finished_at - job.submitted_at for job in jobs)
+    return {
+        'sessions': sessions,
+        'wall_s': round(wall, 3),
+        'session_p50_s': round(statistics.median(durations), 3),
+        'session_p95_s': round(durations[min(int(len(durations) * 0.95), len(durations) - 1)], 3),
+        'failed': sum(job.status != DONE for job in jobs),
+        'sessions_per_minute': round(sessions / wall * 60, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", default="1,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency per upstream call, seconds")
+    parser.add_argument("--workers", type=int, default=3, help="JobQueue workers (main.py uses 3)")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the production token buckets")
+    args = parser.parse_args()
+
+    server = start_stub(latency=args.latency, synthetic_posts=200)
+    os.chdir(SCRATCH_DIR)  # gemini_generate writes its output/ files relative to the working directory
+
+    from jobs import JobQueue
+    from ratelimit import rate_limiter
+    if not args.rate_limits:
+        rate_limiter.limits = {}  # Free-tier quotas would dominate; this measures our own overhead
+
+    from pipeline import PIPELINE_STEPS as steps
+    results = {'stub_latency_s': args.latency, 'workers': args.workers}
+    with quiet():
+        # First session pays for client construction and cold caches; report it separately
+        results['cold'] = run_sessions(JobQueue(workers=args.workers), steps, 1, "cold")
+        for sessions in (int(n) for n in args.sessions.split(',')):
+            results[f'sessions_{sessions}'] = run_sessions(JobQueue(workers=args.workers), steps, sessions, sessions)
+    results['upstream_requests'] = server.stats()['requests']
+    report('pipeline', results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Search benchmarks against the local stub server (no network).
+Measures search_images fetch+parse+filter throughput on large post lists, the
+cache-hit path, the cost of ranking posts in get_best_image_url, and how many
+searches the tag fallback needs with and without tag post counts (concurrent, as the
+app runs it, and sequential).
+"""
+
+import argparse
+import random
+
+import common
+from common import measure, report, start_stub
+
+
+def synthetic_posts(count, seed=0):
+    rng = random.Random(seed)
+    return [{
+        'id': i,
+        'md5': f"{i:032x}",
+        'score': rng.randint(0, 500),
+        'rating': rng.choice(('general', 'general', 'general', 'sensitive')),
+        'width': rng.choice((800, 1200, 2000)),
+        'height': rng.choice((1000, 1600, 2800)),
+        'tags': "1girl solo looking_at_viewer",
+        'file_url': f"https://img.example/{i}.png" if rng.random() > 0.02 else "",
+    } for i in range(count)]
+
+
+# Rough Gelbooru post counts and categories, and tag lists in the order an LLM tends to produce them
+TAG_COUNTS = {
+    'megumin': [10000, 4], 'kono_subarashii_sekai_ni_shukufuku_wo!': [30000, 3], 'gojou_satoru': [15000, 4],
+    'jujutsu_kaisen': [60000, 3], '1girl': [6000000, 0], '1boy': [2500000, 0], 'brown_hair': [1500000, 0],
+    'red_eyes': [2000000, 0], 'white_hair': [900000, 0], 'blue_eyes': [2200000, 0], 'blindfold': [60000, 0],
+    'official_art': [200000, 0], 'anime_screenshot': [300000, 0],
+}
+FALLBACK_QUERIES = [
+    "megumin kono_subarashii_sekai_ni_shukufuku_wo! red_eyes brown_hair 1girl official_art anime_screenshot",
+    "megumin kono_subarashii_sekai_ni_shukufuku_wo! red_eyes brown_hair 1girl",
+    "gojou_satoru jujutsu_kaisen white_hair blue_eyes 1boy blindfold official_art",
+    "gojo_satoru jujutsu_kaisen white_hair blindfold 1boy",
+]
+
+
+def fallback_searches(searcher, queries, concurrent=True):
+    """Average search_images calls per query for find_top_posts_with_fallback (concurrent, as the app runs it)"""
+    calls = 0
+    search_images = searcher.search_images
+
+    def counted(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return search_images(*args, **kwargs)
+
+    searcher.search_images = counted
+    with common.quiet():
+        for query in queries:
+            searcher.find_top_posts_with_fallback(query, concurrent=concurrent)
+    return round(calls / len(queries), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--posts", type=int, default=5000, help="posts in the large search response")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    server = start_stub(synthetic_posts=args.posts)
+    import http_session
+    from gelbooru import GelbooruSearcher
+    from posts import Post, postcard_score
+    from search_cache import SearchCache
+    from tag_counts import TagCounts
+
+    uncached = GelbooruSearcher(cache=SearchCache(enabled=False))
+    cached = GelbooruSearcher(cache=SearchCache(path=None, max_entries=64))
+    tags = ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!']
+    with common.quiet():
+        cached.search_images(tags, limit=args.posts)  # Fill the memory tier
+
+    results = {}
+    for size in (100, args.posts):
+        timing = measure(lambda: uncached.search_images(tags, limit=size, use_cache=False), args.runs)
+        timing['posts_per_second'] = round(size / (timing['median_ms'] / 1000))
+        results[f'search_images_{size}_posts'] = timing
+    results['search_images_cache_hit'] = measure(lambda: cached.search_images(tags, limit=args.posts), args.runs)
+
+    postcard = GelbooruSearcher(cache=SearchCache(enabled=False), scorer=postcard_score)
+    for size in (100, args.posts):
+        raw = synthetic_posts(size)
+        posts = [Post.from_dict(post) for post in raw]
+        results[f'parse_posts_{size}'] = measure(lambda: [Post.from_dict(post) for post in raw], args.runs)
+        results[f'get_best_image_url_{size}_posts'] = measure(lambda: uncached.get_best_image_url(posts), args.runs)
+        results[f'get_best_image_url_postcard_{size}_posts'] = measure(lambda: postcard.get_best_image_url(posts), args.runs)
+
+    server.config.tag_counts = TAG_COUNTS
+    positional = GelbooruSearcher(cache=SearchCache(enabled=False), counts=TagCounts(enabled=False))
+    planned = GelbooruSearcher(cache=SearchCache(enabled=False))
+    results['fallback_searches_per_query'] = {
+        'positional': fallback_searches(positional, FALLBACK_QUERIES),
+        'planned': fallback_searches(planned, FALLBACK_QUERIES),
+        'positional_sequential': fallback_searches(positional, FALLBACK_QUERIES, concurrent=False),
+        'planned_sequential': fallback_searches(planned, FALLBACK_QUERIES, concurrent=False),
+    }
+
+    # Connection reuse of the pooled session over every search above
+    results['connections'] = http_session.connection_stats()
+    report('search', results)
+
+
+if __name__ == "__main__":
+    main()
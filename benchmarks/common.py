@@ -0,0 +1,80 @@
+"""
+Shared helpers for the offline benchmarks.
+Importing this module points every cache and API base URL at throwaway locations,
+so it must be imported before any of the app modules.
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="nyp-bench-")
+
+# Cold, isolated caches: nothing from a previous run or the real app may skew the numbers
+os.environ.update({
+    'SEARCH_CACHE_PATH': os.path.join(SCRATCH_DIR, "search_cache.sqlite3"),
+    'IMAGE_STORE_DIR': os.path.join(SCRATCH_DIR, "images"),
+    'TAG_RESOLVER_CACHE_PATH': os.path.join(SCRATCH_DIR, "tag_resolver.json"),
+    'STYLE_DESCRIPTOR_CACHE_PATH': os.path.join(SCRATCH_DIR, "style_descriptors.json"),
+    'TAG_COUNTS_CACHE_PATH': os.path.join(SCRATCH_DIR, "tag_counts.json"),
+    'RATE_LIMIT_STATE': os.path.join(SCRATCH_DIR, "ratelimit.json"),
+    'TRACING': os.environ.get('TRACING', ''),
+    'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY') or 'stub',
+    'OPENROUTER_API_KEY': os.environ.get('OPENROUTER_API_KEY') or 'stub',
+    'GOOGLE_API_KEY': os.environ.get('GOOGLE_API_KEY') or 'stub',
+})
+
+
+def start_stub(**config):
+    """Start stub_server.py on a free port and point the app's base URLs at it"""
+    from stub_server import StubConfig, StubServer
+    server = StubServer(('127.0.0.1', 0), StubConfig(data_dir=os.path.join(SCRATCH_DIR, "stub_data"), **config))
+    os.environ.update(server.env())
+    return server.start()
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the app's progress prints so stdout stays valid JSON"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def measure(fn, runs=20, warmup=2):
+    """Call fn() repeatedly and summarize wall time in milliseconds"""
+    with quiet():
+        for _ in range(warmup):
+            fn()
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'runs': runs,
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(int(len(timings) * 0.95), len(timings) - 1)], 3),
+        'min_ms': round(timings[0], 3),
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def report(name, results):
+    print(json.dumps({'benchmark': name, 'environment': environment(), 'results': results}, indent=2))
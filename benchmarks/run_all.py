@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Run every benchmark (each in its own interpreter) and merge their JSON into one report.
+
+    python benchmarks/run_all.py --output bench.json
+    python benchmarks/run_all.py --baseline bench.json --threshold 0.25
+
+With --baseline, timings that got slower than the threshold are listed as regressions
+and the exit status is 1, so CI can flag them.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BENCHMARKS = {
+    'import_time': ["bench_import.py"],
+    'search': ["bench_search.py"],
+    'codec': ["bench_codec.py"],
+    'pipeline': ["bench_pipeline.py"],
+}
+
+# Lower is better for these; everything else (counts, throughput, sizes) is informational
+COMPARED_KEYS = ('median_ms', 'p95_ms', 'wall_s', 'session_p50_s', 'session_p95_s')
+
+
+def run_benchmark(script):
+    result = subprocess.run([sys.executable, *script], cwd=BENCH_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}"}
+    try:
+        return json.loads(result.stdout)['results']
+    except (ValueError, KeyError) as e:
+        return {'error': f"unparseable output: {e}"}
+
+
+def flatten(results, prefix=""):
+    """{'a': {'median_ms': 1}} -> {'a.median_ms': 1}"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        else:
+            flat[path] = value
+    return flat
+
+
+def compare(current, baseline, threshold):
+    """Timings in current that are more than `threshold` (a fraction) slower than in baseline"""
+    old, new = flatten(baseline), flatten(current)
+    regressions = []
+    for path, value in sorted(new.items()):
+        if not path.endswith(COMPARED_KEYS) or not isinstance(old.get(path), (int, float)) or not old[path]:
+            continue
+        change = value / old[path] - 1
+        if change > threshold:
+            regressions.append({'metric': path, 'baseline': old[path], 'current': value, 'change': round(change, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help="comma-separated benchmark names", default=",".join(BENCHMARKS))
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before flagging, as a fraction")
+    args = parser.parse_args()
+
+    report = {'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"), 'python': sys.version.split()[0], 'benchmarks': {}}
+    for name in args.only.split(','):
+        print(f"Running {name}...", file=sys.stderr)
+        report['benchmarks'][name] = run_benchmark(BENCHMARKS[name])
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['regressions'] = compare(report['benchmarks'], baseline.get('benchmarks', {}), args.threshold)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    if report.get('regressions'):
+        print(f"{len(report['regressions'])} regression(s) over {args.threshold:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from gelbooru import GENERIC_FALLBACK, GelbooruSearcher
+from tracing import current_span, submit, traced
+
+# Danbooru ratings are single letters; 's' is "sensitive", not "safe"
+DANBOORU_RATINGS = {'g': 'general', 's': 'sensitive', 'q': 'questionable', 'e': 'explicit'}
+
+
+class SafebooruSearcher(GelbooruSearcher):
+    """Safebooru runs the same dapi as Gelbooru but answers with a bare list in an older layout"""
+    name = "safebooru"
+    default_base_url = "https://safebooru.org/index.php"
+    base_url_env = "SAFEBOORU_BASE_URL"
+    total_posts = 5_000_000
+
+    def query_tags(self, tags):
+        return tags  # Everything on Safebooru is meant to be safe; non-general posts are filtered after
+
+    def parse_posts(self, response):
+        if not response.text.strip():
+            return []  # Empty body when nothing matches
+        data = response.json()
+        if not isinstance(data, list):
+            return None
+        host = self.base_url.rsplit('/', 1)[0]
+        posts = []
+        for post in data:
+            image, directory = post.get('image'), post.get('directory')
+            file_url = post.get('file_url') or (f"{host}/images/{directory}/{image}" if image else '')
+            # Samples and thumbnails are always JPEGs named after the hash, whatever the original's format
+            stem = post.get('hash') or (image.rsplit('.', 1)[0] if image else None)
+            posts.append({
+                **post,
+                'md5': post.get('hash') or post.get('md5'),
+                'score': post.get('score') or 0,
+                'rating': 'general' if post.get('rating') in ('safe', 'general') else post.get('rating'),
+                'file_url': file_url,
+                'sample_url': post.get('sample_url') or (
+                    f"{host}/samples/{directory}/sample_{stem}.jpg" if post.get('sample') and stem else ''),
+                'preview_url': post.get('preview_url') or (
+                    f"{host}/thumbnails/{directory}/thumbnail_{stem}.jpg" if stem else ''),
+            })
+        return posts
+
+
+class DanbooruSearcher(GelbooruSearcher):
+    """Danbooru's posts.json, mapped onto Gelbooru's field names"""
+    name = "danbooru"
+    default_base_url = "https://danbooru.donmai.us/posts.json"
+    base_url_env = "DANBOORU_BASE_URL"
+    total_posts = 8_000_000
+    max_query_tags = 2  # Anonymous searches are limited to two tags
+
+    def query_tags(self, tags):
+        # No rating metatag so it cannot eat into the tag limit; non-general posts are filtered after
+        return tags[:self.max_query_tags]
+
+    def build_params(self, tag_string, limit, pid):
+        return {'tags': tag_string.replace('+', ' '), 'limit': limit, 'page': pid + 1}
+
+    def parse_posts(self, response):
+        data = response.json()
+        if not isinstance(data, list):
+            return None
+        return [{
+            'id': post.get('id'),
+            'md5': post.get('md5'),
+            'score': post.get('score'),
+            'rating': DANBOORU_RATINGS.get(post.get('rating'), post.get('rating')),
+            'width': post.get('image_width'),
+            'height': post.get('image_height'),
+            'tags': post.get('tag_string', ''),
+            'file_url': post.get('file_url'),
+            # large_file_url is an 850px sample for big images, else the original again
+            'sample_url': post.get('large_file_url') if post.get('large_file_url') != post.get('file_url') else None,
+            'preview_url': post.get('preview_file_url'),
+        } for post in data]  # Restricted posts come without URLs and are skipped as unusable later
+
+    def tag_url(self):
+        return self.base_url.rsplit('/', 1)[0] + "/tags.json"
+
+    def build_tag_params(self, tags):
+        return {'search[name_comma]': ','.join(tags), 'limit': len(tags)}
+
+    def parse_tags(self, response):
+        data = response.json()
+        if not isinstance(data, list):
+            return None
+        return [{'name': tag.get('name'), 'count': tag.get('post_count'), 'type': tag.get('category')} for tag in data]
+
+
+SOURCES = {
+    'gelbooru': GelbooruSearcher,
+    'safebooru': SafebooruSearcher,
+    'danbooru': DanbooruSearcher,
+}
+
+
+class SourceStats:
+    """Rolling latency of a source's complete searches, to decide when to hedge"""
+
+    def __init__(self, window=50):
+        self.latencies = deque(maxlen=window)
+        self.successes = 0
+        self.empty = 0
+        self.errors = 0
+
+    def percentile(self, quantile):
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * quantile), len(latencies) - 1)] if latencies else None
+
+    def snapshot(self):
+        p50, p90 = self.percentile(0.5), self.percentile(0.9)
+        return {
+            'searches': len(self.latencies),
+            'p50_latency': round(p50, 3) if p50 is not None else None,
+            'p90_latency': round(p90, 3) if p90 is not None else None,
+            'successes': self.successes,
+            'empty': self.empty,
+            'errors': self.errors,
+        }
+
+
+class HedgedSearch:
+    """Searches the fastest source first and hedges to the next one if it is slower than usual.
+
+    The hedge fires once the running search passes its source's latency percentile (clamped to
+    [min_delay, max_delay]), or straight away if it comes back empty or with only the generic
+    fallback. The first character match wins; a generic fallback only once every source is done.
+    """
+
+    def __init__(self, sources, hedge_quantile=0.9, min_delay=0.5, max_delay=5.0, cold_delay=2.0, min_samples=5):
+        self.sources = list(sources)
+        self.hedge_quantile = hedge_quantile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.cold_delay = cold_delay  # Threshold until a source has min_samples latencies
+        self.min_samples = min_samples
+        self._stats = {source.name: SourceStats() for source in self.sources}
+        self._lock = threading.Lock()
+
+    def hedge_delay(self, source):
+        with self._lock:
+            stats = self._stats[source.name]
+            if len(stats.latencies) < self.min_samples:
+                return self.cold_delay
+            return min(max(stats.percentile(self.hedge_quantile), self.min_delay), self.max_delay)
+
+    def ordered_sources(self):
+        """Configured order, but a source with a clearly lower median goes first"""
+        def median(source):
+            stats = self._stats[source.name]
+            return stats.percentile(0.5) if len(stats.latencies) >= self.min_samples else None
+
+        with self._lock:
+            known = [source for source in self.sources if median(source) is not None]
+            if not known:
+                return list(self.sources)
+            fastest = min(known, key=median)
+            return [fastest] + [source for source in self.sources if source is not fastest]
+
+    def _timed_search(self, source, tags, concurrent):
+        """(posts, matched tag subset) from one source, recording its latency"""
+        started = time.monotonic()
+        try:
+            posts, matched = source.search_plan(tags, concurrent=concurrent)
+        except Exception as e:
+            with self._lock:
+                self._stats[source.name].errors += 1
+            print(f"{source.name} search failed: {e}")
+            return [], None
+        with self._lock:
+            stats = self._stats[source.name]
+            stats.latencies.append(time.monotonic() - started)
+            if posts:
+                stats.successes += 1
+            else:
+                stats.empty += 1
+        return posts, matched
+
+    def find_post(self, tags, concurrent=True):
+        """First usable general-rated post from any source (random among its best), or None"""
+        posts = self.find_posts(tags, concurrent)
+        return random.choice(posts) if posts else None
+
+    @traced("hedged_search")
+    def find_posts(self, tags, concurrent=True):
+        """Top posts, best first, from whichever source returns usable results first, or []"""
+        pending_sources = self.ordered_sources()
+        executor = ThreadPoolExecutor(max_workers=len(pending_sources))
+        running = {}
+        generic = None  # (source, posts) of the first generic fallback, held back until every source is done
+        try:
+            while pending_sources or running:
+                if pending_sources:
+                    source = pending_sources.pop(0)
+                    if running:
+                        print(f"Hedging reference search to {source.name}")
+                        current_span().incr('hedges')
+                    running[submit(executor, self._timed_search, source, tags, concurrent)] = source
+                    timeout = self.hedge_delay(source) if pending_sources else None
+                else:
+                    timeout = None
+
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    source = running.pop(future)
+                    posts, matched = future.result()
+                    if posts and matched == GENERIC_FALLBACK:
+                        # Another source may still find the actual character
+                        generic = generic or (source, posts)
+                    elif posts:
+                        print(f"Using reference from {source.name}")
+                        current_span().set('source', source.name)
+                        return posts
+            if generic:
+                print(f"Using generic fallback reference from {generic[0].name}")
+                current_span().set('source', generic[0].name)
+                current_span().set('generic_fallback', True)
+                return generic[1]
+            return []
+        finally:
+            # Losing searches finish in the background; their latencies still feed the stats
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in self._stats.items()}
+
+
+def _configured_sources():
+    names = [name.strip() for name in os.environ.get("BOORU_SOURCES", "gelbooru,safebooru").split(',') if name.strip()]
+    return [SOURCES[name]() for name in names]
+
+
+# Shared so latency stats accumulate across requests; BOORU_SOURCES picks and orders the sources
+hedged_search = HedgedSearch(_configured_sources())
+
+
+def find_reference_post(tags, concurrent=True):
+    """Hedged counterpart of gelbooru.find_anime_character"""
+    posts = find_reference_posts(tags, concurrent)
+    return random.choice(posts) if posts else None
+
+
+def find_reference_posts(tags, concurrent=True):
+    """Every post find_reference_post may pick from, best first (for cache warming)"""
+    if isinstance(tags, str):
+        tags = [tag.strip() for tag in tags.split() if tag.strip()]
+    print(f"Searching {', '.join(source.name for source in hedged_search.sources)} for: {tags}")
+    return hedged_search.find_posts(tags, concurrent)
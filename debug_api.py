@@ -4,7 +4,7 @@ Debug script to examine actual Gelbooru API responses and understand
 the data structure, including ratings and available content.
 """
 
-import requests
+import http_session
 import json
 from pprint import pprint
 
@@ -32,7 +32,7 @@ def debug_gelbooru_api():
     }
     
     try:
-        response = requests.get(base_url, params=params, headers=headers, timeout=10)
+        response = http_session.get(base_url, params=params, headers=headers, timeout=10)
         response.raise_for_status()
         data = response.json()
         
@@ -85,7 +85,7 @@ def debug_gelbooru_api():
     }
     
     try:
-        response = requests.get(base_url, params=params_with_rating, headers=headers, timeout=10)
+        response = http_session.get(base_url, params=params_with_rating, headers=headers, timeout=10)
         response.raise_for_status()
         data = response.json()
         
@@ -134,7 +134,7 @@ def debug_gelbooru_api():
         }
         
         try:
-            response = requests.get(base_url, params=params, headers=headers, timeout=10)
+            response = http_session.get(base_url, params=params, headers=headers, timeout=10)
             response.raise_for_status()
             data = response.json()
             
@@ -167,7 +167,7 @@ def debug_gelbooru_api():
     }
     
     try:
-        response = requests.get(base_url, params=params_safe, headers=headers, timeout=10)
+        response = http_session.get(base_url, params=params_safe, headers=headers, timeout=10)
         response.raise_for_status()
         data = response.json()
         
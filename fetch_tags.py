@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Download Danbooru's tag list and aliases into the CSV dump tag_index.py reads, then build its index.
+
+    python fetch_tags.py [--min-count 50] [--output data/tags.csv]
+
+The dump has one tag per line as name,category,post_count,"alias1,alias2" (the layout of the
+common booru autocomplete CSVs, which can be dropped in at TAG_DUMP_PATH instead).
+"""
+
+import argparse
+import csv
+import os
+from urllib.parse import urlparse
+
+import http_session
+from ratelimit import rate_limiter
+from tag_index import TAG_DUMP_PATH, TagIndex
+
+PAGE_SIZE = 1000
+MAX_PAGES = 1000  # Danbooru refuses numbered pages past 1000
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+
+
+def danbooru_root():
+    # DANBOORU_BASE_URL points at posts.json, so a mirror or stub_server.py works here too
+    base_url = os.environ.get("DANBOORU_BASE_URL", "https://danbooru.donmai.us/posts.json")
+    return base_url.rsplit('/', 1)[0]
+
+
+def fetch_pages(url, params):
+    """Yield the rows of every page of a Danbooru listing until a short page comes back"""
+    rate_limit_key = f"host:{urlparse(url).hostname}"
+    for page in range(1, MAX_PAGES + 1):
+        rate_limiter.acquire(rate_limit_key)
+        response = http_session.get(url, params={**params, 'limit': PAGE_SIZE, 'page': page}, headers=HEADERS, timeout=30)
+        rate_limiter.observe(rate_limit_key, response)
+        response.raise_for_status()
+        rows = response.json()
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            return
+
+
+def fetch_tags(min_count):
+    """{name: (category, post_count)} for every tag used on at least min_count posts"""
+    tags = {}
+    params = {'search[post_count]': f">={min_count}", 'search[order]': 'count', 'search[hide_empty]': 'yes'}
+    for tag in fetch_pages(danbooru_root() + "/tags.json", params):
+        tags[tag['name']] = (tag.get('category', 0), tag.get('post_count', 0))
+        if len(tags) % 10000 == 0:
+            print(f"Fetched {len(tags)} tags")
+    return tags
+
+
+def fetch_aliases(tags):
+    """{canonical name: [aliases]} for active aliases pointing at a known tag"""
+    aliases = {}
+    for alias in fetch_pages(danbooru_root() + "/tag_aliases.json", {'search[status]': 'active'}):
+        if alias.get('consequent_name') in tags:
+            aliases.setdefault(alias['consequent_name'], []).append(alias['antecedent_name'])
+    return aliases
+
+
+def write_dump(path, tags, aliases):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        for name, (category, count) in tags.items():
+            writer.writerow([name, category, count, ','.join(aliases.get(name, []))])
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the booru tag dump used for tag validation and fallback planning")
+    parser.add_argument("--output", default=TAG_DUMP_PATH, help="CSV dump path (TAG_DUMP_PATH)")
+    parser.add_argument("--min-count", type=int, default=50, help="skip tags used on fewer posts")
+    args = parser.parse_args()
+
+    tags = fetch_tags(args.min_count)
+    aliases = fetch_aliases(tags)
+    write_dump(args.output, tags, aliases)
+    print(f"Wrote {len(tags)} tags and {sum(map(len, aliases.values()))} aliases to {args.output}")
+    TagIndex.load(args.output)  # Build the .idx now rather than on the first visitor's search
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,343 @@
-import requests
+import http_session
+import os
 import random
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from posts import Post, PostPage, top_posts
+from ratelimit import rate_limiter
+from search_cache import search_cache
+from tag_counts import IDENTITY_CATEGORIES, category_id, tag_counts
+from tag_index import CHARACTER, TagInfo
+from tracing import span, submit, traced
+
+# Last resort when no subset of the character's tags matches anything
+GENERIC_FALLBACK = ["1girl"]
 
 class GelbooruSearcher:
-    def __init__(self):
-        self.base_url = "https://gelbooru.com/index.php"
+    """Gelbooru search, and the base for other booru sources (see booru_sources.py).
+
+    A source overrides name, default_base_url, base_url_env and the query_tags/build_params/
+    parse_posts (and tag_url/build_tag_params/parse_tags) hooks; paging, caching, ranking and
+    tag fallback are shared.
+    """
+    name = "gelbooru"
+    default_base_url = "https://gelbooru.com/index.php"
+    base_url_env = "GELBOORU_BASE_URL"
+    total_posts = 10_000_000  # Rough size of the site, for estimating how many posts a tag set matches
+
+    def __init__(self, cache=None, base_url=None, scorer=None, counts=None):
+        # GELBOORU_BASE_URL (etc.) points searches at a mirror or the local stub_server.py
+        self.base_url = base_url or os.environ.get(self.base_url_env, self.default_base_url)
         self.headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+        self.cache = cache if cache is not None else search_cache
+        # Shared token bucket for this host, across threads and Streamlit processes
+        self.rate_limit_key = f"host:{urlparse(self.base_url).hostname}"
+        self.min_usable_posts = 5  # Keep paging until this many posts have a file_url
+        self.scorer = scorer  # post -> sortable key for ranking; None uses POST_SCORER (see posts.py)
+        self.top_k = 5
+        self.counts = counts if counts is not None else tag_counts
+        self.min_expected_posts = 1.0  # Tag subsets estimated to match fewer posts are skipped
+        self.planned_fanout = 2  # Subsets probed at once when post counts planned the fallback
 
-    def search_images(self, tags, limit=100):
+    def search_images(self, tags, limit=100, use_cache=True, pid=0):
         """Search for images with given tags"""
         if isinstance(tags, str):
             tags = [tags]
 
         # Normalize tags: lowercase, replace spaces with underscores
         tags = [tag.strip().lower().replace(' ', '_') for tag in tags if tag.strip()]
-        tag_string = '+'.join(tags)
+        tag_string = '+'.join(self.query_tags(tags))
 
-        params = {
+        with span("search_images", source=self.name, tags=len(tags), pid=pid) as trace:
+            # Keyed on what is actually sent: Danbooru only sends the first tags of the given order
+            cache_key = self.cache.make_key(self.query_tags(tags), limit, pid, self.name)
+            if use_cache:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    print(f"Cache hit for tags {tags}: {len(cached)} general-rated posts")
+                    trace.set('cache_hit', True)
+                    trace.set('posts', len(cached))
+                    return cached
+            return self._fetch_posts(tags, tag_string, limit, pid, cache_key, trace)
+
+    def query_tags(self, tags):
+        """Tags as sent to the server"""
+        # Let the server drop non-general posts instead of downloading and discarding them
+        return tags if any(tag.startswith('rating:') for tag in tags) else tags + ['rating:general']
+
+    def build_params(self, tag_string, limit, pid):
+        return {
             'page': 'dapi',
             's': 'post',
             'q': 'index',
             'tags': tag_string,
             'limit': limit,
+            'pid': pid,
             'json': '1'
         }
+
+    def parse_posts(self, response):
+        """Raw post dicts in Gelbooru's field layout; [] for no results, None for an unexpected format"""
+        data = response.json()
+        # Handle gelbooru JSON format
+        if isinstance(data, dict) and 'post' in data:
+            return data['post']
+        # Gelbooru omits the 'post' key entirely when nothing matches
+        if isinstance(data, dict) and '@attributes' in data:
+            return []
+        return None
+
+    def tag_url(self):
+        return self.base_url
+
+    def build_tag_params(self, tags):
+        return {'page': 'dapi', 's': 'tag', 'q': 'index', 'names': ' '.join(tags), 'limit': len(tags), 'json': '1'}
+
+    def parse_tags(self, response):
+        """Raw tag dicts ('name', 'count', 'type'); None for an unexpected format"""
+        if not response.text.strip():
+            return []
+        data = response.json()
+        if isinstance(data, dict):
+            return data.get('tag', []) if ('tag' in data or '@attributes' in data) else None
+        return data if isinstance(data, list) else None
+
+    def fetch_tag_counts(self, tags):
+        """{tag: TagInfo} from the site's tag API in one request; None if the answer can't be used"""
+        rate_limiter.acquire(self.rate_limit_key)
+        response = http_session.get(self.tag_url(), params=self.build_tag_params(tags), headers=self.headers, timeout=10)
+        rate_limiter.observe(self.rate_limit_key, response)
+        response.raise_for_status()
+        raw_tags = self.parse_tags(response)
+        if raw_tags is None:
+            return None
+        infos = {}
+        for tag in raw_tags:
+            name = tag.get('name')
+            if name:
+                infos[name] = TagInfo(name, int(tag.get('count') or 0), category_id(tag.get('type')))
+        return infos
+
+    def _fetch_posts(self, tags, tag_string, limit, pid, cache_key, trace):
+        """Network half of search_images"""
+        params = self.build_params(tag_string, limit, pid)
         try:
-            response = requests.get(self.base_url, params=params, headers=self.headers, timeout=10)
+            rate_limiter.acquire(self.rate_limit_key)
+            response = http_session.get(self.base_url, params=params, headers=self.headers, timeout=10)
+            rate_limiter.observe(self.rate_limit_key, response)
             response.raise_for_status()  # Raise error for bad status codes
-            data = response.json()
-
-            # Handle gelbooru JSON format
-            if isinstance(data, dict) and 'post' in data:
-                posts = data['post']
-                # Filter to only return general-rated posts
-                general_posts = [post for post in posts if post.get('rating') == 'general']
-                print(f"Filtered {len(general_posts)} general-rated posts from {len(posts)} total posts")
-                return general_posts
-            return []  # Fail-safe for unexpected formats
+            trace.set('bytes', len(response.content))
+            trace.set('retries', len(response.raw.retries.history) if getattr(response.raw, 'retries', None) else 0)
+            posts = self.parse_posts(response)
+            if posts is None:
+                return []  # Fail-safe for unexpected formats
+
+            # Filter to only return general-rated posts, parsed once into compact records
+            general_posts = PostPage([Post.from_dict(post) for post in posts if post.get('rating') == 'general'],
+                                     raw_count=len(posts))
+            print(f"Filtered {len(general_posts)} general-rated posts from {len(posts)} total posts")
+            trace.set('posts', len(general_posts))
+            self.cache.set(cache_key, general_posts)
+            return general_posts
         except Exception as e:
-            print(f"Error searching Gelbooru: {e}")
+            print(f"Error searching {self.name}: {e}")
+            trace.set('error', repr(e)[:200])
             return []
 
-    def get_best_image_url(self, posts):
-        """Get the best quality image URL from posts"""
+    def iter_pages(self, tags, page_size=100, max_pages=5):
+        """Lazily page through results by pid, yielding the usable (file_url) posts of each page"""
+        for pid in range(max_pages):
+            posts = self.search_images(tags, limit=page_size, pid=pid)
+            yield [post for post in posts if post.file_url]
+            # Compare what the server sent, not what survived the rating/file_url filters
+            if getattr(posts, 'raw_count', len(posts)) < page_size:
+                return  # Last page
+
+    def iter_posts(self, tags, want=None, page_size=100, max_pages=5):
+        """Yield usable general-rated posts one at a time, stopping after `want` of them"""
+        found = 0
+        for page in self.iter_pages(tags, page_size, max_pages):
+            for post in page:
+                yield post
+                found += 1
+                if want and found >= want:
+                    return
+
+    def collect_posts(self, tags, want=None, page_size=100, max_pages=5):
+        """Fetch whole pages until at least `want` usable posts are in hand, for ranking"""
+        want = want or self.min_usable_posts
+        usable = []
+        for page in self.iter_pages(tags, page_size, max_pages):
+            usable.extend(page)
+            if len(usable) >= want:
+                break
+        return usable
+
+    def get_best_post(self, posts):
+        """Pick one of the best scoring usable posts"""
         if not posts:
             return None
 
-        # Filter valid posts with file_url and general rating only
-        valid_posts = [post for post in posts if post.get('file_url') and post.get('rating') == 'general']
-        if not valid_posts:
-            return None
+        # Top-k by heap instead of sorting every post, then pick randomly among them for variety
+        best = top_posts(posts, self.top_k, self.scorer)
+        return random.choice(best) if best else None
 
-        # Sort by score (descending) for best quality
-        valid_posts.sort(key=lambda x: int(x.get('score', 0)), reverse=True)
+    def get_best_image_url(self, posts):
+        """Get the best quality image URL from posts"""
+        post = self.get_best_post(posts)
+        return post.file_url if post else None
 
-        # Pick randomly from top 5 results
-        top_posts = valid_posts[:5]
-        return random.choice(top_posts).get('file_url') if top_posts else None
+    def fallback_candidates(self, tags, max_attempts=None):
+        """List the tag subsets search_with_fallback tries, most specific first"""
+        return self._fallback_plan(tags, max_attempts)[0]
 
-    def search_with_fallback(self, tags, max_attempts=None):
-        """Search for images, gradually reducing tags if no results found"""
+    def _fallback_plan(self, tags, max_attempts=None):
+        """(tag subsets to try, whether post counts planned them)"""
         # Convert to list and normalize tags
         if isinstance(tags, str):
             tags = tags.split()
         current_tags = [tag.strip().lower().replace(' ', '_') for tag in tags]
 
+        plain_tags = [tag for tag in current_tags if ':' not in tag]
+        infos = self.counts.lookup(self, plain_tags) if plain_tags else {}
+        if plain_tags and all(tag in infos for tag in plain_tags):
+            candidates = self.planned_candidates(current_tags, infos)
+            return (candidates[:max_attempts] if max_attempts else candidates), True
+
+        # Without counts, trust the LLM's order and drop from the end
         # Set max attempts to number of tags + 1 (for the 1girl fallback)
         if max_attempts is None:
             max_attempts = len(current_tags) + 2  # +1 for 1girl fallback, +1 extra attempt
 
-        for attempt in range(max_attempts):
-            if not current_tags:
-                break
-
-            print(f"Searching with tags: {current_tags}")
-            posts = self.search_images(current_tags)
-            # Additional safety check: filter out non-general rated posts
-            general_posts = [post for post in posts if post.get('rating') == 'general']
-            print(f"Found {len(general_posts)} general-rated posts out of {len(posts)} total")
-            if general_posts:
-                url = self.get_best_image_url(general_posts)
-                if url:
-                    return url
+        candidates = []
+        while current_tags and len(candidates) < max_attempts:
+            candidates.append(list(current_tags))
 
             # Remove least important tag (last element)
             if len(current_tags) > 1:
-                current_tags.pop()
+                current_tags = current_tags[:-1]
+            elif current_tags != GENERIC_FALLBACK:
+                current_tags = list(GENERIC_FALLBACK)  # Final fallback tag
             else:
-                if current_tags and current_tags[0] != "1girl":
-                    current_tags = ["1girl"]  # Final fallback tag
-                else:
-                    break  # Already tried 1girl with no results
+                break  # Already tried 1girl
+        return candidates, False
+
+    def planned_candidates(self, tags, infos):
+        """Tag subsets ordered by post counts: descriptive tags go before the character and series,
+        the most restrictive first, and subsets estimated to match nothing are skipped"""
+        metatags = [tag for tag in tags if ':' in tag]
+        # Tags with no posts on this source can only make a search come back empty
+        present = [tag for tag in tags if ':' not in tag and infos[tag].count > 0]
+        identity = [tag for tag in present if infos[tag].category in IDENTITY_CATEGORIES]
+        descriptive = [tag for tag in present if tag not in identity]
+        # Series before character, and the broader of two names first
+        drop_order = (sorted(descriptive, key=lambda tag: infos[tag].count)
+                      + sorted(identity, key=lambda tag: (infos[tag].category == CHARACTER, -infos[tag].count)))
+
+        candidates = []
+        kept = list(present)
+        for tag in drop_order:
+            # Most important first, so sources that cap the query length keep the identity tags
+            candidates.append(metatags + sorted(kept, key=drop_order.index, reverse=True))
+            kept.remove(tag)
+        if GENERIC_FALLBACK not in candidates:
+            candidates.append(list(GENERIC_FALLBACK))  # Final fallback tag
+
+        # Removing tags only widens a search, so start at the first subset likely to have results
+        for i, candidate in enumerate(candidates[:-1]):
+            if self.estimate_matches(candidate, infos) >= self.min_expected_posts:
+                return candidates[i:]
+        return candidates[-1:]
+
+    def estimate_matches(self, tags, infos):
+        """Rough post count for a tag set: the rarest name, or tag, narrowed by each descriptive tag as if independent"""
+        counted = [infos[tag] for tag in tags if tag in infos]
+        if not counted:
+            return float(self.total_posts)
+        identity = [info for info in counted if info.category in IDENTITY_CATEGORIES]
+        # Names imply each other (a character implies its series), so only the rarest one counts
+        base = min(identity or counted, key=lambda info: info.count)
+        estimate = float(base.count)
+        for info in counted:
+            if info is not base and info.category not in IDENTITY_CATEGORIES:
+                estimate *= min(info.count / self.total_posts, 1.0)
+        return estimate
 
-            time.sleep(0.1)  # Respect API rate limits
+    def _top_posts_from(self, posts):
+        # Additional safety check: filter out non-general rated posts
+        general_posts = [post for post in posts if post.rating == 'general']
+        print(f"Found {len(general_posts)} general-rated posts out of {len(posts)} total")
+        return top_posts(general_posts, self.top_k, self.scorer)
 
-        return None  # No results after all attempts
+    def search_with_fallback(self, tags, max_attempts=None, concurrent=False, max_workers=8):
+        """Search for images, gradually reducing tags if no results found"""
+        post = self.find_post_with_fallback(tags, max_attempts, concurrent, max_workers)
+        return post.file_url if post else None
+
+    def find_post_with_fallback(self, tags, max_attempts=None, concurrent=False, max_workers=8):
+        """Like search_with_fallback, but returns the whole post (md5, sample/preview urls, ...)"""
+        top = self.find_top_posts_with_fallback(tags, max_attempts, concurrent, max_workers)
+        # Pick randomly among the best for variety
+        return random.choice(top) if top else None
+
+    def find_top_posts_with_fallback(self, tags, max_attempts=None, concurrent=False, max_workers=8):
+        """The top_k posts (best first) for the most specific tag subset with results, or []"""
+        return self.search_plan(tags, max_attempts, concurrent, max_workers)[0]
+
+    @traced("search_with_fallback")
+    def search_plan(self, tags, max_attempts=None, concurrent=False, max_workers=8):
+        """(top posts, the tag subset they matched) for the most specific subset with results, or ([], None)"""
+        candidates, planned = self._fallback_plan(tags, max_attempts)
+        if concurrent and len(candidates) > 1:
+            # A planned fallback usually hits on its first subset, so only probe a couple at a
+            # time instead of spending a search on every subset
+            window = min(self.planned_fanout, max_workers) if planned else len(candidates)
+            for start in range(0, len(candidates), window):
+                top, matched = self._search_concurrent(candidates[start:start + window], max_workers)
+                if top:
+                    return top, matched
+            return [], None
+
+        # Pacing comes from the shared rate limiter in search_images, not a fixed sleep
+        for current_tags in candidates:
+            print(f"Searching with tags: {current_tags}")
+            top = self._top_posts_from(self.collect_posts(current_tags))
+            if top:
+                return top, current_tags
+
+        return [], None  # No results after all attempts
+
+    def _search_concurrent(self, candidates, max_workers):
+        """Probe every tag subset at once and keep the most specific one with results"""
+        if len(candidates) == 1:
+            print(f"Searching with tags: {candidates[0]}")
+            top = self._top_posts_from(self.collect_posts(candidates[0]))
+            return (top, candidates[0]) if top else ([], None)
+        print(f"Searching {len(candidates)} tag subsets concurrently: {candidates}")
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(candidates)))
+        futures = {submit(executor, self.collect_posts, tags): i for i, tags in enumerate(candidates)}
+        finished = [False] * len(candidates)
+        best = [None] * len(candidates)
+        try:
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    best[index] = self._top_posts_from(future.result())
+                except Exception as e:
+                    print(f"Search for {candidates[index]} failed: {e}")
+                finished[index] = True
+
+                # A subset wins once every more specific subset has come back empty
+                for i in range(len(candidates)):
+                    if not finished[i]:
+                        break
+                    if best[i]:
+                        print(f"Using results for tags: {candidates[i]}")
+                        return best[i], candidates[i]
+            return [], None  # No results for any subset
+        finally:
+            # Drop queued probes; in-flight ones finish in the background and are ignored
+            executor.shutdown(wait=False, cancel_futures=True)
 
 def validate_rating(posts):
     """Validate and log ratings of posts for debugging"""
@@ -106,8 +349,13 @@ def validate_rating(posts):
     print(f"Rating breakdown: {ratings}")
     return [post for post in posts if post.get('rating') == 'general']
 
-def search_anime_character(tags):
+def search_anime_character(tags, concurrent=True):
     """Main function to search for anime character images"""
+    post = find_anime_character(tags, concurrent)
+    return post.file_url if post else None
+
+def find_anime_character(tags, concurrent=True):
+    """Search for an anime character and return the chosen post"""
     searcher = GelbooruSearcher()
 
     # Add common anime tags if not present
@@ -122,4 +370,4 @@ def search_anime_character(tags):
 
     print(f"Searching for anime character with tags: {tag_list}")
     print("Note: Only general-rated images will be used")
-    return searcher.search_with_fallback(tag_list)
+    return searcher.find_post_with_fallback(tag_list, concurrent=concurrent)
@@ -0,0 +1,97 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = 10
+POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+CHUNK_SIZE = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class DownloadRejected(Exception):
+    """A streamed download was refused for its size or content type"""
+
+
+def build_session(pool_size=POOL_SIZE, retries=3, backoff_factor=0.3, backoff_jitter=0.2):
+    """Create a keep-alive session with pooled connections and jittered retry on 429/5xx"""
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_jitter,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """Return the process-wide session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def get(url, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """requests.get replacement that goes through the shared pooled session"""
+    return get_session().get(url, timeout=timeout, **kwargs)
+
+
+def fetch_bytes(url, max_bytes, content_types=('image/',), timeout=DEFAULT_TIMEOUT, **kwargs):
+    """Stream url into memory, refusing bodies over max_bytes or of an unexpected Content-Type early"""
+    with get_session().get(url, timeout=timeout, stream=True, **kwargs) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_types and content_type and not content_type.startswith(tuple(content_types)):
+            raise DownloadRejected(f"unexpected Content-Type {content_type} for {url}")
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise DownloadRejected(f"{url} is {int(length)} bytes, over the {max_bytes} byte limit")
+
+        # Content-Length can be missing or wrong, so the ceiling is enforced while reading too
+        data = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            data += chunk
+            if len(data) > max_bytes:
+                raise DownloadRejected(f"{url} exceeded the {max_bytes} byte limit")
+        return bytes(data)
+
+
+def connection_stats():
+    """Per-host connection reuse stats for the shared session"""
+    stats = {}
+    if _session is None:
+        return stats
+    seen = set()
+    for adapter in _session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}"
+            entry = stats.setdefault(host, {'requests': 0, 'connections': 0, 'reused': 0})
+            entry['requests'] += pool.num_requests
+            entry['connections'] += pool.num_connections
+            entry['reused'] += max(pool.num_requests - pool.num_connections, 0)
+    return stats
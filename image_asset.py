@@ -0,0 +1,85 @@
+import base64
+import hashlib
+import io
+from functools import cached_property
+
+from PIL import Image
+
+FORMAT_MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp', 'GIF': 'image/gif'}
+
+
+class ImageAsset:
+    """Immutable image bytes; base64, PIL, size and hashes are derived lazily and only once"""
+
+    def __init__(self, data, mime_type=None, width=None, height=None):
+        self.__dict__['_data'] = bytes(data)  # No copy when data is already bytes
+        if mime_type:
+            self.__dict__['mime_type'] = mime_type
+        if width and height:
+            self.__dict__['size'] = (width, height)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ImageAsset is immutable")
+
+    @classmethod
+    def from_b64(cls, b64, mime_type=None):
+        return cls(base64.b64decode(b64), mime_type)
+
+    @property
+    def data(self):
+        return self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"ImageAsset({len(self._data)} bytes, {self.__dict__.get('mime_type', '?')})"
+
+    @cached_property
+    def b64(self):
+        return base64.b64encode(self._data).decode('utf-8')
+
+    @cached_property
+    def sha1(self):
+        return hashlib.sha1(self._data).hexdigest()
+
+    @cached_property
+    def md5(self):
+        return hashlib.md5(self._data).hexdigest()
+
+    @cached_property
+    def _header(self):
+        # Image.open only parses the header; pixels are not decoded here
+        with Image.open(io.BytesIO(self._data)) as image:
+            return image.format, image.size
+
+    @cached_property
+    def mime_type(self):
+        return FORMAT_MIME_TYPES.get(self._header[0], 'application/octet-stream')
+
+    @cached_property
+    def size(self):
+        return self._header[1]
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @cached_property
+    def image(self):
+        """Decoded PIL image, shared by every caller - copy() it before modifying"""
+        image = Image.open(io.BytesIO(self._data))
+        image.load()
+        return image
+
+    def as_png(self):
+        """PNG bytes of this image, reusing the original bytes when they already are PNG"""
+        if self.mime_type == 'image/png':
+            return self._data
+        buffer = io.BytesIO()
+        self.image.save(buffer, format='PNG')
+        return buffer.getvalue()
@@ -0,0 +1,222 @@
+import io
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+from image_asset import ImageAsset
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # Face detection is optional; without OpenCV we crop to the detailed region instead
+    cv2 = None
+    np = None
+
+
+class Profile:
+    __slots__ = ('name', 'max_side', 'format', 'quality', 'crop_to_subject')
+
+    def __init__(self, name, max_side, format='JPEG', quality=85, crop_to_subject=False):
+        self.name = name
+        self.max_side = max_side
+        self.format = format
+        self.quality = quality
+        self.crop_to_subject = crop_to_subject
+
+
+# Per-model input sizes: gemma-3 tiles images at 896px, Gemini/gpt-image work well around 1024px
+PROFILES = {
+    'vlm': Profile('vlm', max_side=896, quality=85, crop_to_subject=True),
+    'gemini': Profile('gemini', max_side=1024, quality=90),
+    'openai': Profile('openai', max_side=1024, quality=90),
+    'preview': Profile('preview', max_side=512, format='WEBP', quality=80),
+}
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+# Refuse to decode anything bigger; a booru original is rarely over 30 megapixels
+MAX_DECODE_PIXELS = 60_000_000
+
+
+_face_cascade = None
+
+
+def _detect_face(image):
+    global _face_cascade
+    if cv2 is None:
+        return None
+    if _face_cascade is None:
+        _face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    gray = np.asarray(image.convert('L'))
+    faces = _face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(48, 48))
+    if len(faces) == 0:
+        return None
+    x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+    return int(x), int(y), int(w), int(h)
+
+
+def _span(profile, share):
+    """(start, end) of the middle part of a 1-D energy profile holding all but share of it at each end"""
+    total = sum(profile)
+    start, seen = 0, 0.0
+    while start < len(profile) - 1 and seen + profile[start] <= total * share:
+        seen += profile[start]
+        start += 1
+    end, seen = len(profile), 0.0
+    while end > start + 1 and seen + profile[end - 1] <= total * share:
+        seen += profile[end - 1]
+        end -= 1
+    return start, end
+
+
+def _detail_box(image, share=0.1, margin=0.15, size=128):
+    """Box around where the edges are: a person in front of a plain wall or booth backdrop.
+
+    Edge strength is averaged per column and per row on a thumbnail, the outer share of it
+    trimmed from each side, and the rest padded by margin. None for an image without detail.
+    """
+    small = image.convert('L')
+    small.thumbnail((size, size))
+    edges = small.filter(ImageFilter.FIND_EDGES).crop((1, 1, small.width - 1, small.height - 1))
+    columns = list(edges.resize((edges.width, 1), Image.Resampling.BOX).getdata())
+    rows = list(edges.resize((1, edges.height), Image.Resampling.BOX).getdata())
+    if not sum(columns):
+        return None
+    (left, right), (top, bottom) = _span(columns, share), _span(rows, share)
+
+    # Back to full-size coordinates (the 1px edge crop included), with some room around the subject
+    scale_x, scale_y = image.width / small.width, image.height / small.height
+    pad_x, pad_y = (right - left) * margin, (bottom - top) * margin
+    return (max(int((left + 1 - pad_x) * scale_x), 0), max(int((top + 1 - pad_y) * scale_y), 0),
+            min(int((right + 1 + pad_x) * scale_x), image.width), min(int((bottom + 1 + pad_y) * scale_y), image.height))
+
+
+def subject_box(image):
+    """Region worth keeping: head and shoulders around the largest face, else the detailed region"""
+    face = _detect_face(image)
+    if face is not None:
+        x, y, w, h = face
+        # Keep hair, shoulders and some background so the VLM can still describe pose and setting
+        left = max(x - int(1.5 * w), 0)
+        right = min(x + w + int(1.5 * w), image.width)
+        top = max(y - int(1.0 * h), 0)
+        bottom = min(y + h + int(2.5 * h), image.height)
+        return left, top, right, bottom
+
+    # Trim flat letterbox/page borders, common on booru scans and screenshots
+    rgb = image.convert('RGB')
+    background = Image.new('RGB', rgb.size, rgb.getpixel((0, 0)))
+    diff = ImageChops.difference(rgb, background).convert('L').point(lambda value: 255 if value > 16 else 0)
+    box = diff.getbbox()
+    if box is not None:
+        image = image.crop(box)
+    # A webcam photo has no flat border, so also narrow it down to where the detail is
+    detail = _detail_box(image)
+    if box is None or detail is None:
+        return box or detail
+    return box[0] + detail[0], box[1] + detail[1], box[0] + detail[2], box[1] + detail[3]
+
+
+def _open(data, max_side):
+    image = Image.open(io.BytesIO(data))
+    if image.format == 'JPEG':
+        image.draft('RGB', (max_side, max_side))  # Let libjpeg decode at a reduced scale
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        # Flatten transparency onto white; JPEG has no alpha channel
+        rgba = image.convert('RGBA')
+        flattened = Image.new('RGB', rgba.size, (255, 255, 255))
+        flattened.paste(rgba, mask=rgba.getchannel('A'))
+        image = flattened
+    return image
+
+
+def shrink(data, max_side, quality=92):
+    """(bytes, long side, extension) of the image scaled down to max_side, or None if it already fits.
+
+    JPEGs are decoded at a reduced scale and the rest box-reduced before resampling,
+    so the full-resolution bitmap is never held in memory for JPEGs and only briefly otherwise.
+    """
+    image = Image.open(io.BytesIO(data))
+    if image.width * image.height > MAX_DECODE_PIXELS:
+        raise ValueError(f"refusing to decode a {image.width}x{image.height} image")
+    if max(image.size) <= max_side:
+        return None
+    if image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')  # First frame of a GIF
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    image = ImageOps.exif_transpose(image)
+
+    buffer = io.BytesIO()
+    if image.mode in ('RGBA', 'LA'):
+        image.save(buffer, format='PNG', optimize=True)
+        extension = '.png'
+    else:
+        image.convert('RGB').save(buffer, format='JPEG', quality=quality)
+        extension = '.jpg'
+    return buffer.getvalue(), max(image.size), extension
+
+
+def _process(asset, profile):
+    # Already small enough and in the right format: hand back the same bytes untouched
+    if (not profile.crop_to_subject and asset.mime_type == MIME_TYPES[profile.format]
+            and max(asset.size) <= profile.max_side):
+        return asset
+
+    image = _open(asset.data, profile.max_side)
+    if profile.crop_to_subject:
+        box = subject_box(image)
+        if box and (box[2] - box[0]) * (box[3] - box[1]) < image.width * image.height:
+            image = image.crop(box)
+    image.thumbnail((profile.max_side, profile.max_side), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    if profile.format == 'JPEG':
+        image.convert('RGB').save(buffer, format='JPEG', quality=profile.quality, optimize=True, progressive=True)
+    elif profile.format == 'WEBP':
+        image.save(buffer, format='WEBP', quality=profile.quality, method=4)
+    else:
+        image.save(buffer, format=profile.format, optimize=True)
+    return ImageAsset(buffer.getvalue(), MIME_TYPES[profile.format], image.width, image.height)
+
+
+class ImageProcessor:
+    """Downscales, crops and re-encodes images for a model profile, caching results by input hash"""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def process(self, asset, profile='vlm'):
+        """ImageAsset prepared for profile; accepts an ImageAsset or raw bytes"""
+        if not isinstance(asset, ImageAsset):
+            asset = ImageAsset(asset)
+        if isinstance(profile, str):
+            profile = PROFILES[profile]
+        key = (asset.sha1, profile.name)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+        result = _process(asset, profile)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = result
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        print(f"Pre-processed image for {profile.name}: {len(asset)} -> {len(result)} bytes "
+              f"({result.width}x{result.height} {result.mime_type})")
+        return result
+
+
+image_processor = ImageProcessor()
+
+
+def prepare_image(asset, profile='vlm'):
+    """Shorthand for image_processor.process"""
+    return image_processor.process(asset, profile)
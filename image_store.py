@@ -0,0 +1,194 @@
+import glob
+import hashlib
+import os
+import threading
+
+import requests
+
+import http_session
+from image_processor import shrink
+from posts import int_or_zero
+
+# Long side the VLM/generation stages actually need from the reference image
+REFERENCE_TARGET_SIDE = int(os.environ.get("REFERENCE_TARGET_SIDE", 1024))
+
+# Gelbooru samples are 850px wide and previews 250px when the post doesn't give dimensions
+DEFAULT_VARIANT_SIDES = {'preview': 250, 'sample': 850}
+
+# Hard ceiling per download; a bigger original falls back to the post's sample
+REFERENCE_MAX_BYTES = int(os.environ.get("REFERENCE_MAX_BYTES", 20 * 1024 * 1024))
+
+
+def post_variants(post):
+    """(long_side, kind, url) for each downloadable variant of a post, smallest first"""
+    variants = []
+    for kind, prefix in (('preview', 'preview_'), ('sample', 'sample_')):
+        url = post.get(f'{prefix}url')
+        if not url:
+            continue
+        side = max(int_or_zero(post.get(f'{prefix}width')), int_or_zero(post.get(f'{prefix}height')))
+        variants.append((side or DEFAULT_VARIANT_SIDES[kind], kind, url))
+    if post.get('file_url'):
+        side = max(int_or_zero(post.get('width')), int_or_zero(post.get('height')))
+        variants.append((side or 1 << 30, 'file', post['file_url']))
+    variants.sort(key=lambda variant: variant[0])
+    return variants
+
+
+def choose_variant(post, target_side=REFERENCE_TARGET_SIDE):
+    """Smallest variant whose long side covers target_side, else the largest there is"""
+    variants = post_variants(post)
+    if not variants:
+        return None
+    for variant in variants:
+        if variant[0] >= target_side:
+            return variant
+    return variants[-1]
+
+
+class ImageStore:
+    """Content-addressed on-disk cache of reference images, keyed by post MD5 and evicted LRU by size"""
+
+    def __init__(self, directory="cache/images", max_bytes=256 * 1024 * 1024, max_download_bytes=REFERENCE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_download_bytes = max_download_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.bytes_downloaded = 0
+
+    @staticmethod
+    def post_key(post):
+        if post.get('md5'):
+            return post['md5'].lower()
+        # Sources without an md5 get keyed by their original URL instead
+        return hashlib.md5(post.get('file_url', '').encode('utf-8')).hexdigest()
+
+    def _path(self, key, side, extension):
+        return os.path.join(self.directory, key[:2], f"{key}_{side}{extension}")
+
+    def _cached(self, key, target_side):
+        """(side, path) of the best cached variant: smallest covering target_side, else the largest"""
+        variants = []
+        for path in glob.glob(os.path.join(self.directory, key[:2], f"{key}_*")):
+            if not path.endswith('.tmp'):
+                side = int_or_zero(os.path.basename(path).rsplit('_', 1)[1].split('.')[0])
+                variants.append((side, path))
+        if not variants:
+            return None
+        covering = [variant for variant in variants if variant[0] >= target_side]
+        return min(covering) if covering else max(variants)
+
+    def get(self, post, target_side=REFERENCE_TARGET_SIDE):
+        """Image bytes for post, from disk when possible, else downloading the smallest adequate variant"""
+        variant = choose_variant(post, target_side)
+        if variant is None:
+            return None
+        side, kind, url = variant
+        key = self.post_key(post)
+
+        cached = self._cached(key, target_side)
+        if cached is not None and cached[0] >= min(side, target_side):
+            try:
+                with open(cached[1], 'rb') as f:
+                    data = f.read()
+                os.utime(cached[1])  # Mark as recently used for eviction
+                self.hits += 1
+                return data
+            except OSError:
+                pass
+
+        self.misses += 1
+        # The chosen variant first, then smaller ones in case it is oversized or not an image (videos)
+        variants = post_variants(post)
+        smaller = [other for other in variants if other[0] < side]
+        for side, kind, url in [variant] + smaller[::-1]:
+            print(f"Downloading {kind} variant ({side}px) of post {key}: {url}")
+            try:
+                data = http_session.fetch_bytes(url, self.max_download_bytes, timeout=30)
+            except (http_session.DownloadRejected, requests.RequestException) as e:
+                # A dead original (404, timeout) should not cost the visitor a sample that works
+                print(f"Skipping {kind} variant: {e}")
+                continue
+            self.bytes_downloaded += len(data)
+            data, side, extension = self._fit(data, side, url, target_side)
+            self._store(self._path(key, side, extension), data)
+            return data
+        return None
+
+    def _fit(self, data, side, url, target_side):
+        """Scale originals well past target_side down before caching, so nothing downstream decodes them"""
+        extension = os.path.splitext(url.split('?')[0])[1] or '.jpg'
+        try:
+            shrunk = shrink(data, target_side) if side > target_side * 1.5 else None
+        except Exception as e:
+            print(f"Could not downscale reference image: {e}")
+            shrunk = None
+        if shrunk is None:
+            return data, side, extension
+        print(f"Downscaled reference image: {len(data)} -> {len(shrunk[0])} bytes")
+        return shrunk
+
+    def _store(self, path, data):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not cache reference image: {e}")
+            return
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self):
+        for path in glob.glob(os.path.join(self.directory, '*', '*')):
+            if not path.endswith('.tmp'):
+                yield path
+
+    def _scan_size(self):
+        total = 0
+        for path in self._files():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def _evict(self):
+        # Least recently used (oldest mtime) first until we're back under budget
+        entries = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'bytes_downloaded': self.bytes_downloaded}
+
+
+image_store = ImageStore(
+    directory=os.environ.get("IMAGE_STORE_DIR", "cache/images"),
+    max_bytes=int(os.environ.get("IMAGE_STORE_MAX_BYTES", 256 * 1024 * 1024)),
+)
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from tracing import span
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# How many steps may run at once per provider, across all booth sessions. Model calls fan out
+# inside their steps, so their limits are enforced per call by ProviderRouter (see models.py)
+DEFAULT_PROVIDER_LIMITS = {'booru': 4}
+
+
+class Step:
+    """One pipeline stage: fn(job) runs in a worker thread while holding a slot for provider"""
+    __slots__ = ('name', 'provider', 'fn')
+
+    def __init__(self, name, provider, fn):
+        self.name = name
+        self.provider = provider
+        self.fn = fn
+
+
+class Job:
+    def __init__(self, steps, inputs):
+        self.id = uuid.uuid4().hex[:8]
+        self.steps = steps
+        self.inputs = inputs
+        self.results = {}
+        self.cached_stages = []
+        self.status = QUEUED
+        self.stage = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+
+class JobQueue:
+    """In-process async job queue with a bounded worker pool and per-provider concurrency limits"""
+
+    def __init__(self, workers=3, provider_limits=None, max_kept=30, keep_for=15 * 60):
+        self.workers = workers
+        self.provider_limits = dict(DEFAULT_PROVIDER_LIMITS, **(provider_limits or {}))
+        # Finished jobs hold their reference and candidate images (a few MB), so only keep recent ones
+        self.max_kept = max_kept
+        self.keep_for = keep_for
+        self._jobs = OrderedDict()
+        self._waiting = []  # Job ids in queue order, for position reporting
+        self._lock = threading.Lock()
+        self._average_duration = 45.0  # Seconds; refined as jobs complete
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="job-queue", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._limits = {name: asyncio.Semaphore(limit) for name, limit in self.provider_limits.items()}
+        for i in range(self.workers):
+            self._loop.create_task(self._worker(i))
+        self._ready.set()
+        self._loop.run_forever()
+
+    def submit(self, steps, inputs=None):
+        """Queue a job and return its id"""
+        job = Job(steps, inputs or {})
+        with self._lock:
+            self._jobs[job.id] = job
+            self._waiting.append(job.id)
+            self._forget_old_jobs()
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job_id):
+        """1-based place in the waiting line, or 0 once the job has started"""
+        with self._lock:
+            return self._waiting.index(job_id) + 1 if job_id in self._waiting else 0
+
+    def eta(self, job_id):
+        """Rough seconds until the job finishes, from the rolling average job duration"""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return 0.0
+        if job.status == RUNNING:
+            return max(self._average_duration - (time.time() - job.started_at), 0.0)
+        rounds = (self.position(job_id) - 1) // self.workers + 1
+        return rounds * self._average_duration
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {'jobs': counts, 'waiting': len(self._waiting), 'average_duration': self._average_duration}
+
+    def _forget_old_jobs(self):
+        # Keep finished results around for retrieval, but only the most recent ones
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        excess = len(self._jobs) - self.max_kept
+        expired = time.time() - self.keep_for
+        for i, job_id in enumerate(finished):
+            if i < excess or self._jobs[job_id].finished_at < expired:
+                del self._jobs[job_id]
+
+    async def _worker(self, index):
+        while True:
+            job = await self._queue.get()
+            with self._lock:
+                if job.id in self._waiting:
+                    self._waiting.remove(job.id)
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                # One trace per job; to_thread copies the context, so every stage's spans nest under it
+                with span("job", job_id=job.id):
+                    for step in job.steps:
+                        job.stage = step.name
+                        with span(f"step_{step.name}"):
+                            limit = self._limits.get(step.provider)
+                            if limit is None:
+                                result = await asyncio.to_thread(step.fn, job)
+                            else:
+                                async with limit:
+                                    result = await asyncio.to_thread(step.fn, job)
+                        if result is None:
+                            raise RuntimeError(f"{step.name} step returned no result")
+                        job.results[step.name] = result
+                job.status = DONE
+            except Exception as e:
+                print(f"Job {job.id} failed during {job.stage}: {e}")
+                job.error = str(e)
+                job.status = FAILED
+            finally:
+                job.finished_at = time.time()
+                job.inputs = {}  # The webcam photo and stage cache are not needed to show the result
+                if job.status == DONE:
+                    duration = job.finished_at - job.started_at
+                    self._average_duration = 0.8 * self._average_duration + 0.2 * duration
+                self._queue.task_done()
@@ -0,0 +1,35 @@
+import json
+import os
+
+
+class JsonMemo:
+    """A dict kept in one JSON file: read on first use, rewritten atomically by save().
+
+    Not locked; the owner serializes access (see TagCounts, TagResolver, StyleDescriptors).
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name  # For error messages
+        self._data = None
+
+    def load(self):
+        if self._data is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.load(), f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save {self.name}: {e}")
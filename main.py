@@ -1,131 +1,77 @@
 import streamlit as st
-import io
-from PIL import Image
-import requests
-import base64
-from models import gemini_generate, openrouter_generate, vlm_generate
-# from pybooru import Danbooru
-from gelbooru import search_anime_character
-
-# https://pypi.org/project/aiodanbooru/
-# pip install aiodanbooru
-
-def vlm_prompt(webcam_image, downloaded_image):
-    ### ret a prompt of how to merge the webcam image and downloaded image
-    webcam_bytes = webcam_image.getvalue()
-    webcam_b64 = base64.b64encode(webcam_bytes).decode('utf-8')
-
-    # Convert PIL image to bytes then base64
-    img_buffer = io.BytesIO()
-    downloaded_image.save(img_buffer, format='PNG')
-    anime_b64 = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
-
-    analysis_prompt = """Analyze these two images carefully:
-1. The first image shows a real person
-2. The second image shows an anime character
-You are not expected to generate an image, but to create a prompt instead.
-Create a detailed transformation prompt for converting the real person into anime style. Be specific about:
-
-PHYSICAL FEATURES TO PRESERVE:
-- Age and gender of the person
-- Basic facial structure and proportions
-- Hair length and style
-- Pose and expression
-- Background elements
-
-ANIME STYLE TO ADOPT:
-- Art style from the anime reference (cel-shaded, soft-shaded, etc.)
-- Color palette and vibrancy
-- Eye style and size
-- Line art thickness
-- Shading technique
-
-Format as a clear, actionable prompt for image generation. Start with "Transform this person into anime style:" and include specific technical terms like "cel-shaded", "anime proportions", "vibrant colors", etc.
-
-Make it practical for AI image generation."""
-
-    analysis = vlm_generate(webcam_b64, anime_b64, analysis_prompt)
-
-    # Create a more structured final prompt
-    final_prompt = f"""Given these two reference images, {analysis}
-
-Technical requirements:
-- Maintain the original person's pose, facial structure, and background
-- Apply anime art style with cell-shading and bold outlines
-- Use vibrant anime color palette
-- Transform facial features to anime proportions while keeping recognizable identity
-- High quality anime artwork style"""
-
-    return final_prompt
-
-def search_agent(prompt):
-    ### ret b64 image of downloaded anime character from prompt
-
-    # 1. use ai to parse prompt into proper anime character name.
-    # 2. if unable to find name, traits such as hair, eye color, height are also acceptable
-    prompt = f"""Parse this anime character description and extract search terms for booru image boards: "{prompt}"
-
-    IMPORTANT: Use only valid booru tags in this format:
-    - Character names: lowercase, underscores for spaces (e.g., "megumin", "gojo", "gojo_satoru")
-    - Series names: with underscores (e.g., "konosuba", "jujutsu_kaisen")
-    - Physical traits: standardized tags (e.g., "red_eyes", "brown_hair", "long_hair")
-    - Always include "1girl" or "1boy" as appropriate
-    - Use tags like "official_art" or "anime_screenshot" for better quality
-
-    Examples:
-    - "megumin konosuba red_eyes brown_hair 1girl official_art"
-    - "gojo_satoru jujutsu_kaisen white_hair blue_eyes 1boy"
-    - "zero_two darling_in_the_franxx pink_hair red_horns 1girl"
-
-    Return only the search tags separated by spaces, no explanations."""
-    search_query = openrouter_generate(prompt)
-
-    # https://openrouter.ai/docs/features/tool-calling
-    # 3. use https://www.animecharactersdatabase.com or danbooru
-    try:
-        # tag_list = '_'.join(search_query.strip().split()[:2]) if search_query else "1girl"
-        # posts = danbooru.post_list(tags="1girl", limit=1, page=1, random=True)
-        # print(posts[0])
-        # if posts[0].get('file_url'):
-        #     file_url = posts[0]['file_url']
-        # elif posts[0].get('large_file_url'):
-        #     file_url = posts[0]['large_file_url']
-        # else:
-        #     # Fallback to sample if no high-res available
-        #     file_url = posts[0]['media_asset']['variants'][-1]['url']
-
-        # Download the image and convert to base64
-        file_url = search_anime_character(search_query)
-        if not file_url:
-            file_url = search_anime_character("1girl")
-
-        if file_url:
-            response = requests.get(file_url)
-            response.raise_for_status()
-            image_b64 = base64.b64encode(response.content).decode('utf-8')
-            return image_b64
-        else:
-            raise Exception("Could not find any anime character image")
-    except Exception as e:
-       print(f"Search failed: {e}")
-       # Return None to indicate failure
-       return None
-
-# def generate_image(original_img: bytes, prompt: str):
-def generate_image(original_img: bytes, anime_img: bytes, prompt: str):
-    ### ret image in bytes for st.image() and bytesio
-    b64 = base64.b64encode(original_img).decode('utf-8')
-    b64_2 = base64.b64encode(anime_img).decode('utf-8')
-    gemini_bytes = gemini_generate(b64, b64_2, prompt)
-    # openai_bytes = openai_generate(b64, prompt)
-    if gemini_bytes is None:
-        print("Error: gemini_generate returned None")
+import os
+import time
+from models import router
+from http_session import connection_stats
+from booru_sources import hedged_search
+from image_asset import ImageAsset
+from tag_resolver import tag_resolver, normalize_prompt
+from stage_cache import StageCache, content_key
+from style_descriptors import style_descriptors
+from prefetch import build_prefetcher, log_request
+from pipeline import PIPELINE_STEPS
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue
+from tracing import start_metrics_server
+
+STEP_ERRORS = {
+    "reference": "Failed to find anime character reference. Please try a different character name.",
+    "prompt": "Failed to generate a transformation prompt. Please try again.",
+    "generate": "Failed to generate image. Please try again with a different character or photo.",
+}
+
+def follow_text(job, key, done_key):
+    ### yield what the background job adds to job.results[key] until done_key lands, for st.write_stream
+    shown = ""
+    while done_key not in job.results and not job.finished:
+        text = job.results.get(key, "")
+        if not text.startswith(shown):
+            yield "\n\n"  # The answer restarted on another model
+            shown = ""
+        if len(text) > len(shown):
+            yield text[len(shown):]
+            shown = text
+        time.sleep(0.1)
+
+@st.cache_resource
+def get_stage_cache():
+    # One bounded cache per process, shared by every rerun and session
+    return StageCache()
+
+@st.cache_resource
+def get_metrics_server():
+    # Prometheus scrape endpoint, only when asked for with METRICS_PORT
+    port = os.environ.get("METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+@st.cache_resource
+def get_job_queue():
+    # One worker pool per process so every visitor's session shares the provider limits
+    return JobQueue()
+
+@st.cache_resource
+def get_prefetcher():
+    # Warms caches for popular characters in the background, backing off while anyone is in line
+    if os.environ.get("PREFETCH", "1") == "0":
         return None
-    return gemini_bytes
+    job_queue = get_job_queue()
+
+    def is_busy():
+        stats = job_queue.stats()
+        return stats['waiting'] > 0 or stats['jobs'].get(RUNNING, 0) > 0
+
+    return build_prefetcher(is_busy).start()
+
+get_metrics_server()
+get_prefetcher()
 
 # Streamlit UI
 st.title("Anime Transformation Studio")
 
+with st.sidebar.expander("Provider health"):
+    st.json(router.stats())
+    st.json(hedged_search.stats())
+    st.json(connection_stats())  # Requests per pooled connection, per host
+
 # Input Section
 col1, col2 = st.columns(2)
 with col1:
@@ -138,51 +84,87 @@ with col2:
     char_prompt = st.text_input("Character prompt (e.g. 'Megumi Jujutsu Kaisen')")
 
 if user_img and char_prompt:
-    with st.status("Processing..."):
-        # Pre-process images
-        st.write("Processing images...")
-
-        st.write("Searching character reference...")
-        anime_b64 = search_agent(char_prompt)
-        if anime_b64 is None:
-            st.error("Failed to find anime character reference. Please try a different character name.")
-            st.stop()
-        anime_image = Image.open(io.BytesIO(base64.b64decode(anime_b64)))
-
-        # Display references
-        st.subheader("Input References")
-        ref_col1, ref_col2 = st.columns(2)
-        with ref_col1:
-            st.image(user_img, caption="Your Photo")
-        with ref_col2:
-            st.image(anime_image, caption="Anime Reference")
-
-        # Generate prompt
-        st.write("Generating fusion prompt...")
-        final_prompt = vlm_prompt(user_img, anime_image)
-        st.subheader("Generated Transformation Prompt")
-        st.write(final_prompt)
-
-        # Generate final image
-        st.write("Creating artwork...")
-        generated_bytes = generate_image(user_img.getvalue(), base64.b64decode(anime_b64), final_prompt)
-
-        if generated_bytes is None:
-            st.error("Failed to generate image. Please try again with a different character or photo.")
+    job_queue = get_job_queue()
+    webcam_asset = ImageAsset(user_img.getvalue(), user_img.type)
+
+    # Submit once per photo + character; reruns just poll the same job
+    job_key = content_key(webcam_asset, normalize_prompt(char_prompt))
+    if st.session_state.get("job_key") != job_key or job_queue.get(st.session_state.get("job_id")) is None:
+        st.session_state.job_key = job_key
+        log_request(char_prompt)
+        st.session_state.job_id = job_queue.submit(PIPELINE_STEPS, {
+            "char_prompt": char_prompt,
+            "webcam": webcam_asset,
+            "stage_cache": get_stage_cache(),
+        })
+    job = job_queue.get(st.session_state.job_id)
+
+    status_state = {DONE: "complete", FAILED: "error"}.get(job.status, "running")
+    with st.status(f"Processing... (job {job.id})", state=status_state):
+        if job.status == QUEUED:
+            st.write(f"Waiting in line: position {job_queue.position(job.id)}, "
+                     f"about {job_queue.eta(job.id):.0f}s to go")
+        elif job.status == RUNNING:
+            st.write(f"Working on {job.stage}, about {job_queue.eta(job.id):.0f}s to go")
+
+        anime_asset = job.results.get("reference")
+        if anime_asset is not None:
+            st.caption(f"Tag resolver answers so far: {tag_resolver.stats}, style descriptors: {style_descriptors.stats}")
+
+            # Display references
+            st.subheader("Input References")
+            ref_col1, ref_col2 = st.columns(2)
+            with ref_col1:
+                st.image(webcam_asset.data, caption="Your Photo")
+            with ref_col2:
+                st.image(anime_asset.data, caption="Anime Reference")
+
+        final_prompt = job.results.get("prompt")
+        if final_prompt is not None:
+            st.subheader("Generated Transformation Prompt")
+            st.write(final_prompt)
+        elif job.status == RUNNING and job.stage == "prompt":
+            # Render the person analysis as the VLM writes it; the merged prompt replaces it on the next rerun
+            st.subheader("Generated Transformation Prompt")
+            st.write_stream(follow_text(job, "prompt_partial", "prompt"))
+
+        if job.status == FAILED:
+            st.error(STEP_ERRORS.get(job.stage, f"Something went wrong: {job.error}"))
+            st.session_state.job_key = None  # Let the next interaction retry
             st.stop()
 
-        final_image = Image.open(io.BytesIO(generated_bytes))
+        if job.finished:
+            cached_stages = job.cached_stages
+            st.caption(f"Replayed from cache: {', '.join(cached_stages)}" if cached_stages else "No cached stages")
+
+    # Show the first finished candidate right away; the rest fill in as they land
+    candidates = [ImageAsset(image_bytes) for image_bytes in job.results.get("candidates", [])]
+    if not candidates:
+        time.sleep(1)
+        st.rerun()
 
     # Display result
     st.subheader("Your Anime Transformation")
-    st.image(final_image)
-
-    # Download button
-    img_bytes = io.BytesIO()
-    final_image.save(img_bytes, format="PNG")
+    choice = 0
+    if len(candidates) > 1:
+        choice = st.radio("Pick your favourite", range(len(candidates)),
+                          format_func=lambda i: f"Option {i + 1}", horizontal=True)
+        thumb_cols = st.columns(len(candidates))
+        for i, candidate in enumerate(candidates):
+            with thumb_cols[i]:
+                st.image(candidate.data, caption=f"Option {i + 1}")
+    final_image = candidates[choice]
+    st.image(final_image.data)
+
+    # Download button (Gemini already returns PNG, so this is usually the same bytes)
     st.download_button(
         label="Download Postcard",
-        data=img_bytes.getvalue(),
+        data=final_image.as_png(),
         file_name="output/anime_transformation.png",
         mime="image/png"
     )
+
+    if not job.finished:
+        st.caption("More options on the way...")
+        time.sleep(1)
+        st.rerun()
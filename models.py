@@ -3,26 +3,126 @@
 # free openrouter vlm for recognising / prompting
 # openrouter free small llm for tool calling / searching for image and downloading
 
-from google import genai
-from google.genai import types
 import base64
+import glob
+import hashlib
 import mimetypes
 import os
-from openai import OpenAI
+import threading
+import time
+from typing import TYPE_CHECKING
 
-if os.environ.get("GOOGLE_API_KEY") == "":
-    print("no gemini api key wtf ur COOKED")
+from ratelimit import rate_limiter
+from router import ProviderRouter, ProviderUnavailable
+from tracing import current_span, traced
 
-gemini_client = genai.Client(
-    api_key="meow" if os.environ.get("GOOGLE_API_KEY") == "" else (os.environ.get("GOOGLE_API_KEY") or "meow"),
-)
+if TYPE_CHECKING:
+    from image_asset import ImageAsset
 
-openai_client = OpenAI()
+# SDKs and clients are created on first use: importing google.genai/openai is slow and
+# OpenAI() raises without a key, which shouldn't stop scripts that never call a model
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _api_key(name):
+    return "meow" if os.environ.get(name) == "" else (os.environ.get(name) or "meow")
+
+
+def _make_gemini_client():
+    from google import genai
+    from google.genai import types
+    if os.environ.get("GOOGLE_API_KEY") == "":
+        print("no gemini api key wtf ur COOKED")
+    base_url = os.environ.get("GEMINI_BASE_URL")
+    return genai.Client(
+        api_key=_api_key("GOOGLE_API_KEY"),
+        http_options=types.HttpOptions(base_url=base_url) if base_url else None,
+    )
+
+
+def _make_openai_client():
+    from openai import OpenAI
+    return OpenAI()  # Honours OPENAI_BASE_URL itself
+
+
+def _make_openrouter_client():
+    from openai import OpenAI
+    return OpenAI(
+        base_url=os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+        api_key=_api_key("OPENROUTER_API_KEY"),
+    )
+
+
+CLIENT_FACTORIES = {
+    'gemini_client': _make_gemini_client,
+    'openai_client': _make_openai_client,
+    'openrouter_client': _make_openrouter_client,
+}
+
+
+def get_client(name):
+    """Return the process-wide client for a provider, building it on first use"""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = CLIENT_FACTORIES[name]()
+                _clients[name] = client
+    return client
+
+
+def __getattr__(name):
+    # Keeps `models.gemini_client` & co. working without constructing them at import time
+    if name in CLIENT_FACTORIES:
+        return get_client(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _models(env_name, defaults):
+    value = os.environ.get(env_name)
+    return [model.strip() for model in value.split(",") if model.strip()] if value else defaults
+
+
+# Models per capability in failover order; override with comma-separated env vars
+MODEL_ROUTES = {
+    'vlm': _models("VLM_MODELS", ["google/gemma-3-27b-it:free", "qwen/qwen2.5-vl-32b-instruct:free"]),
+    'text': _models("TEXT_MODELS", ["deepseek/deepseek-r1-0528-qwen3-8b:free", "mistralai/mistral-7b-instruct:free"]),
+    'gemini_image': _models("GEMINI_IMAGE_MODELS", ["gemini-2.0-flash-preview-image-generation"]),
+    'openai_image': _models("OPENAI_IMAGE_MODELS", ["gpt-4.1-mini"]),
+}
+
+# Seconds a capability may spend across all of its models before giving up
+DEADLINES = {'vlm': 90, 'text': 60, 'gemini_image': 120, 'openai_image': 120}
+
+# Which upstream serves each capability, and how many calls each may have in flight at once
+# across every booth session, VLM half and generation candidate
+CAPABILITY_PROVIDERS = {'vlm': 'openrouter', 'text': 'openrouter', 'gemini_image': 'gemini', 'openai_image': 'openai'}
+PROVIDER_CONCURRENCY = {
+    'openrouter': int(os.environ.get("OPENROUTER_CONCURRENCY", 2)),
+    'gemini': int(os.environ.get("GEMINI_CONCURRENCY", 2)),
+    'openai': int(os.environ.get("OPENAI_CONCURRENCY", 2)),
+}
+
+def _deadline(capability, deadline=None):
+    """The capability's own deadline, or the caller's if that is sooner"""
+    return DEADLINES[capability] if deadline is None else min(deadline, DEADLINES[capability])
+
+
+router = ProviderRouter(MODEL_ROUTES, rate_limiter=rate_limiter,
+                        providers=CAPABILITY_PROVIDERS, concurrency=PROVIDER_CONCURRENCY)
+
+
+def _openrouter(timeout):
+    client = get_client('openrouter_client')
+    return client.with_options(timeout=timeout) if timeout else client
+
+
+# Generated images are kept for reprinting, but only the most recent ones so the kiosk disk can't fill up
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "output")
+OUTPUT_KEEP = int(os.environ.get("OUTPUT_KEEP", 50))
+_output_lock = threading.Lock()
 
-openrouter_client = OpenAI(
-  base_url="https://openrouter.ai/api/v1",
-  api_key="meow" if os.environ.get("OPENROUTER_API_KEY") == "" else (os.environ.get("OPENROUTER_API_KEY") or "meow"),
-)
 
 def save_binary_file(file_name, data):
     f = open(file_name, "wb")
@@ -31,39 +131,66 @@ def save_binary_file(file_name, data):
     print(f"File saved to to: {file_name}")
 
 
-def gemini_generate(b64_image: str, b64_image_2: str, input: str):
+def _prune_output(directory=OUTPUT_DIR, keep=OUTPUT_KEEP):
+    """Delete all but the keep newest files in directory"""
+    with _output_lock:
+        paths = sorted(glob.glob(os.path.join(directory, '*')), key=os.path.getmtime, reverse=True)
+        for path in paths[keep:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+@traced("gemini_generate")
+def gemini_generate(image: "ImageAsset", image_2: "ImageAsset", input: str, deadline: float = None):
     # taken from google ai studio
-    model = "gemini-2.0-flash-preview-image-generation"
+    from google.genai import types
     contents = [
         types.Content(
             role="user",
             parts=[
                 *(
                     [types.Part.from_bytes(
-                        mime_type="image/png",
-                        data=base64.b64decode(b64_image)
-                    )] if b64_image else []
+                        mime_type=image.mime_type,
+                        data=image.data
+                    )] if image else []
                 ),
                 *(
                     [types.Part.from_bytes(
-                        mime_type="image/png",
-                        data=base64.b64decode(b64_image_2)
-                    )] if b64_image_2 else []
+                        mime_type=image_2.mime_type,
+                        data=image_2.data
+                    )] if image_2 else []
                 ),
                 types.Part.from_text(text=input),
             ],
         ),
     ]
+
+    current_span().set('bytes', sum(len(img) for img in (image, image_2) if img))
+
+    def _generate(model, timeout):
+        return _gemini_stream(model, contents, timeout)
+
+    try:
+        return router.call('gemini_image', _generate, deadline=_deadline('gemini_image', deadline))
+    except ProviderUnavailable as e:
+        print(e)
+        return None
+
+def _gemini_stream(model, contents, timeout):
+    from google.genai import types
     generate_content_config = types.GenerateContentConfig(
         response_modalities=[
             "IMAGE",
             "TEXT"
         ],
         response_mime_type="text/plain",
+        http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
     )
 
     file_index = 0
-    for chunk in gemini_client.models.generate_content_stream(
+    for chunk in get_client('gemini_client').models.generate_content_stream(
         model=model,
         contents=contents,
         config=generate_content_config,
@@ -75,95 +202,165 @@ def gemini_generate(b64_image: str, b64_image_2: str, input: str):
         ):
             continue
         if chunk.candidates[0].content.parts[0].inline_data and chunk.candidates[0].content.parts[0].inline_data.data:
-            file_name = f"ENTER_FILE_NAME_{file_index}"
-            file_index += 1
             inline_data = chunk.candidates[0].content.parts[0].inline_data
             data_buffer = inline_data.data # image bytes
+            # Unique per image so concurrent generations don't overwrite each other's output
+            file_name = f"ENTER_FILE_NAME_{file_index}_{hashlib.sha1(data_buffer).hexdigest()[:8]}"
+            file_index += 1
             file_extension = mimetypes.guess_extension(inline_data.mime_type)
-            os.makedirs("output", exist_ok=True)
-            save_binary_file(f"output/{file_name}{file_extension}", data_buffer)
+            os.makedirs(OUTPUT_DIR, exist_ok=True)
+            save_binary_file(os.path.join(OUTPUT_DIR, f"{file_name}{file_extension}"), data_buffer)
+            _prune_output()
             return data_buffer
         else:
             print(chunk.text)
 
-def openai_generate(b64_image: str, input: str):
+@traced("openai_generate")
+def openai_generate(image: "ImageAsset", input: str, image_2: "ImageAsset" = None, deadline: float = None):
     # https://platform.openai.com/docs/guides/image-generation?image-generation-model=gpt-image-1&api=responses#edit-images
-    response = openai_client.responses.create(
-        model="gpt-4.1-mini",
-        input=[
-            {
-            "role": "user",
-            "content": [
-                {"type": "input_text", "text": input},
+    current_span().set('bytes', sum(len(img) for img in (image, image_2) if img))
+
+    def _generate(model, timeout):
+        client = get_client('openai_client')
+        response = (client.with_options(timeout=timeout) if timeout else client).responses.create(
+            model=model,
+            input=[
                 {
-                    "type": "input_image",
-                    "image_url": f"data:image/jpeg;base64,{image}",
+                "role": "user",
+                "content": [
+                    {"type": "input_text", "text": input},
+                    *(
+                        {
+                            "type": "input_image",
+                            "image_url": f"data:{img.mime_type};base64,{img.b64}",
+                        }
+                        for img in (image, image_2) if img
+                    ),
+                ],
                 }
             ],
-            }
-        ],
-        tools=[{"type": "image_generation"}],
-    )
-    image_generation_calls = [
-        output
-        for output in response.output
-        if output.type == "image_generation_call"
-    ]
+            tools=[{"type": "image_generation"}],
+        )
+        image_generation_calls = [
+            output
+            for output in response.output
+            if output.type == "image_generation_call"
+        ]
 
-    image_data = [output.result for output in image_generation_calls]
+        image_data = [output.result for output in image_generation_calls]
 
-    if image_data:
-        image_base64 = image_data[0]
-        return image_base64
-    else:
-        print(response.output.content)
+        if image_data:
+            # Same contract as gemini_generate: raw image bytes
+            return base64.b64decode(image_data[0])
+        else:
+            print(response.output_text)
 
-def vlm_generate(webcam_image: str, downloaded_image: str, prompt: str):
-    completion = openrouter_client.chat.completions.create(
-        model="google/gemma-3-27b-it:free",
-        # model="qwen/qwen2.5-vl-32b-instruct:free",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{webcam_image}"
-                        }
-                    },
+    try:
+        return router.call('openai_image', _generate, deadline=_deadline('openai_image', deadline))
+    except ProviderUnavailable as e:
+        print(e)
+        return None
+
+def _stream_completion(model, timeout, messages, **kwargs):
+    """Yield content deltas of a streamed OpenRouter chat completion as they arrive"""
+    stream = _openrouter(timeout).chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+    try:
+        for chunk in stream:
+            # Reasoning models send empty content while they think
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()  # Also drops the connection when the caller stops early
+
+def _chat_completion(model, timeout, messages, on_text=None, stop=None, **kwargs):
+    """Completion text; streamed when the caller wants partial text (on_text) or may cut it short (stop)"""
+    if on_text is None and stop is None:
+        completion = _openrouter(timeout).chat.completions.create(model=model, messages=messages, **kwargs)
+        print(completion.choices[0].message.content)
+        return completion.choices[0].message.content
+
+    started = time.monotonic()
+    text = ""
+    deltas = _stream_completion(model, timeout, messages, **kwargs)
+    try:
+        for delta in deltas:
+            if not text:
+                current_span().set('first_token_s', round(time.monotonic() - started, 3))
+            text += delta
+            if on_text:
+                on_text(text)  # Whole text so far, so a failover to another model simply starts over
+            if stop and stop(text):
+                current_span().set('stopped_early', True)
+                break
+    finally:
+        deltas.close()
+    print(text)
+    return text or None
+
+def _vlm_messages(prompt, images):
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt
+                },
+                *(
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{downloaded_image}"
+                            "url": f"data:{image.mime_type};base64,{image.b64}"
                         }
                     }
-                ]
-            }
-        ]
-    )
-    print(completion.choices[0].message.content)
-    return completion.choices[0].message.content
-
-def openrouter_generate(prompt: str):
-    completion = openrouter_client.chat.completions.create(
-        extra_body={},
-        model="deepseek/deepseek-r1-0528-qwen3-8b:free",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                ]
-            }
-        ]
-    )
-    print(completion.choices[0].message.content)
-    return completion.choices[0].message.content
+                    for image in images
+                ),
+            ]
+        }
+    ]
+
+@traced("vlm_generate")
+def vlm_generate(webcam_image: "ImageAsset", downloaded_image: "ImageAsset", prompt: str, on_text=None):
+    current_span().set('bytes', len(webcam_image) + len(downloaded_image))
+
+    def _generate(model, timeout):
+        return _chat_completion(model, timeout, _vlm_messages(prompt, [webcam_image, downloaded_image]), on_text)
+
+    return router.call('vlm', _generate, deadline=DEADLINES['vlm'])
+
+@traced("vlm_describe")
+def vlm_describe(image: "ImageAsset", prompt: str, on_text=None):
+    # Single-image VLM call: half the upload of vlm_generate
+    current_span().set('bytes', len(image))
+
+    def _generate(model, timeout):
+        return _chat_completion(model, timeout, _vlm_messages(prompt, [image]), on_text)
+
+    return router.call('vlm', _generate, deadline=DEADLINES['vlm'])
+
+@traced("openrouter_generate")
+def openrouter_generate(prompt: str, on_text=None, stop=None):
+    # stop(text) -> True ends the stream early, e.g. once a full tag line has arrived
+    current_span().set('prompt_chars', len(prompt))
+
+    def _generate(model, timeout):
+        return _chat_completion(
+            model,
+            timeout,
+            [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": prompt
+                        },
+                    ]
+                }
+            ],
+            on_text,
+            stop,
+            extra_body={},
+        )
+
+    return router.call('text', _generate, deadline=DEADLINES['text'])
@@ -0,0 +1,181 @@
+"""
+The booth pipeline: reference search -> VLM prompt -> parallel image generation, as job queue steps.
+Kept apart from main.py so the benchmarks run the same stages without Streamlit.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from models import gemini_generate, openai_generate, vlm_describe
+from booru_sources import find_reference_post
+from image_store import image_store
+from image_processor import prepare_image
+from image_asset import ImageAsset
+from tag_resolver import llm_tags, tag_resolver, normalize_prompt
+from stage_cache import content_key
+from style_descriptors import style_descriptors
+from jobs import Step
+from tracing import span, submit
+
+FEATURES_PROMPT = """This image shows a real person. Describe what must be preserved when redrawing them in anime style:
+- Age and gender of the person
+- Basic facial structure and proportions
+- Hair length and style
+- Pose and expression
+- Background elements
+
+Answer as a compact, specific description. No introduction."""
+
+def person_features(webcam_image: ImageAsset, on_text=None):
+    ### ret the person half of the analysis; only this runs per visitor
+    # Crop to the subject, shrink to the VLM's input size and re-encode as JPEG
+    return vlm_describe(prepare_image(webcam_image, 'vlm'), FEATURES_PROMPT, on_text=on_text)
+
+def vlm_prompt(webcam_image: ImageAsset, downloaded_image: ImageAsset, on_text=None):
+    ### ret a prompt of how to merge the webcam image and downloaded image
+    # The style half depends only on the reference, so it is cached per image (style_descriptors.py);
+    # both single-image calls run at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        style_future = submit(executor, style_descriptors.describe, downloaded_image)
+        features_future = submit(executor, person_features, webcam_image, on_text)
+        style, features = style_future.result(), features_future.result()
+    if not style or not features:
+        return None
+
+    # Create a more structured final prompt
+    final_prompt = f"""Transform this person into anime style, in the art style of the anime reference.
+
+PHYSICAL FEATURES TO PRESERVE:
+{features}
+
+ANIME STYLE TO ADOPT:
+{style}
+
+Technical requirements:
+- Maintain the original person's pose, facial structure, and background
+- Apply anime art style with cell-shading and bold outlines
+- Use vibrant anime color palette
+- Transform facial features to anime proportions while keeping recognizable identity
+- High quality anime artwork style"""
+
+    return final_prompt
+
+def search_agent(prompt):
+    ### ret ImageAsset of downloaded anime character from prompt
+    # memo cache -> local name matching -> llm, see tag_resolver.py
+    search_query = tag_resolver.resolve(prompt, llm_tags)
+
+    # https://openrouter.ai/docs/features/tool-calling
+    # 3. use https://www.animecharactersdatabase.com
+    try:
+        # Gelbooru first, hedged to Safebooru/Danbooru when it is slow or empty, see booru_sources.py
+        post = find_reference_post(search_query)
+        if not post:
+            post = find_reference_post("1girl")
+
+        # Download the image (or reuse the cached copy)
+
+        with span("reference_download") as trace:
+            misses_before = image_store.misses
+            image_bytes = image_store.get(post) if post else None
+            trace.set('bytes', len(image_bytes or b""))
+            trace.set('cache_hit', image_store.misses == misses_before)
+        if image_bytes:
+            return ImageAsset(image_bytes)
+        else:
+            raise Exception("Could not find any anime character image")
+    except Exception as e:
+       print(f"Search failed: {e}")
+       # Return None to indicate failure
+       return None
+
+# def generate_image(original_img: bytes, prompt: str):
+def generate_image(original_img: ImageAsset, anime_img: ImageAsset, prompt: str, backend: str = "gemini", deadline: float = None):
+    ### ret image in bytes for st.image() and bytesio
+    # deadline (seconds) bounds the model call too, so it stops and frees its provider slot
+    started = time.monotonic()
+    original = prepare_image(original_img, backend)
+    anime = prepare_image(anime_img, backend)
+    if deadline is not None:
+        deadline = max(deadline - (time.monotonic() - started), 0.0)
+    if backend == "openai":
+        openai_bytes = openai_generate(original, prompt, anime, deadline=deadline)
+        if openai_bytes is None:
+            print("Error: openai_generate returned None")
+        return openai_bytes
+    gemini_bytes = gemini_generate(original, anime, prompt, deadline=deadline)
+    if gemini_bytes is None:
+        print("Error: gemini_generate returned None")
+        return None
+    return gemini_bytes
+
+# (backend, extra prompt text) per parallel candidate; the first NUM_CANDIDATES are used
+GENERATION_VARIANTS = [
+    ("gemini", ""),
+    ("gemini", "\n- Stay especially close to the original photo's composition and framing"),
+    ("openai", ""),
+]
+NUM_CANDIDATES = int(os.environ.get("NUM_CANDIDATES", 2))
+GENERATION_DEADLINE = float(os.environ.get("GENERATION_DEADLINE", 90))
+
+def generate_candidates(original_img: ImageAsset, anime_img: ImageAsset, prompt: str,
+                        n: int = NUM_CANDIDATES, deadline: float = GENERATION_DEADLINE, on_result=None):
+    ### ret list of image bytes in arrival order; on_result(bytes) fires as each one lands
+    variants = GENERATION_VARIANTS[:max(n, 1)]
+    executor = ThreadPoolExecutor(max_workers=len(variants))
+    futures = {submit(executor, generate_image, original_img, anime_img, prompt + extra, backend, deadline): backend
+               for backend, extra in variants}
+    results = []
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            try:
+                image_bytes = future.result()
+            except Exception as e:
+                print(f"{futures[future]} candidate failed: {e}")
+                continue
+            if image_bytes:
+                results.append(image_bytes)
+                if on_result:
+                    on_result(image_bytes)
+    except FuturesTimeout:
+        print(f"Generation deadline of {deadline}s hit with {len(results)}/{len(variants)} candidates")
+    finally:
+        # Nobody waits on stragglers; their model calls give up at the same deadline
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results or None
+
+def reference_step(job):
+    char_prompt = job.inputs["char_prompt"]
+    anime_asset, hit = job.inputs["stage_cache"].run("reference", content_key(normalize_prompt(char_prompt)),
+                                                     search_agent, char_prompt)
+    if hit:
+        job.cached_stages.append("reference")
+    return anime_asset
+
+def prompt_step(job):
+    webcam_asset, anime_asset = job.inputs["webcam"], job.results["reference"]
+    final_prompt, hit = job.inputs["stage_cache"].run("prompt", content_key(webcam_asset, anime_asset),
+                                                      vlm_prompt, webcam_asset, anime_asset,
+                                                      on_text=lambda text: job.results.__setitem__("prompt_partial", text))
+    if hit:
+        job.cached_stages.append("prompt")
+    return final_prompt
+
+def generate_step(job):
+    webcam_asset, anime_asset, final_prompt = job.inputs["webcam"], job.results["reference"], job.results["prompt"]
+    # Filled in as candidates arrive so the UI can show the first one straight away
+    candidates = job.results.setdefault("candidates", [])
+    generated, hit = job.inputs["stage_cache"].run("generate", content_key(webcam_asset, anime_asset, final_prompt),
+                                                   generate_candidates, webcam_asset, anime_asset, final_prompt,
+                                                   on_result=candidates.append)
+    if hit:
+        candidates.extend(generated)
+        job.cached_stages.append("generate")
+    return generated
+
+# search_agent -> vlm_prompt -> generate_candidates; the model calls inside are limited per call by models.router
+PIPELINE_STEPS = [
+    Step("reference", "booru", reference_step),
+    Step("prompt", "openrouter", prompt_step),
+    Step("generate", "gemini", generate_step),
+]
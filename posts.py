@@ -0,0 +1,126 @@
+import heapq
+import math
+import os
+
+
+def int_or_zero(value):
+    """Booru numeric fields come as ints, numeric strings, '' or null"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class Post:
+    """Compact booru post holding only the fields we use; raw API dicts carry dozens more"""
+    __slots__ = ('id', 'md5', 'score', 'width', 'height', 'rating', 'tags',
+                 'file_url', 'sample_url', 'sample_width', 'sample_height',
+                 'preview_url', 'preview_width', 'preview_height')
+
+    def __init__(self, id=0, md5='', score=0, width=0, height=0, rating='', tags='',
+                 file_url='', sample_url='', sample_width=0, sample_height=0,
+                 preview_url='', preview_width=0, preview_height=0):
+        self.id = id
+        self.md5 = md5
+        self.score = score
+        self.width = width
+        self.height = height
+        self.rating = rating
+        self.tags = tags  # Space-separated, as the API sends them
+        self.file_url = file_url
+        self.sample_url = sample_url
+        self.sample_width = sample_width
+        self.sample_height = sample_height
+        self.preview_url = preview_url
+        self.preview_width = preview_width
+        self.preview_height = preview_height
+
+    @classmethod
+    def from_dict(cls, data):
+        """Parse a raw API post (or a to_dict() round trip)"""
+        return cls(
+            id=int_or_zero(data.get('id')),
+            md5=data.get('md5') or '',
+            score=int_or_zero(data.get('score')),
+            width=int_or_zero(data.get('width')),
+            height=int_or_zero(data.get('height')),
+            rating=data.get('rating') or '',
+            tags=data.get('tags') or '',
+            file_url=data.get('file_url') or '',
+            sample_url=data.get('sample_url') or '',
+            sample_width=int_or_zero(data.get('sample_width')),
+            sample_height=int_or_zero(data.get('sample_height')),
+            preview_url=data.get('preview_url') or '',
+            preview_width=int_or_zero(data.get('preview_width')),
+            preview_height=int_or_zero(data.get('preview_height')),
+        )
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    # Dict-style access so code written against raw API posts keeps working
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        value = getattr(self, key)
+        return value if value != '' else default
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def has_tag(self, tag):
+        return f" {tag} " in f" {self.tags} "
+
+    def __repr__(self):
+        return f"Post({self.id}, score={self.score}, {self.width}x{self.height}, {self.rating})"
+
+
+class PostPage(list):
+    """The general-rated posts of one search page, remembering how many posts the server sent"""
+
+    def __init__(self, posts=(), raw_count=None):
+        super().__init__(posts)
+        # Client-side filtering shrinks the list, so "last page" has to be judged on the raw size
+        self.raw_count = len(self) if raw_count is None else raw_count
+
+
+def as_post(post):
+    return post if isinstance(post, Post) else Post.from_dict(post)
+
+
+# Postcards are 148 x 100 mm; prints are cropped to that, so closer aspect ratios lose less of the image
+POSTCARD_ASPECT = 148 / 100
+
+
+def score_only(post):
+    """Booru score alone, the original ranking"""
+    return post.score
+
+
+def postcard_score(post):
+    """Prefer popular, high resolution, postcard-shaped, single-character posts"""
+    popularity = math.log1p(max(post.score, 0))
+    resolution = min(max(post.width, post.height) / 1024, 1.0) if post.width and post.height else 0.5
+    if post.width and post.height:
+        aspect = max(post.width, post.height) / min(post.width, post.height)
+        shape = 1.0 - min(abs(math.log(aspect / POSTCARD_ASPECT)), 1.0)
+    else:
+        shape = 0.5
+    solo = 1.0 if post.has_tag('solo') else 0.0
+    return popularity + 2.0 * resolution + 1.5 * shape + 1.0 * solo
+
+
+SCORERS = {
+    'score': score_only,
+    'postcard': postcard_score,
+}
+
+DEFAULT_SCORER = SCORERS[os.environ.get("POST_SCORER", "score")]
+
+
+def top_posts(posts, k=5, scorer=None):
+    """The k best usable general-rated posts by scorer, best first, without sorting everything"""
+    usable = (post for post in map(as_post, posts) if post.file_url and post.rating == 'general')
+    return heapq.nlargest(k, usable, key=scorer or DEFAULT_SCORER)
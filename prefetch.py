@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Background warm-up of the tag, search and reference image caches for popular characters,
+so a visitor asking for one of them skips the LLM tag call, the booru search and the download.
+
+Popular means the configured list (one prompt per line, # comments) followed by the most
+requested prompts from the request log. Run a pass by hand before an event with:
+
+    python prefetch.py
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+from booru_sources import find_reference_posts
+from image_asset import ImageAsset
+from image_processor import image_processor, prepare_image
+from image_store import image_store
+from ratelimit import rate_limiter
+from style_descriptors import style_descriptors
+from tag_resolver import llm_tags, normalize_prompt, tag_resolver
+
+REQUEST_LOG_PATH = os.environ.get("PREFETCH_LOG_PATH", "cache/requests.jsonl")
+_log_lock = threading.Lock()
+
+
+def log_request(prompt, path=REQUEST_LOG_PATH):
+    """Append a character prompt to the request log the prefetcher ranks popularity from"""
+    directory = os.path.dirname(path)
+    try:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with _log_lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'time': round(time.time()), 'prompt': normalize_prompt(prompt)}) + "\n")
+    except OSError as e:
+        print(f"Could not log request: {e}")
+
+
+def top_requested(path=REQUEST_LOG_PATH, n=20, max_age=7 * 24 * 3600):
+    """The n most requested prompts logged within max_age seconds, most requested first"""
+    counts = Counter()
+    cutoff = time.time() - max_age
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by a crash
+                if entry.get('prompt') and entry.get('time', 0) >= cutoff:
+                    counts[entry['prompt']] += 1
+    except OSError:
+        return []
+    return [prompt for prompt, _ in counts.most_common(n)]
+
+
+def configured_prompts(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = [line.split('#', 1)[0].strip() for line in f]
+    except OSError:
+        return []
+    return [line for line in lines if line]
+
+
+class Prefetcher:
+    """Warms caches for popular characters one at a time, yielding whenever visitors are waiting.
+
+    Each character takes a token from the shared 'task:prefetch' bucket, and the searches, LLM
+    and VLM calls it makes go through the same per-host and per-model buckets as live traffic.
+    """
+
+    def __init__(self, prompts_path="data/popular_characters.txt", log_path=REQUEST_LOG_PATH, top_n=20,
+                 interval=3600.0, idle_poll=2.0, is_busy=None, profiles=('vlm', 'gemini'), describe_style=True):
+        self.prompts_path = prompts_path
+        self.log_path = log_path
+        self.top_n = top_n
+        self.interval = interval  # Seconds between passes; search cache entries expire after hours
+        self.idle_poll = idle_poll
+        self.is_busy = is_busy or (lambda: False)
+        self.profiles = tuple(profiles)
+        self.describe_style = describe_style
+        self.stats = {'passes': 0, 'characters': 0, 'images': 0, 'encoded': 0, 'failed': 0, 'yielded': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def popular_prompts(self):
+        """Configured characters first, then the most requested ones, without repeats"""
+        prompts, seen = [], set()
+        for prompt in configured_prompts(self.prompts_path) + top_requested(self.log_path, self.top_n):
+            key = normalize_prompt(prompt)
+            if key and key not in seen:
+                seen.add(key)
+                prompts.append(prompt)
+        return prompts
+
+    def _wait_until_idle(self):
+        yielded = False
+        while self.is_busy() and not self._stop.is_set():
+            yielded = True
+            self._stop.wait(self.idle_poll)
+        if yielded:
+            self.stats['yielded'] += 1
+        return not self._stop.is_set()
+
+    def warm(self, prompt, encode_budget=None):
+        """Resolve, search and download one character's references; True if any image got cached"""
+        tags = tag_resolver.resolve(prompt, llm_tags)
+        if not tags:
+            print(f"Prefetch: no tags for {prompt!r}")
+            return False
+        # A visitor gets a random pick among the top posts, so warm all of them
+        posts = find_reference_posts(tags)
+        images = 0
+        for post in posts:
+            if not self._wait_until_idle():
+                break
+            image_bytes = image_store.get(post)
+            if not image_bytes:
+                continue
+            images += 1
+            reference = ImageAsset(image_bytes)
+            for profile in self.profiles:
+                if encode_budget is not None and self.stats['encoded'] >= encode_budget:
+                    break
+                prepare_image(reference, profile)
+                self.stats['encoded'] += 1
+            # One style description per character: each is a free-tier VLM call, and the
+            # top posts of a character mostly share a style
+            if self.describe_style and images == 1:
+                style_descriptors.describe(reference)
+        self.stats['images'] += images
+        print(f"Prefetch: warmed {images} reference(s) for {prompt!r}")
+        return images > 0
+
+    def run_once(self):
+        """One pass over the popular characters"""
+        # Leave half of the encoded-image LRU to live traffic
+        encode_budget = self.stats['encoded'] + image_processor.max_entries // 2
+        for prompt in self.popular_prompts():
+            if not self._wait_until_idle():
+                break
+            rate_limiter.acquire('task:prefetch')
+            try:
+                if self.warm(prompt, encode_budget):
+                    self.stats['characters'] += 1
+                else:
+                    self.stats['failed'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                print(f"Prefetch failed for {prompt!r}: {e}")
+        self.stats['passes'] += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def build_prefetcher(is_busy=None):
+    """Prefetcher configured from the PREFETCH_* environment variables"""
+    return Prefetcher(
+        prompts_path=os.environ.get("PREFETCH_CHARACTERS", "data/popular_characters.txt"),
+        top_n=int(os.environ.get("PREFETCH_TOP_N", 20)),
+        interval=float(os.environ.get("PREFETCH_INTERVAL", 3600)),
+        is_busy=is_busy,
+        profiles=[name.strip() for name in os.environ.get("PREFETCH_PROFILES", "vlm,gemini").split(',') if name.strip()],
+        describe_style=os.environ.get("PREFETCH_STYLE", "1") != "0",
+    )
+
+
+def main():
+    prefetcher = build_prefetcher()
+    prefetcher.profiles = ()  # Encoded images only live in this process's memory
+    prompts = prefetcher.popular_prompts()
+    print(f"Prefetching {len(prompts)} character(s)")
+    prefetcher.run_once()
+    print(f"Prefetch: {prefetcher.stats}, images: {image_store.stats()}, style descriptors: {style_descriptors.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import email.utils
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are still shared between threads, just not between processes
+    fcntl = None
+
+# (tokens per second, burst) per bucket key. Keys are "host:<hostname>", "model:<model id>" or
+# "task:<name>"; OpenRouter free models allow roughly 20 requests a minute
+DEFAULT_LIMITS = {
+    'host:gelbooru.com': (5.0, 6),
+    'host:safebooru.org': (5.0, 6),
+    'host:danbooru.donmai.us': (5.0, 6),
+    'model:*:free': (20 / 60, 4),
+    'task:prefetch': (1 / 15, 1),  # One background-warmed character every 15 seconds
+}
+
+
+class RateLimiter:
+    """Token buckets keyed by host or model, shared across threads and (via a file lock) processes"""
+
+    def __init__(self, limits=None, state_path=None):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.state_path = state_path if fcntl is not None else None
+        self._state = {}  # key -> [tokens, updated_at, blocked_until], used without a state file
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def limit_for(self, key):
+        if key in self.limits:
+            return self.limits[key]
+        for pattern, limit in self.limits.items():
+            # Only suffix wildcards like "model:*:free" are supported
+            if '*' in pattern:
+                prefix, suffix = pattern.split('*', 1)
+                if key.startswith(prefix) and key.endswith(suffix):
+                    return limit
+        return None
+
+    def _update(self, key, change):
+        """Apply change(state, now) to the bucket under the thread lock and, if configured, the file lock"""
+        with self._lock:
+            if self.state_path is None:
+                return change(self._state, time.time())
+            directory = os.path.dirname(self.state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.state_path + ".lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    try:
+                        with open(self.state_path, encoding='utf-8') as f:
+                            state = json.load(f)
+                    except (OSError, ValueError):
+                        state = {}
+                    result = change(state, time.time())
+                    tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        json.dump(state, f)
+                    os.replace(tmp_path, self.state_path)
+                    return result
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def reserve(self, key, max_wait=None):
+        """Claim the next token for key; return seconds to wait for it, or None if that exceeds max_wait"""
+        limit = self.limit_for(key)
+
+        def change(state, now):
+            if limit is None:
+                # No bucket, but a Retry-After from penalize() still holds every caller back
+                blocked_until = state.get(key, [0, now, 0.0])[2]
+                wait = max(blocked_until - now, 0.0)
+                return None if max_wait is not None and wait > max_wait else wait
+            rate, burst = limit
+            tokens, updated, blocked_until = state.get(key, [burst, now, 0.0])
+            tokens = min(burst, tokens + max(now - updated, 0.0) * rate)
+            wait = max(blocked_until - now, 0.0, (1 - tokens) / rate)
+            if max_wait is not None and wait > max_wait:
+                state[key] = [tokens, now, blocked_until]
+                return None
+            # Tokens may go negative: later callers queue up behind this reservation
+            state[key] = [tokens - 1, now, blocked_until]
+            return wait
+
+        return self._update(key, change)
+
+    def acquire(self, key, max_wait=None):
+        """Block until a token for key is available; False if it would take longer than max_wait"""
+        wait = self.reserve(key, max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            self.waited += wait
+            time.sleep(wait)
+        return True
+
+    def penalize(self, key, seconds):
+        """Hold every caller of key back for `seconds`, e.g. from a Retry-After header"""
+        def change(state, now):
+            limit = self.limit_for(key) or (1.0, 1)
+            tokens, updated, blocked_until = state.get(key, [limit[1], now, 0.0])
+            state[key] = [tokens, updated, max(blocked_until, now + seconds)]
+
+        print(f"Backing off {key} for {seconds:.1f}s")
+        self._update(key, change)
+
+    def observe(self, key, response):
+        """Learn from a 429/503 response (or an SDK error carrying one) by honouring its Retry-After"""
+        response = getattr(response, 'response', response)
+        status = getattr(response, 'status_code', None)
+        headers = getattr(response, 'headers', None)
+        if status not in (429, 503) or headers is None:
+            return
+        seconds = retry_after_seconds(headers.get('Retry-After'))
+        self.penalize(key, seconds if seconds is not None else 5.0)
+
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header (delta seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+rate_limiter = RateLimiter(state_path=os.environ.get("RATE_LIMIT_STATE", "cache/ratelimit.json"))
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import deque
+
+from tracing import current_span
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class ProviderUnavailable(Exception):
+    """Every model configured for a capability failed, was circuit-broken, or ran out of time"""
+
+
+class ModelHealth:
+    """Rolling latency/error stats and circuit breaker state for one model"""
+
+    def __init__(self, model, window=50):
+        self.model = model
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True for success
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False  # Half-open lets exactly one call through
+        self.last_error = None
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        return {
+            'state': self.state,
+            'calls': len(self.outcomes),
+            'error_rate': round(1 - sum(self.outcomes) / len(self.outcomes), 3) if self.outcomes else 0.0,
+            'p50_latency': round(latencies[len(latencies) // 2], 3) if latencies else None,
+            'p95_latency': round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 3) if latencies else None,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error,
+        }
+
+
+class ProviderRouter:
+    """Routes a capability to the first healthy model in its list, failing over within a deadline"""
+
+    def __init__(self, routes, failure_threshold=3, reset_timeout=60.0, rate_limiter=None, providers=None, concurrency=None):
+        self.routes = {capability: list(models) for capability, models in routes.items()}
+        self.rate_limiter = rate_limiter
+        # capability -> upstream, and how many calls each upstream may have in flight across all threads
+        self.providers = dict(providers or {})
+        self._slots = {provider: threading.BoundedSemaphore(limit) for provider, limit in (concurrency or {}).items()}
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def health(self, model):
+        with self._lock:
+            if model not in self._health:
+                self._health[model] = ModelHealth(model)
+            return self._health[model]
+
+    def _available(self, health):
+        with self._lock:
+            if health.state == OPEN and time.monotonic() - health.opened_at >= self.reset_timeout:
+                health.state = HALF_OPEN
+            if health.state == HALF_OPEN:
+                # Let one probe call through; everyone else fails over until it reports back
+                if health.probe_in_flight:
+                    return False
+                health.probe_in_flight = True
+                return True
+            return health.state != OPEN
+
+    def _record(self, health, latency, error=None):
+        with self._lock:
+            health.probe_in_flight = False
+            health.latencies.append(latency)
+            health.outcomes.append(error is None)
+            if error is None:
+                health.consecutive_failures = 0
+                health.state = CLOSED
+                return
+            health.last_error = str(error)[:200]
+            health.consecutive_failures += 1
+            if health.state == HALF_OPEN or health.consecutive_failures >= self.failure_threshold:
+                if health.state != OPEN:
+                    print(f"Opening circuit for {health.model} after {health.consecutive_failures} failures")
+                health.state = OPEN
+                health.opened_at = time.monotonic()
+
+    def call(self, capability, fn, deadline=None):
+        """Run fn(model, timeout) against each healthy model in turn until one returns without raising.
+
+        A None result (an empty or refused answer) is returned as is and counts as a healthy call."""
+        started = time.monotonic()
+        slot = self._slots.get(self.providers.get(capability))
+        if slot is None:
+            return self._call(capability, fn, deadline, started)
+        # Held for the whole call, so parallel candidates and VLM halves count against the same limit
+        if not slot.acquire(timeout=deadline):
+            raise ProviderUnavailable(f"No {capability} slot freed up within {deadline}s")
+        try:
+            return self._call(capability, fn, deadline, started)
+        finally:
+            slot.release()
+
+    def _call(self, capability, fn, deadline, started):
+        errors = []
+        for model in self.routes[capability]:
+            remaining = None if deadline is None else deadline - (time.monotonic() - started)
+            if remaining is not None and remaining <= 0:
+                errors.append("deadline exceeded")
+                break
+            health = self.health(model)
+            if not self._available(health):
+                errors.append(f"{model}: circuit open")
+                continue
+
+            # Wait for this model's quota only if the token arrives before the deadline; else fail over
+            key = f"model:{model}"
+            if self.rate_limiter and not self.rate_limiter.acquire(key, max_wait=remaining):
+                with self._lock:
+                    health.probe_in_flight = False  # Never ran, so the next caller may probe instead
+                errors.append(f"{model}: rate limited")
+                continue
+
+            current_span().incr('attempts')
+            current_span().set('model', model)
+            call_started = time.monotonic()
+            try:
+                result = fn(model, remaining)
+            except Exception as e:
+                if self.rate_limiter:
+                    self.rate_limiter.observe(key, e)
+                self._record(health, time.monotonic() - call_started, e)
+                print(f"{capability} call to {model} failed: {e}")
+                errors.append(f"{model}: {e}")
+                continue
+            self._record(health, time.monotonic() - call_started)
+            if result is None:
+                # The model answered but had nothing for this request (e.g. a safety refusal of one
+                # visitor's photo); that says nothing about the model's health, so don't fail over
+                current_span().set('empty', True)
+                print(f"{capability} call to {model} returned nothing")
+            return result
+
+        raise ProviderUnavailable(f"No {capability} model succeeded: {'; '.join(errors)}")
+
+    def stats(self):
+        """Per-capability, per-model health for the dashboard"""
+        return {
+            capability: {model: self.health(model).snapshot() for model in models}
+            for capability, models in self.routes.items()
+        }
@@ -0,0 +1,169 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from posts import Post, PostPage
+
+
+class SearchCache:
+    """Two-tier cache for booru search results (Post lists): in-memory LRU backed by SQLite"""
+
+    def __init__(self, path="cache/search_cache.sqlite3", max_entries=256, ttl=6 * 60 * 60, enabled=True,
+                 empty_ttl=5 * 60, purge_every=200):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl  # "No results" is often a hiccup or a brand-new tag; retry it sooner
+        self.purge_every = purge_every  # Writes between sweeps of expired disk rows
+        self.enabled = enabled
+        self._writes = 0
+        self._memory = OrderedDict()  # key -> (stored_at, posts)
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(tags, *extra):
+        """Build a cache key from a tag list plus any extra query parameters"""
+        if isinstance(tags, str):
+            tags = tags.split()
+        normalized = sorted({tag.strip().lower().replace(' ', '_') for tag in tags if tag.strip()})
+        return json.dumps([normalized, *extra])
+
+    def _connect(self):
+        # Opened lazily so importing gelbooru.py never touches the disk
+        if self._db is None and self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                "key TEXT PRIMARY KEY, stored_at REAL NOT NULL, posts TEXT NOT NULL)"
+            )
+            self._purge(self._db)  # Rows left over from earlier runs
+        return self._db
+
+    def _purge(self, db):
+        db.execute("DELETE FROM search_cache WHERE stored_at < ?", (time.time() - self.ttl,))
+        db.commit()
+
+    def _fresh(self, stored_at, posts, now):
+        return now - stored_at <= (self.ttl if posts else min(self.empty_ttl, self.ttl))
+
+    def _remember(self, key, stored_at, posts):
+        self._memory[key] = (stored_at, posts)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return cached posts for key, or None on a miss or expired entry"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, posts = entry
+                if self._fresh(stored_at, posts, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return posts
+                del self._memory[key]
+
+            try:
+                db = self._connect()
+                row = db.execute(
+                    "SELECT stored_at, posts FROM search_cache WHERE key = ?", (key,)
+                ).fetchone() if db else None
+            except sqlite3.Error as e:
+                print(f"Search cache read failed: {e}")
+                row = None
+
+            if row is not None:
+                stored = json.loads(row[1])
+                if isinstance(stored, list):
+                    stored = {'posts': stored}  # Rows written before raw counts were kept
+                if self._fresh(row[0], stored['posts'], now):
+                    posts = PostPage([Post.from_dict(post) for post in stored['posts']], stored.get('raw_count'))
+                    self._remember(key, row[0], posts)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return posts
+
+            self.misses += 1
+            return None
+
+    def set(self, key, posts):
+        """Store posts under key in both tiers"""
+        if not self.enabled:
+            return
+        stored_at = time.time()
+        with self._lock:
+            self._remember(key, stored_at, posts)
+            try:
+                db = self._connect()
+                if db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO search_cache (key, stored_at, posts) VALUES (?, ?, ?)",
+                        (key, stored_at, json.dumps({
+                            'posts': [post.to_dict() for post in posts],
+                            'raw_count': getattr(posts, 'raw_count', len(posts)),
+                        })),
+                    )
+                    db.commit()
+                    self._writes += 1
+                    if self._writes % self.purge_every == 0:
+                        self._purge(db)
+            except sqlite3.Error as e:
+                print(f"Search cache write failed: {e}")
+
+    def purge_expired(self):
+        """Drop expired rows from the disk tier"""
+        with self._lock:
+            try:
+                db = self._connect()
+                if db:
+                    self._purge(db)
+            except sqlite3.Error as e:
+                print(f"Search cache purge failed: {e}")
+
+    def clear(self):
+        """Empty both tiers"""
+        with self._lock:
+            self._memory.clear()
+            try:
+                db = self._connect()
+                if db:
+                    db.execute("DELETE FROM search_cache")
+                    db.commit()
+            except sqlite3.Error as e:
+                print(f"Search cache clear failed: {e}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'memory_entries': len(self._memory),
+        }
+
+
+# Shared by every GelbooruSearcher in the process; set SEARCH_CACHE_DISABLED=1 to bypass it
+search_cache = SearchCache(
+    path=os.environ.get("SEARCH_CACHE_PATH", "cache/search_cache.sqlite3"),
+    ttl=float(os.environ.get("SEARCH_CACHE_TTL", 6 * 60 * 60)),
+    empty_ttl=float(os.environ.get("SEARCH_CACHE_EMPTY_TTL", 5 * 60)),
+    enabled=os.environ.get("SEARCH_CACHE_DISABLED", "") not in ("1", "true", "yes"),
+)
@@ -0,0 +1,54 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def content_key(*parts):
+    """Stable key from strings, bytes or anything with a sha1 (e.g. ImageAsset)"""
+    digest = hashlib.sha1()
+    for part in parts:
+        if hasattr(part, 'sha1'):
+            part = part.sha1
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        elif not isinstance(part, bytes):
+            part = repr(part).encode('utf-8')
+        digest.update(hashlib.sha1(part).digest())
+    return digest.hexdigest()
+
+
+class StageCache:
+    """Bounded per-stage memoization of pipeline results, so Streamlit reruns replay instead of recompute"""
+
+    def __init__(self, max_entries_per_stage=16):
+        self.max_entries_per_stage = max_entries_per_stage
+        self._stages = {}
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def run(self, stage, key, fn, *args, **kwargs):
+        """Return (result, hit) for fn(*args, **kwargs), memoized under (stage, key); None is never cached"""
+        with self._lock:
+            entries = self._stages.setdefault(stage, OrderedDict())
+            if key in entries:
+                entries.move_to_end(key)
+                self.hits[stage] = self.hits.get(stage, 0) + 1
+                return entries[key], True
+
+        result = fn(*args, **kwargs)
+
+        with self._lock:
+            self.misses[stage] = self.misses.get(stage, 0) + 1
+            if result is not None:
+                entries[key] = result
+                while len(entries) > self.max_entries_per_stage:
+                    entries.popitem(last=False)
+        return result, False
+
+    def clear(self, stage=None):
+        with self._lock:
+            if stage is None:
+                self._stages.clear()
+            else:
+                self._stages.pop(stage, None)
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for Gelbooru and the model APIs, for offline and load testing.
+Replays recorded Gelbooru/Safebooru/Danbooru search JSON and image files, answers OpenRouter/OpenAI/Gemini
+requests with canned responses, and can inject latency, errors and rate limiting.
+
+    python stub_server.py --port 8900 --latency 0.2 --error-rate 0.05
+    GELBOORU_BASE_URL=http://127.0.0.1:8900/index.php \\
+    SAFEBOORU_BASE_URL=http://127.0.0.1:8900/safebooru/index.php \\
+    OPENROUTER_BASE_URL=http://127.0.0.1:8900/api/v1 \\
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 \\
+    GEMINI_BASE_URL=http://127.0.0.1:8900 streamlit run main.py
+
+Use --record to proxy booru searches to the real boorus and save them for replay.
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from PIL import Image
+
+UPSTREAMS = {
+    'gelbooru': "https://gelbooru.com/index.php",
+    'safebooru': "https://safebooru.org/index.php",
+    'danbooru': "https://danbooru.donmai.us/posts.json",
+}
+TAG_UPSTREAMS = dict(UPSTREAMS, danbooru="https://danbooru.donmai.us/tags.json")
+BOORU_ROUTES = {
+    "/index.php": 'gelbooru',
+    "/safebooru/index.php": 'safebooru',
+    "/danbooru/posts.json": 'danbooru',
+}
+# Gelbooru and Safebooru answer tag lookups on the search URL with s=tag
+TAG_ROUTES = {"/danbooru/tags.json": 'danbooru'}
+URL_FIELDS = ('file_url', 'sample_url', 'preview_url', 'large_file_url', 'preview_file_url')
+
+# Chatty models often explain their tags after the tag line; streaming callers can stop at the newline
+CANNED_TAGS = (
+    "megumin kono_subarashii_sekai_ni_shukufuku_wo! brown_hair red_eyes 1girl\n\n"
+    "These tags identify Megumin from KonoSuba by name and series, plus her most recognisable traits."
+)
+CANNED_VLM_PROMPT = (
+    "Transform this person into anime style: young adult with short dark hair, relaxed smile, "
+    "cel-shaded, bold clean line art, large expressive eyes, vibrant colors, anime proportions, "
+    "soft indoor background."
+)
+
+
+class StubConfig:
+    def __init__(self, data_dir="stub_data", latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None,
+                 record=False, synthetic_posts=0, seed=None, token_delay=0.02, tag_counts=None, total_posts=10_000_000):
+        self.data_dir = data_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit  # Requests per second before answering 429
+        self.record = record
+        self.synthetic_posts = synthetic_posts  # Fake posts per search when nothing is recorded
+        self.token_delay = token_delay  # Seconds between streamed chat tokens
+        # {tag: [post count, category]} for the tag APIs; synthetic searches then only match as many
+        # posts as those counts allow, as if tags were independent in a site of total_posts posts
+        self.tag_counts = tag_counts
+        self.total_posts = total_posts
+        self.random = random.Random(seed)
+
+
+def _recording_name(tags, pid):
+    normalized = '+'.join(sorted(tag for tag in re.split(r'[+ ]', tags.lower()) if tag))
+    return f"{hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]}_{pid}.json"
+
+
+def _posts_of(data):
+    # Gelbooru wraps posts in {"post": [...]}, Safebooru and Danbooru send a bare list
+    return data.get('post', []) if isinstance(data, dict) else data
+
+
+def placeholder_image(width, height, seed, format='PNG'):
+    """Deterministic solid-colour image standing in for a booru file or a generated artwork"""
+    digest = hashlib.md5(seed.encode('utf-8')).digest()
+    image = Image.new('RGB', (width, height), tuple(digest[:3]))
+    image.paste(tuple(digest[3:6]), (width // 4, height // 4, 3 * width // 4, 3 * height // 4))
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so connection pooling behaves like production
+    server_version = "nyp-stub/1.0"
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # --- plumbing -------------------------------------------------------
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+        elif isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _inject_faults(self):
+        """Apply configured latency, rate limiting and random errors; True if a fault response was sent"""
+        config = self.config
+        if config.latency or config.jitter:
+            time.sleep(max(config.latency + config.random.uniform(-config.jitter, config.jitter), 0))
+        if config.rate_limit and not self.server.take_token():
+            self._send(429, {"error": {"message": "stub rate limit", "code": 429}}, headers={"Retry-After": "1"})
+            return True
+        if config.error_rate and config.random.random() < config.error_rate:
+            self._send(500, {"error": {"message": "stub injected error", "code": 500}})
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.count(url.path)
+        if self._inject_faults():
+            return
+        query = parse_qs(url.query)
+        if url.path in BOORU_ROUTES and query.get('s') == ['tag']:
+            self._booru_tags(BOORU_ROUTES[url.path], query)
+        elif url.path in BOORU_ROUTES:
+            self._booru_search(BOORU_ROUTES[url.path], query)
+        elif url.path in TAG_ROUTES:
+            self._booru_tags(TAG_ROUTES[url.path], query)
+        elif url.path.startswith("/images/"):
+            self._image(url.path[len("/images/"):])
+        elif url.path == "/stats":
+            self._send(200, self.server.stats())
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.server.count(url.path)
+        body = self._read_json()
+        if self._inject_faults():
+            return
+        if url.path.endswith("/chat/completions"):
+            self._chat_completion(body)
+        elif url.path.endswith("/responses"):
+            self._openai_response(body)
+        elif re.search(r"/models/[^/]+:(stream)?[gG]enerateContent$", url.path):
+            self._gemini(url, body)
+        else:
+            self._send(404, {"error": "not found"})
+
+    # --- boorus --------------------------------------------------------
+
+    def _booru_search(self, flavor, query):
+        if flavor == "danbooru":
+            tags = query.get('tags', [''])[0].replace(' ', '+')
+            pid = int(query.get('page', ['1'])[0] or 1) - 1
+        else:
+            tags = query.get('tags', [''])[0]
+            pid = int(query.get('pid', ['0'])[0] or 0)
+        limit = int(query.get('limit', ['100'])[0] or 100)
+        path = os.path.join(self.config.data_dir, flavor, _recording_name(tags, pid))
+
+        data = None
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        elif self.config.record:
+            data = self._record_search(flavor, query, path)
+        elif self.config.synthetic_posts:
+            data = self._synthetic_search(flavor, tags, pid, limit)
+
+        if data is None:
+            # Each booru says "no results" differently
+            if flavor == "safebooru":
+                self._send(200, "")
+                return
+            data = [] if flavor == "danbooru" else {"@attributes": {"limit": limit, "offset": pid * limit, "count": 0}}
+        self._send(200, self._localize_urls(data))
+
+    def _record_search(self, flavor, query, path):
+        params = {key: values[0] for key, values in query.items()}
+        response = requests.get(UPSTREAMS[flavor], params=params, timeout=15,
+                                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'})
+        response.raise_for_status()
+        data = response.json() if response.text.strip() else None
+        if data is None:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        # Remember where each image really lives so /images/ can fetch and save it on first request
+        for post in _posts_of(data):
+            for field in URL_FIELDS:
+                if post.get(field):
+                    self.server.upstream_images[os.path.basename(urlparse(post[field]).path)] = post[field]
+        return data
+
+    def _booru_tags(self, flavor, query):
+        if flavor == "danbooru":
+            names = query.get('search[name_comma]', [''])[0].split(',')
+        else:
+            names = query.get('names', [''])[0].split()
+        names = [name for name in names if name]
+        path = os.path.join(self.config.data_dir, flavor, "tags_" + _recording_name('+'.join(names), 0))
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self._send(200, json.load(f))
+            return
+        if self.config.record:
+            response = requests.get(TAG_UPSTREAMS[flavor], params={key: values[0] for key, values in query.items()},
+                                    timeout=15, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'})
+            response.raise_for_status()
+            data = response.json() if response.text.strip() else []
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            self._send(200, data)
+            return
+
+        if self.config.tag_counts is not None:
+            found = [(name, *self.config.tag_counts[name]) for name in names if name in self.config.tag_counts]
+        else:
+            found = [(name, self.config.total_posts, 0) for name in names]  # Every tag matches everything
+        if flavor == "danbooru":
+            self._send(200, [{'name': name, 'post_count': count, 'category': category} for name, count, category in found])
+        elif flavor == "safebooru":
+            self._send(200, [{'name': name, 'count': count, 'type': category} for name, count, category in found])
+        else:
+            self._send(200, {"@attributes": {"limit": len(names), "offset": 0, "count": len(found)},
+                             "tag": [{'id': i + 1, 'name': name, 'count': count, 'type': category, 'ambiguous': 0}
+                                     for i, (name, count, category) in enumerate(found)]})
+
+    def _synthetic_matches(self, tags):
+        """Posts a tag set matches under the configured tag counts"""
+        counts = self.config.tag_counts
+        names = [tag for tag in re.split(r'[+ ]', tags.lower()) if tag and ':' not in tag]
+        if not names:
+            return self.config.total_posts
+        if any(counts.get(name, (0, 0))[0] <= 0 for name in names):
+            return 0
+        infos = [counts[name] for name in names]
+        identity = [info for info in infos if info[1] in (3, 4)]
+        base = min(identity or infos, key=lambda info: info[0])
+        matches = base[0]
+        for info in infos:
+            if info is not base and info[1] not in (3, 4):
+                matches *= info[0] / self.config.total_posts
+        return int(matches)
+
+    def _synthetic_search(self, flavor, tags, pid, limit):
+        total = self.config.synthetic_posts
+        if self.config.tag_counts is not None:
+            total = min(total, self._synthetic_matches(tags))
+        start = pid * limit
+        posts = []
+        for i in range(start, min(start + limit, total)):
+            md5 = hashlib.md5(f"{tags}:{i}".encode('utf-8')).hexdigest()
+            width, height = 1200 + (i % 5) * 100, 1600 + (i % 3) * 150
+            posts.append({
+                'id': 1000000 + i, 'md5': md5, 'score': (i * 37) % 200, 'rating': 'general',
+                'width': width, 'height': height, 'tags': f"{tags.replace('+', ' ')} solo looking_at_viewer",
+                'file_url': f"/images/{md5}.png",
+                'sample_url': f"/images/sample_{md5}.jpg", 'sample_width': 850, 'sample_height': int(850 * height / width),
+                'preview_url': f"/images/thumbnail_{md5}.jpg", 'preview_width': 188, 'preview_height': 250,
+            })
+        if not posts:
+            return None
+        if flavor == "safebooru":
+            return [{**post, 'hash': post.pop('md5'), 'image': f"{post['id']}.png", 'directory': 1, 'rating': 'safe'}
+                    for post in posts]
+        if flavor == "danbooru":
+            return [{
+                'id': post['id'], 'md5': post['md5'], 'score': post['score'], 'rating': 'g',
+                'image_width': post['width'], 'image_height': post['height'], 'tag_string': post['tags'],
+                'file_url': post['file_url'], 'large_file_url': post['sample_url'], 'preview_file_url': post['preview_url'],
+            } for post in posts]
+        return {"@attributes": {"limit": limit, "offset": start, "count": total}, "post": posts}
+
+    def _localize_urls(self, data):
+        base = f"http://{self.headers.get('Host', '127.0.0.1')}"
+        for post in _posts_of(data):
+            for field in URL_FIELDS:
+                if post.get(field):
+                    post[field] = f"{base}/images/{os.path.basename(urlparse(post[field]).path)}"
+        return data
+
+    def _image(self, name):
+        name = os.path.basename(name)
+        path = os.path.join(self.config.data_dir, "images", name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+        elif self.config.record and name in self.server.upstream_images:
+            response = requests.get(self.server.upstream_images[name], timeout=30)
+            response.raise_for_status()
+            data = response.content
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        else:
+            # Nothing recorded: a placeholder sized like the variant that was asked for
+            size = (188, 250) if name.startswith("thumbnail_") else (850, 1133) if name.startswith("sample_") \
+                else (1200, 1600)
+            data = placeholder_image(*size, seed=name, format='JPEG' if name.endswith('.jpg') else 'PNG')
+        content_type = "image/jpeg" if name.endswith(('.jpg', '.jpeg')) else "image/png"
+        self._send(200, data, content_type)
+
+    # --- model APIs -----------------------------------------------------
+
+    def _chat_completion(self, body):
+        messages = body.get('messages', [])
+        has_image = any(isinstance(part, dict) and part.get('type') == 'image_url'
+                        for message in messages for part in (message.get('content') or []) if isinstance(message.get('content'), list))
+        content = CANNED_VLM_PROMPT if has_image else CANNED_TAGS
+        if body.get('stream'):
+            self._stream_chat(body, content)
+            return
+        self._send(200, {
+            "id": f"gen-stub-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'stub'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(content.split()), "total_tokens": len(content.split())},
+        })
+
+    def _stream_chat(self, body, content):
+        """Server-sent chat.completion.chunk events, one word at a time, sent with chunked encoding"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {"id": f"gen-stub-{int(time.time() * 1000)}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": body.get('model', 'stub')}
+        tokens = re.findall(r"\S+\s*|\s+", content)
+        events = [{**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None}]}
+                  for token in tokens]
+        events.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        try:
+            for event in [json.dumps(event) for event in events] + ["[DONE]"]:
+                data = f"data: {event}\n\n".encode('utf-8')
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+                time.sleep(self.config.token_delay)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # Client stopped reading early
+
+    def _openai_response(self, body):
+        image_b64 = base64.b64encode(placeholder_image(1024, 1024, seed=json.dumps(body)[:200])).decode('ascii')
+        self._send(200, {
+            "id": "resp_stub",
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": "completed",
+            "model": body.get('model', 'stub'),
+            "output": [{"id": "ig_stub", "type": "image_generation_call", "status": "completed", "result": image_b64}],
+            "parallel_tool_calls": True,
+            "tool_choice": "auto",
+            "tools": [],
+        })
+
+    def _gemini(self, url, body):
+        image_b64 = base64.b64encode(placeholder_image(1024, 1024, seed=json.dumps(body)[:200])).decode('ascii')
+        chunks = [
+            {"candidates": [{"content": {"role": "model", "parts": [{"text": "Here is your artwork."}]}}]},
+            {"candidates": [{"content": {"role": "model", "parts": [{"inlineData": {"mimeType": "image/png", "data": image_b64}}]},
+                             "finishReason": "STOP"}]},
+        ]
+        if "streamGenerateContent" in url.path:
+            payload = "".join(f"data: {json.dumps(chunk)}\r\n\r\n" for chunk in chunks)
+            self._send(200, payload, "text/event-stream")
+        else:
+            self._send(200, chunks[-1])
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config, verbose=False):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.verbose = verbose
+        self.upstream_images = {}
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._tokens = float(config.rate_limit or 0)
+        self._updated = time.monotonic()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def take_token(self):
+        with self._lock:
+            now = time.monotonic()
+            rate = self.config.rate_limit
+            self._tokens = min(rate, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def count(self, path):
+        with self._lock:
+            self._requests[path] = self._requests.get(path, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {'requests': dict(self._requests)}
+
+    def start(self):
+        """Serve from a daemon thread (for tests and benchmarks); returns self"""
+        threading.Thread(target=self.serve_forever, name="stub-server", daemon=True).start()
+        return self
+
+    def env(self):
+        """Environment variables that point the app at this server"""
+        return {
+            'GELBOORU_BASE_URL': f"{self.base_url}/index.php",
+            'SAFEBOORU_BASE_URL': f"{self.base_url}/safebooru/index.php",
+            'DANBOORU_BASE_URL': f"{self.base_url}/danbooru/posts.json",
+            'OPENROUTER_BASE_URL': f"{self.base_url}/api/v1",
+            'OPENAI_BASE_URL': f"{self.base_url}/v1",
+            'GEMINI_BASE_URL': self.base_url,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for Gelbooru and the model APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--data-dir", default="stub_data", help="recorded search JSON (gelbooru/, safebooru/, danbooru/) and images (images/)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- random seconds on top of --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second before answering 429")
+    parser.add_argument("--synthetic-posts", type=int, default=0, help="fake posts per search when nothing is recorded")
+    parser.add_argument("--record", action="store_true", help="proxy unknown searches to the real boorus and save them")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed chat tokens")
+    parser.add_argument("--tag-counts", default=None, help="JSON {tag: [post count, category]} for tag lookups and synthetic matches")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    config = StubConfig(args.data_dir, args.latency, args.jitter, args.error_rate, args.rate_limit,
+                        args.record, args.synthetic_posts, args.seed, args.token_delay)
+    if args.tag_counts:
+        with open(args.tag_counts, encoding='utf-8') as f:
+            config.tag_counts = json.load(f)
+    server = StubServer((args.host, args.port), config, verbose=args.verbose)
+    print(f"Stub server on {server.base_url}")
+    for name, value in server.env().items():
+        print(f"  {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Per-reference art-style descriptors: the anime half of the VLM analysis, which only depends on
+the reference image, so it is computed once per image and cached on disk by content hash.
+
+Precompute offline for every reference already in the image store (or for given files):
+
+    python style_descriptors.py [image ...]
+"""
+
+import glob
+import os
+import sys
+import threading
+
+from image_asset import ImageAsset
+from image_processor import prepare_image
+from json_memo import JsonMemo
+from models import vlm_describe
+
+STYLE_PROMPT = """This image shows an anime character. Describe only its ART STYLE, not the character, so the style can be applied to a different person:
+- Rendering (cel-shaded, soft-shaded, painterly, etc.)
+- Color palette and vibrancy
+- Eye style and size
+- Line art thickness
+- Shading technique and lighting
+- Signature hair or outfit elements worth carrying over
+
+Answer as a compact comma-separated list of specific technical terms like "cel-shaded", "bold clean line art", "vibrant colors". No introduction."""
+
+
+class StyleDescriptors:
+    """Style descriptions from the VLM keyed by reference image SHA-1, persisted as JSON"""
+
+    def __init__(self, path="cache/style_descriptors.json"):
+        self._memo = JsonMemo(path, "style descriptors")
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, reference):
+        with self._lock:
+            return self._memo.load().get(reference.sha1)
+
+    def describe(self, reference: ImageAsset):
+        """Cached style descriptor for a reference image, asking the VLM on a miss"""
+        descriptor = self.get(reference)
+        if descriptor:
+            self.stats['hits'] += 1
+            print(f"Style descriptor cache hit for {reference.sha1[:8]}")
+            return descriptor
+
+        self.stats['misses'] += 1
+        descriptor = vlm_describe(prepare_image(reference, 'vlm'), STYLE_PROMPT)
+        if descriptor:
+            with self._lock:
+                self._memo.load()[reference.sha1] = descriptor.strip()
+                self._memo.save()
+        return descriptor
+
+
+style_descriptors = StyleDescriptors(path=os.environ.get("STYLE_DESCRIPTOR_CACHE_PATH", "cache/style_descriptors.json"))
+
+
+def main():
+    paths = sys.argv[1:]
+    if not paths:
+        directory = os.environ.get("IMAGE_STORE_DIR", "cache/images")
+        paths = [path for path in glob.glob(os.path.join(directory, '*', '*')) if not path.endswith('.tmp')]
+    for path in paths:
+        with open(path, 'rb') as f:
+            reference = ImageAsset(f.read())
+        if style_descriptors.get(reference):
+            continue
+        try:
+            print(f"{path}: {style_descriptors.describe(reference)}")
+        except Exception as e:
+            print(f"{path}: failed: {e}")
+    print(f"Style descriptors: {style_descriptors.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+
+from json_memo import JsonMemo
+from tag_index import ARTIST, CHARACTER, COPYRIGHT, GENERAL, META, TagInfo, get_tag_index
+from tracing import traced
+
+# Tag APIs name categories either by id or by word, depending on the site and its age
+CATEGORY_NAMES = {
+    'general': GENERAL, 'tag': GENERAL, 'artist': ARTIST, 'copyright': COPYRIGHT,
+    'character': CHARACTER, 'metadata': META, 'meta': META,
+}
+IDENTITY_CATEGORIES = (CHARACTER, COPYRIGHT)
+
+
+def category_id(value):
+    """Numeric booru tag category from an id, a numeric string or a category name; None if unknown"""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = value.strip().lower()
+        return int(value) if value.isdigit() else CATEGORY_NAMES.get(value)
+    return None
+
+
+class TagCounts:
+    """Post counts and categories per tag: the local tag dump, then a JSON memo, then the source's tag API.
+
+    Counts plan the tag fallback (see GelbooruSearcher.fallback_candidates); they drift slowly,
+    so memo entries are kept for ttl seconds per source.
+    """
+
+    def __init__(self, path="cache/tag_counts.json", ttl=7 * 24 * 60 * 60, enabled=True):
+        self.ttl = ttl
+        self.enabled = enabled
+        self._memo = JsonMemo(path, "tag counts")
+        self._lock = threading.Lock()
+        self.stats = {'index': 0, 'memo': 0, 'fetched': 0, 'failed': 0}
+
+    @traced("tag_counts")
+    def lookup(self, source, tags):
+        """{tag: TagInfo} for tags on source; tags it has no posts for get count 0, unknowable ones are left out"""
+        if not self.enabled:
+            return {}
+        index = get_tag_index()
+        now = time.time()
+        infos, missing = {}, []
+        with self._lock:
+            memo = self._memo.load().get(source.name, {})
+            for tag in tags:
+                info = index.lookup(tag) if index else None
+                entry = memo.get(tag)
+                if info is not None:
+                    infos[tag] = info
+                    self.stats['index'] += 1
+                elif entry is not None and now - entry[2] <= self.ttl:
+                    infos[tag] = TagInfo(tag, entry[0], entry[1])
+                    self.stats['memo'] += 1
+                else:
+                    missing.append(tag)
+        if not missing:
+            return infos
+
+        try:
+            fetched = source.fetch_tag_counts(missing)
+        except Exception as e:
+            print(f"Tag count lookup on {source.name} failed: {e}")
+            fetched = None
+        if fetched is None:
+            self.stats['failed'] += len(missing)
+            return infos
+
+        with self._lock:
+            memo = self._memo.load().setdefault(source.name, {})
+            for tag in missing:
+                # A tag the API does not know has no posts on that source
+                info = fetched.get(tag) or TagInfo(tag, 0, None)
+                infos[tag] = info
+                memo[tag] = [info.count, info.category, now]
+            self._memo.save()
+        self.stats['fetched'] += len(missing)
+        return infos
+
+
+# Shared by every searcher in the process; set TAG_COUNTS_DISABLED=1 to fall back to dropping the last tag
+tag_counts = TagCounts(
+    path=os.environ.get("TAG_COUNTS_CACHE_PATH", "cache/tag_counts.json"),
+    enabled=os.environ.get("TAG_COUNTS_DISABLED", "") not in ("1", "true", "yes"),
+)
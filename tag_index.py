@@ -0,0 +1,254 @@
+import bisect
+import csv
+import difflib
+import mmap
+import os
+import re
+import struct
+import threading
+
+# Tag dump in the danbooru/gelbooru autocomplete CSV layout: name,category,post_count,"alias1,alias2"
+TAG_DUMP_PATH = os.environ.get("TAG_DUMP_PATH", "data/tags.csv")
+
+INDEX_MAGIC = b"NYPTAGS1"
+HEADER = struct.Struct("<8sI")
+OFFSET = struct.Struct("<I")
+
+# Category ids used by the booru tag dumps
+GENERAL, ARTIST, COPYRIGHT, CHARACTER, META = 0, 1, 3, 4, 5
+
+
+class TagInfo:
+    __slots__ = ('name', 'count', 'category')
+
+    def __init__(self, name, count, category):
+        self.name = name
+        self.count = count
+        self.category = category
+
+    def __repr__(self):
+        return f"TagInfo({self.name!r}, count={self.count}, category={self.category})"
+
+
+def normalize_tag(tag):
+    return tag.strip().lower().replace(' ', '_')
+
+
+def build_index(dump_path, index_path):
+    """Compile a CSV tag dump into the sorted binary index TagIndex memory-maps"""
+    tags = {}
+    aliases = {}
+    with open(dump_path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or not row[2].strip().isdigit():
+                continue  # Header or malformed line
+            name = normalize_tag(row[0])
+            tags[name] = (int(row[2]), int(row[1]) if row[1].strip().isdigit() else GENERAL)
+            if len(row) > 3:
+                for alias in row[3].split(','):
+                    alias = normalize_tag(alias)
+                    if alias and alias != name:
+                        aliases.setdefault(alias, name)
+
+    # One record per key: "key\tcanonical\tcount\tcategory\n"; canonical is empty for real tags
+    records = []
+    for name, (count, category) in tags.items():
+        records.append((name.encode('utf-8'), b"", count, category))
+    for alias, name in aliases.items():
+        if alias not in tags:
+            count, category = tags[name]
+            records.append((alias.encode('utf-8'), name.encode('utf-8'), count, category))
+    records.sort(key=lambda record: record[0])
+
+    blob = bytearray()
+    offsets = bytearray()
+    for key, canonical, count, category in records:
+        offsets += OFFSET.pack(len(blob))
+        blob += b"%s\t%s\t%d\t%d\n" % (key, canonical, count, category)
+
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(INDEX_MAGIC, len(records)))
+        f.write(offsets)
+        f.write(blob)
+    os.replace(tmp_path, index_path)
+    print(f"Built tag index with {len(tags)} tags and {len(aliases)} aliases at {index_path}")
+
+
+class TagIndex:
+    """Read-only, memory-mapped sorted tag dictionary with alias resolution and typo correction"""
+
+    def __init__(self, index_path):
+        self._file = open(index_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._size = HEADER.unpack_from(self._map, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{index_path} is not a tag index")
+        self._offsets_start = HEADER.size
+        self._blob_start = HEADER.size + self._size * OFFSET.size
+        self._keys = _KeyView(self)
+
+    @classmethod
+    def load(cls, dump_path=TAG_DUMP_PATH, index_path=None):
+        """Open the index for a dump, rebuilding it first if it is missing or stale"""
+        index_path = index_path or dump_path + ".idx"
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(dump_path):
+            build_index(dump_path, index_path)
+        return cls(index_path)
+
+    def __len__(self):
+        return self._size
+
+    def _record(self, i):
+        (offset,) = OFFSET.unpack_from(self._map, self._offsets_start + i * OFFSET.size)
+        start = self._blob_start + offset
+        end = self._map.find(b"\n", start)
+        return self._map[start:end].split(b"\t")
+
+    def _key(self, i):
+        (offset,) = OFFSET.unpack_from(self._map, self._offsets_start + i * OFFSET.size)
+        start = self._blob_start + offset
+        return self._map[start:self._map.find(b"\t", start)]
+
+    def _find(self, key):
+        i = bisect.bisect_left(self._keys, key)
+        if i < self._size and self._key(i) == key:
+            return self._record(i)
+        return None
+
+    def lookup(self, tag):
+        """Return TagInfo for a tag or alias (resolved to its canonical name), or None"""
+        record = self._find(normalize_tag(tag).encode('utf-8'))
+        if record is None:
+            return None
+        key, canonical, count, category = record
+        return TagInfo((canonical or key).decode('utf-8'), int(count), int(category))
+
+    def _prefixed(self, prefix, limit):
+        start = bisect.bisect_left(self._keys, prefix)
+        end = min(bisect.bisect_left(self._keys, prefix + b"\xff"), start + limit)
+        return [self._key(i) for i in range(start, end)]
+
+    def suggest(self, tag, cutoff=0.8, limit=5000):
+        """Best guess for a misspelled or truncated tag, preferring popular tags"""
+        key = normalize_tag(tag).encode('utf-8')
+        if not key:
+            return None
+
+        # Truncated names ("gojo" -> "gojo_satoru"): most popular tag extending the word
+        extensions = [self.lookup(k.decode('utf-8')) for k in self._prefixed(key + b"_", limit)]
+        if extensions:
+            return max(extensions, key=lambda info: info.count)
+        return self.correct(tag, cutoff, limit)
+
+    def correct(self, tag, cutoff=0.8, limit=5000):
+        """Best guess for a misspelled tag among tags sharing its first few characters, preferring popular tags"""
+        key = normalize_tag(tag).encode('utf-8')
+        if not key:
+            return None
+        for prefix_length in (3, 2):
+            candidates = [k.decode('utf-8') for k in self._prefixed(key[:prefix_length], limit)]
+            matches = difflib.get_close_matches(key.decode('utf-8'), candidates, n=5, cutoff=cutoff)
+            if matches:
+                infos = [self.lookup(match) for match in matches]
+                return max(infos, key=lambda info: info.count)
+        return None
+
+    def resolve(self, tag):
+        """Canonical tag name for tag, fixing aliases and typos; None if it can't be matched"""
+        if ':' in tag:
+            return normalize_tag(tag)  # Metatags like rating:general are not in the dump
+        info = self.lookup(tag) or self.suggest(tag)
+        return info.name if info else None
+
+    def clean(self, tags):
+        """Resolve a tag list, dropping unknown tags and duplicates while keeping order"""
+        if isinstance(tags, str):
+            tags = tags.split()
+        cleaned = []
+        for tag in tags:
+            resolved = self.resolve(tag)
+            if resolved is None:
+                print(f"Dropping unknown tag: {tag}")
+            elif resolved not in cleaned:
+                if resolved != normalize_tag(tag):
+                    print(f"Resolved tag {tag} -> {resolved}")
+                cleaned.append(resolved)
+        return cleaned
+
+
+class _KeyView:
+    # Sequence over the sorted keys so bisect can search the mmap directly
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return self._index._size
+
+    def __getitem__(self, i):
+        return self._index._key(i)
+
+
+_tag_index = None
+_tag_index_lock = threading.Lock()
+_missing_reported = False
+
+
+def get_tag_index():
+    """Process-wide TagIndex, or None when no tag dump is installed"""
+    global _tag_index, _missing_reported
+    if _tag_index is None and not os.path.exists(TAG_DUMP_PATH):
+        if not _missing_reported:
+            _missing_reported = True
+            print(f"No tag dump at {TAG_DUMP_PATH}; tag validation and local tag matching are off "
+                  f"until `python fetch_tags.py` has been run")
+        return None
+    if _tag_index is None:
+        with _tag_index_lock:
+            if _tag_index is None:
+                try:
+                    _tag_index = TagIndex.load(TAG_DUMP_PATH)
+                except (OSError, ValueError) as e:
+                    print(f"Could not load tag index: {e}")
+    return _tag_index
+
+
+# Lowercase, no spaces, not ending in a colon or full stop: "megumin", "re:zero", "kono_subarashii_sekai_ni_shukufuku_wo!"
+TAG_TOKEN = re.compile(r"^[a-z0-9_()!?:'.&+\-/~@;]*[a-z0-9_()!?'&+\-/~@;]$")
+# Words that show a line is prose ("Here are the tags:") rather than a tag list
+PROSE_WORDS = {'here', 'are', 'is', 'the', 'these', 'tags', 'tag', 'search', 'terms', 'for', 'and', 'of', 'sure'}
+
+
+def _tag_tokens(line):
+    line = line.strip().strip('`"\'*').replace(',', ' ')
+    return [token.strip('`"\'') for token in line.split()]
+
+
+def looks_like_tags(line):
+    """True if every token on the line could be a booru tag"""
+    tokens = _tag_tokens(line)
+    return bool(tokens) and all(TAG_TOKEN.match(token) and token not in PROSE_WORDS for token in tokens)
+
+
+def tag_line(text):
+    """The first complete (newline-terminated) line of an LLM answer that looks like a tag list, else None.
+
+    Blank lines, code fences and preambles like "Here are the tags:" are skipped, so a stream
+    can be stopped as soon as this returns something."""
+    for line in text.split("\n")[:-1]:  # The last piece may still be streaming
+        if not line.strip() or line.strip().startswith('```'):
+            continue
+        if looks_like_tags(line):
+            return ' '.join(_tag_tokens(line))
+    return None
+
+
+def clean_tags(tags):
+    """Validate and normalize LLM-produced tags against the local dictionary, if there is one"""
+    index = get_tag_index()
+    if isinstance(tags, str):
+        tags = tags.split()
+    if index is None:
+        return list(tags)
+    cleaned = index.clean(tags)
+    return cleaned or list(tags)  # Never hand the searcher an empty query
@@ -0,0 +1,171 @@
+import difflib
+import os
+import re
+import threading
+
+from json_memo import JsonMemo
+from models import openrouter_generate
+from router import ProviderUnavailable
+from tag_index import CHARACTER, COPYRIGHT, clean_tags, get_tag_index, tag_line
+
+STOPWORDS = {'a', 'an', 'and', 'as', 'by', 'from', 'in', 'like', 'of', 'on', 'the', 'with'}
+
+
+def normalize_prompt(prompt):
+    """Lowercase, strip punctuation and collapse whitespace so trivial variations share a cache entry"""
+    words = re.findall(r"[\w'!:.-]+", prompt.lower())
+    return ' '.join(word.strip('.') for word in words if word.strip('.'))
+
+
+class TagResolver:
+    """Turns a character prompt into booru tags: memo cache, then local matching, then the LLM"""
+
+    def __init__(self, path="cache/tag_resolver.json", fuzzy_cutoff=0.93):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._memo = JsonMemo(path, "tag resolver cache")
+        self._lock = threading.Lock()
+        self.stats = {'memo': 0, 'local': 0, 'llm': 0, 'failed': 0}
+
+    def remember(self, prompt, tags):
+        key = normalize_prompt(prompt)
+        with self._lock:
+            self._memo.load()[key] = list(tags)
+            self._memo.save()
+
+    def lookup_memo(self, prompt):
+        """Tags for a prompt answered before, after normalize_prompt"""
+        # Exact only: near-identical prompts are often different characters (Rem/Ram, Megumin/Megumi)
+        with self._lock:
+            return self._memo.load().get(normalize_prompt(prompt))
+
+    def match_local(self, prompt, fuzzy=False):
+        """Find character and series names in the prompt using the offline tag dictionary.
+
+        Only exact tags and aliases match, unless fuzzy allows correcting a one-word character
+        name whose tag is qualified by a series also named in the prompt ("shinobuu monogatari").
+        """
+        index = get_tag_index()
+        if index is None:
+            return None
+        words = normalize_prompt(prompt).split()
+
+        found = {CHARACTER: [], COPYRIGHT: []}
+        series_words = []  # How the prompt spelled each series, e.g. "konosuba"
+        used = set()
+        # Longest phrases first so "gojo satoru" wins over "gojo"
+        for length in range(min(len(words), 4), 0, -1):
+            for start in range(len(words) - length + 1):
+                span = set(range(start, start + length))
+                phrase = words[start:start + length]
+                if span & used or phrase[0] in STOPWORDS or phrase[-1] in STOPWORDS:
+                    continue
+                candidates = ['_'.join(phrase)]
+                if length == 2:
+                    candidates.append('_'.join(reversed(phrase)))  # Western vs Japanese name order
+                for candidate in candidates:
+                    info = index.lookup(candidate)
+                    if info is not None and info.category in found and info.name not in found[info.category]:
+                        found[info.category].append(info.name)
+                        if info.category == COPYRIGHT:
+                            series_words.append(candidate)
+                        used |= span
+                        break
+
+        if fuzzy and not found[CHARACTER]:
+            for i, word in enumerate(words):
+                if i in used or word in STOPWORDS or len(word) < 5:
+                    continue
+                info = self._correct_character(index, word, series_words, found[COPYRIGHT])
+                if info is not None:
+                    found[CHARACTER].append(info.name)
+                    break
+
+        if not found[CHARACTER]:
+            return None  # A series alone is too vague; let the LLM pick traits
+        return found[CHARACTER] + found[COPYRIGHT]
+
+    def _correct_character(self, index, word, series_words, series):
+        """Character tag for a misspelled one-word name, qualified by one of the prompt's series"""
+        # Near-identical names are often different characters (Megumin/Megumi, Rem/Ram), so a
+        # guess must carry a series named in the prompt, and the name itself must be very close
+        for series_word in series_words:
+            info = index.correct(f"{word}_({series_word})", cutoff=self.fuzzy_cutoff)
+            if info is None or info.category != CHARACTER or self._series_of(index, info.name) not in series:
+                continue
+            name = info.name[:info.name.rindex('_(')]
+            if difflib.SequenceMatcher(None, word, name).ratio() >= self.fuzzy_cutoff:
+                return info
+        return None
+
+    @staticmethod
+    def _series_of(index, name):
+        """Series tag from a character tag's qualifier: "megumi_(konosuba)" -> its copyright tag"""
+        if not name.endswith(')') or '_(' not in name:
+            return None
+        info = index.lookup(name[name.rindex('_(') + 2:-1])
+        return info.name if info is not None and info.category == COPYRIGHT else None
+
+    def resolve(self, prompt, llm_fallback):
+        """Return a tag list for prompt; llm_fallback(prompt) is only called when nothing local matches"""
+        tags = self.lookup_memo(prompt)
+        if tags:
+            self.stats['memo'] += 1
+            print(f"Tag resolver memo hit: {tags}")
+            return tags
+
+        tags = self.match_local(prompt)
+        if tags:
+            self.stats['local'] += 1
+            print(f"Tag resolver local match: {tags}")
+            self.remember(prompt, tags)
+            return tags
+
+        # A corrected typo is a guess: use it, but don't make it permanent
+        tags = self.match_local(prompt, fuzzy=True)
+        if tags:
+            self.stats['local'] += 1
+            print(f"Tag resolver fuzzy local match: {tags}")
+            return tags
+
+        tags = llm_fallback(prompt)
+        if tags:
+            self.stats['llm'] += 1
+            self.remember(prompt, tags)
+        else:
+            self.stats['failed'] += 1
+        return tags
+
+
+def llm_tags(prompt):
+    """Booru tags for a character prompt from the text LLM (the slow path of TagResolver.resolve)"""
+    # 1. use ai to parse prompt into proper anime character name.
+    # 2. if unable to find name, traits such as hair, eye color, height are also acceptable
+    prompt = f"""Parse this anime character description and extract search terms for booru image boards: "{prompt}"
+
+    IMPORTANT: Use only valid booru tags in this format:
+    - Character names: lowercase, underscores for spaces (e.g., "megumin", "gojo", "gojo_satoru")
+    - Series names: with underscores (e.g., "konosuba", "jujutsu_kaisen")
+    - Physical traits: standardized tags (e.g., "red_eyes", "brown_hair", "long_hair")
+    - Always include "1girl" or "1boy" as appropriate
+    - Use tags like "official_art" or "anime_screenshot" for better quality
+
+    Examples:
+    - "megumin konosuba red_eyes brown_hair 1girl official_art"
+    - "gojo_satoru jujutsu_kaisen white_hair blue_eyes 1boy"
+    - "zero_two darling_in_the_franxx pink_hair red_horns 1girl"
+
+    Return only the search tags separated by spaces, no explanations."""
+    try:
+        # Streamed, and cut off as soon as the tag line is complete instead of waiting out any explanation
+        answer = openrouter_generate(prompt, stop=lambda text: tag_line(text) is not None)
+    except ProviderUnavailable as e:
+        print(f"Tag LLM unavailable: {e}")
+        return []
+    if not answer:
+        return []
+    # Fix aliases/typos and drop made-up tags locally instead of paying a search round trip each;
+    # if no line looked like tags, search on the whole answer as before streaming
+    return clean_tags(tag_line(answer + "\n") or ' '.join(answer.replace('`', ' ').split()))
+
+
+tag_resolver = TagResolver(path=os.environ.get("TAG_RESOLVER_CACHE_PATH", "cache/tag_resolver.json"))
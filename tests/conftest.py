@@ -0,0 +1,64 @@
+"""
+Shared fixtures for the offline tests. Like benchmarks/common.py, this points every cache
+at a throwaway directory before any app module is imported.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="nyp-test-")
+
+os.environ.update({
+    'SEARCH_CACHE_PATH': os.path.join(SCRATCH_DIR, "search_cache.sqlite3"),
+    'IMAGE_STORE_DIR': os.path.join(SCRATCH_DIR, "images"),
+    'TAG_RESOLVER_CACHE_PATH': os.path.join(SCRATCH_DIR, "tag_resolver.json"),
+    'STYLE_DESCRIPTOR_CACHE_PATH': os.path.join(SCRATCH_DIR, "style_descriptors.json"),
+    'TAG_COUNTS_CACHE_PATH': os.path.join(SCRATCH_DIR, "tag_counts.json"),
+    'TAG_DUMP_PATH': os.path.join(SCRATCH_DIR, "tags.csv"),
+    'RATE_LIMIT_STATE': os.path.join(SCRATCH_DIR, "ratelimit.json"),
+})
+
+
+class Clock:
+    """Stand-in for time.time and time.monotonic that only moves when a test sets now"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    import time
+    clock = Clock()
+    monkeypatch.setattr(time, 'time', clock)
+    monkeypatch.setattr(time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def stub(tmp_path):
+    """stub_server.py on a free port, with recordings and images under tmp_path/stub_data"""
+    from stub_server import StubConfig, StubServer
+    server = StubServer(('127.0.0.1', 0), StubConfig(data_dir=str(tmp_path / "stub_data"))).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def record(server, flavor, tags, data, pid=0):
+    """Save a search response for the stub to replay for tags (as sent, e.g. "1girl+rating:general")"""
+    import json
+    from stub_server import _recording_name
+    path = os.path.join(server.config.data_dir, flavor, _recording_name(tags, pid))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
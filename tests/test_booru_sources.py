@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Offline tests for mapping each booru's search response onto Gelbooru's post fields.
+"""
+
+import json
+
+from booru_sources import SafebooruSearcher
+from search_cache import SearchCache
+
+
+class Response:
+    def __init__(self, data):
+        self.text = json.dumps(data)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def test_safebooru_samples_and_thumbnails_are_hash_named_jpegs():
+    searcher = SafebooruSearcher(cache=SearchCache(enabled=False), base_url="https://safebooru.org/index.php")
+    posts = searcher.parse_posts(Response([
+        {'id': 1, 'image': "megumin.png", 'hash': "abc123", 'directory': "4321", 'sample': 1, 'rating': "safe"},
+        {'id': 2, 'image': "def456.gif", 'directory': "4321", 'sample': 0, 'rating': "questionable"},
+    ]))
+    assert posts[0]['file_url'] == "https://safebooru.org/images/4321/megumin.png"
+    assert posts[0]['sample_url'] == "https://safebooru.org/samples/4321/sample_abc123.jpg"
+    assert posts[0]['preview_url'] == "https://safebooru.org/thumbnails/4321/thumbnail_abc123.jpg"
+    assert posts[0]['md5'] == "abc123" and posts[0]['rating'] == 'general'
+    assert posts[1]['sample_url'] == ""
+    assert posts[1]['preview_url'] == "https://safebooru.org/thumbnails/4321/thumbnail_def456.jpg"
+
+
+def test_safebooru_empty_body_is_no_results():
+    searcher = SafebooruSearcher(cache=SearchCache(enabled=False), base_url="https://safebooru.org/index.php")
+    response = Response([])
+    response.text = ""
+    assert searcher.parse_posts(response) == []
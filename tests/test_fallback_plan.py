@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Offline tests for planning the tag fallback from post counts (no searches are made).
+"""
+
+import pytest
+
+from gelbooru import GENERIC_FALLBACK, GelbooruSearcher
+from search_cache import SearchCache
+from tag_index import CHARACTER, COPYRIGHT, GENERAL, TagInfo
+
+COUNTS = {
+    'megumin': (10_000, CHARACTER),
+    'kono_subarashii_sekai_ni_shukufuku_wo!': (30_000, COPYRIGHT),
+    '1girl': (6_000_000, GENERAL),
+    'red_eyes': (2_000_000, GENERAL),
+    'brown_hair': (1_500_000, GENERAL),
+    'official_art': (200_000, GENERAL),
+    'anime_screenshot': (300_000, GENERAL),
+    'made_up_tag': (0, None),
+}
+INFOS = {tag: TagInfo(tag, count, category) for tag, (count, category) in COUNTS.items()}
+
+
+class FakeCounts:
+    """TagCounts stand-in that knows the tags in INFOS and nothing else"""
+
+    def __init__(self, infos):
+        self.infos = infos
+
+    def lookup(self, source, tags):
+        return {tag: self.infos[tag] for tag in tags if tag in self.infos}
+
+
+@pytest.fixture
+def searcher():
+    return GelbooruSearcher(cache=SearchCache(enabled=False), base_url="http://127.0.0.1:9/index.php",
+                            counts=FakeCounts(INFOS))
+
+
+def test_estimate_uses_the_rarest_name(searcher):
+    assert searcher.estimate_matches(['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!'], INFOS) == 10_000
+    assert searcher.estimate_matches(['kono_subarashii_sekai_ni_shukufuku_wo!'], INFOS) == 30_000
+
+
+def test_estimate_narrows_by_descriptive_tags(searcher):
+    # 10k megumin posts, 20% of the site has red_eyes
+    assert searcher.estimate_matches(['megumin', 'red_eyes'], INFOS) == pytest.approx(2_000)
+    assert searcher.estimate_matches(['red_eyes'], INFOS) == 2_000_000
+
+
+def test_estimate_without_counts_is_the_whole_site(searcher):
+    assert searcher.estimate_matches(['rating:general'], INFOS) == searcher.total_posts
+
+
+def test_plan_drops_descriptive_tags_first_and_the_character_last(searcher):
+    tags = ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!', 'red_eyes', 'brown_hair', '1girl', 'official_art']
+    assert searcher.planned_candidates(tags, INFOS) == [
+        ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!', '1girl', 'red_eyes', 'brown_hair', 'official_art'],
+        ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!', '1girl', 'red_eyes', 'brown_hair'],
+        ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!', '1girl', 'red_eyes'],
+        ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!', '1girl'],
+        ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!'],
+        ['megumin'],
+        GENERIC_FALLBACK,
+    ]
+
+
+def test_plan_starts_at_the_first_subset_likely_to_match(searcher):
+    tags = ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!', 'red_eyes', 'brown_hair', '1girl',
+            'official_art', 'anime_screenshot']
+    # All seven tags together are estimated at ~0.1 posts, so the plan skips straight to dropping official_art
+    candidates = searcher.planned_candidates(tags, INFOS)
+    assert candidates[0] == ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!', '1girl', 'red_eyes',
+                             'brown_hair', 'anime_screenshot']
+
+
+def test_plan_skips_unknown_tags_and_keeps_metatags(searcher):
+    candidates = searcher.planned_candidates(['rating:general', 'made_up_tag', 'megumin', 'red_eyes'], INFOS)
+    assert candidates == [['rating:general', 'megumin', 'red_eyes'], ['rating:general', 'megumin'], GENERIC_FALLBACK]
+
+
+def test_plan_falls_back_to_generic_when_nothing_is_likely(searcher):
+    searcher.min_expected_posts = 1e9
+    assert searcher.planned_candidates(['megumin', 'red_eyes'], INFOS) == [GENERIC_FALLBACK]
+
+
+def test_fallback_candidates_uses_the_plan_when_every_tag_is_counted(searcher):
+    assert searcher.fallback_candidates("Red_Eyes megumin") == [['megumin', 'red_eyes'], ['megumin'], GENERIC_FALLBACK]
+    assert searcher.fallback_candidates("red_eyes megumin", max_attempts=1) == [['megumin', 'red_eyes']]
+
+
+def test_fallback_candidates_drops_from_the_end_without_counts(searcher):
+    assert searcher.fallback_candidates("megumin uncounted_tag red_eyes") == [
+        ['megumin', 'uncounted_tag', 'red_eyes'], ['megumin', 'uncounted_tag'], ['megumin'], GENERIC_FALLBACK,
+    ]
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Stub-backed tests for HedgedSearch: which source's posts win, and when a generic fallback may.
+"""
+
+from booru_sources import HedgedSearch, SafebooruSearcher
+from conftest import record
+from gelbooru import GelbooruSearcher
+from search_cache import SearchCache
+from tag_counts import TagCounts
+
+
+def gelbooru_posts(name, count=6):
+    return {"@attributes": {"limit": 100, "offset": 0, "count": count}, "post": [{
+        'id': i, 'md5': f"{name}{i:028d}"[-32:], 'score': 10 * i, 'rating': 'general', 'width': 1200, 'height': 1600,
+        'tags': f"{name} 1girl", 'file_url': f"/images/{name}_{i}.png",
+    } for i in range(count)]}
+
+
+def safebooru_posts(name, count=6):
+    return [{
+        'id': i, 'hash': f"{name}{i:028d}"[-32:], 'score': 10 * i, 'rating': 'safe', 'width': 1200, 'height': 1600,
+        'tags': f"{name} 1girl", 'image': f"{name}_{i}.png", 'directory': "1", 'sample': 0,
+    } for i in range(count)]
+
+
+def sources(stub):
+    env = stub.env()
+    # Tag counts off: the fallback simply drops tags from the end, then tries 1girl
+    options = dict(cache=SearchCache(enabled=False), counts=TagCounts(enabled=False))
+    return (GelbooruSearcher(base_url=env['GELBOORU_BASE_URL'], **options),
+            SafebooruSearcher(base_url=env['SAFEBOORU_BASE_URL'], **options))
+
+
+def names(posts):
+    return {post.tags.split()[0] for post in posts}
+
+
+def test_first_source_with_the_character_wins(stub):
+    record(stub, 'gelbooru', "megumin+rating:general", gelbooru_posts('megumin'))
+    record(stub, 'safebooru', "megumin", safebooru_posts('megumin_safebooru'))
+    gelbooru, safebooru = sources(stub)
+    search = HedgedSearch([gelbooru, safebooru], cold_delay=5.0)
+    posts = search.find_posts(['megumin'])
+    assert names(posts) == {'megumin'}
+    assert len(posts) == gelbooru.top_k
+    # Gelbooru answered well within the hedge delay, so Safebooru was never asked
+    assert stub.stats()['requests'].get("/safebooru/index.php") is None
+
+
+def test_generic_fallback_waits_for_the_other_sources(stub):
+    record(stub, 'gelbooru', "1girl+rating:general", gelbooru_posts('generic'))
+    record(stub, 'safebooru', "megumin", safebooru_posts('megumin'))
+    posts = HedgedSearch(sources(stub), cold_delay=5.0).find_posts(['megumin'])
+    assert names(posts) == {'megumin'}
+
+
+def test_generic_fallback_is_used_when_nothing_finds_the_character(stub):
+    record(stub, 'gelbooru', "1girl+rating:general", gelbooru_posts('generic'))
+    search = HedgedSearch(sources(stub), cold_delay=5.0)
+    assert names(search.find_posts(['megumin'])) == {'generic'}
+    assert search.stats()['safebooru']['empty'] == 1
+
+
+def test_no_results_anywhere(stub):
+    assert HedgedSearch(sources(stub), cold_delay=5.0).find_posts(['megumin']) == []
+
+
+def test_a_clearly_faster_source_goes_first(stub):
+    gelbooru, safebooru = sources(stub)
+    search = HedgedSearch([gelbooru, safebooru], min_samples=2)
+    assert search.ordered_sources() == [gelbooru, safebooru]
+    for latency in (0.2, 0.3):
+        search._stats['gelbooru'].latencies.append(latency + 1.0)
+        search._stats['safebooru'].latencies.append(latency)
+    assert search.ordered_sources() == [safebooru, gelbooru]
+    assert search.hedge_delay(safebooru) == search.min_delay
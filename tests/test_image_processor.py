@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the subject crop of the VLM profile, on synthetic photos.
+"""
+
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+import image_processor
+from image_asset import ImageAsset
+from image_processor import ImageProcessor, subject_box
+
+
+def webcam_photo(subject=(360, 120, 560, 470), size=(960, 540), seed=0):
+    """A plain, slightly noisy wall with a busy 'person' in subject"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, (200, 196, 188))
+    draw = ImageDraw.Draw(image)
+    for _ in range(2000):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.point((x, y), fill=(200 + rng.randint(-3, 3),) * 3)
+    left, top, right, bottom = subject
+    for _ in range(3000):
+        x, y = rng.randrange(left, right), rng.randrange(top, bottom)
+        draw.rectangle((x, y, x + 6, y + 6), fill=tuple(rng.randrange(256) for _ in range(3)))
+    return image
+
+
+def encode(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=95)
+    return ImageAsset(buffer.getvalue())
+
+
+@pytest.fixture
+def no_face_detection(monkeypatch):
+    monkeypatch.setattr(image_processor, 'cv2', None)
+
+
+def contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+def test_crops_a_webcam_photo_to_the_subject(no_face_detection):
+    subject = (360, 120, 560, 470)
+    box = subject_box(webcam_photo(subject))
+    assert contains(box, (subject[0] + 20, subject[1] + 20, subject[2] - 20, subject[3] - 20))
+    # Most of the empty wall is gone
+    assert (box[2] - box[0]) * (box[3] - box[1]) < 0.4 * 960 * 540
+
+
+def test_trims_flat_borders_before_looking_for_detail(no_face_detection):
+    framed = Image.new('RGB', (960, 700), (0, 0, 0))
+    framed.paste(webcam_photo(), (0, 80))
+    box = subject_box(framed)
+    assert box[1] >= 80 + 60 and box[3] <= 80 + 540
+
+
+def test_plain_image_is_left_alone(no_face_detection):
+    assert subject_box(Image.new('RGB', (320, 240), (90, 90, 90))) is None
+
+
+def test_face_box_keeps_head_and_shoulders(monkeypatch):
+    monkeypatch.setattr(image_processor, '_detect_face', lambda image: (400, 100, 100, 100))
+    assert subject_box(webcam_photo()) == (250, 0, 650, 450)
+
+
+def test_vlm_profile_sends_the_crop(no_face_detection):
+    asset = encode(webcam_photo())
+    processed = ImageProcessor().process(asset, 'vlm')
+    assert processed.mime_type == 'image/jpeg'
+    assert processed.size[0] < 960 * 0.6 and processed.size[1] < 540
+    # Other profiles keep the whole frame
+    assert ImageProcessor().process(asset, 'gemini').size == (960, 540)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for picking and downloading reference image variants, against the stub server.
+"""
+
+import io
+import os
+import random
+
+import pytest
+from PIL import Image
+
+import http_session
+from image_store import ImageStore, choose_variant
+
+POST = {
+    'md5': "0123456789abcdef0123456789abcdef", 'width': 1200, 'height': 1600,
+    'file_url': "/images/original.png",
+    'sample_url': "/images/sample_original.jpg", 'sample_width': 850, 'sample_height': 1133,
+    'preview_url': "/images/thumbnail_original.jpg", 'preview_width': 188, 'preview_height': 250,
+}
+
+
+def noisy_png(width, height, seed=0):
+    """A PNG that does not compress, far bigger than the stub's placeholder samples"""
+    rng = random.Random(seed)
+    image = Image.frombytes('RGB', (width, height), bytes(rng.getrandbits(8) for _ in range(width * height * 3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def post(stub):
+    path = os.path.join(stub.config.data_dir, "images", "original.png")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(noisy_png(300, 400))
+    return {key: stub.base_url + value if key.endswith('_url') else value for key, value in POST.items()}
+
+
+def test_choose_variant_takes_the_smallest_that_covers_the_target():
+    assert choose_variant(POST, 200)[1] == 'preview'
+    assert choose_variant(POST, 1024)[1] == 'sample'
+    assert choose_variant(POST, 1200)[1] == 'file'
+    assert choose_variant(POST, 5000)[1] == 'file'  # Nothing covers it: the largest there is
+    assert choose_variant({'file_url': "x.png"}, 1024) == (1 << 30, 'file', "x.png")
+    assert choose_variant({}, 1024) is None
+
+
+def test_fetch_bytes_refuses_bodies_over_the_ceiling(stub, post):
+    data = http_session.fetch_bytes(post['file_url'], 10 * 1024 * 1024)
+    assert data.startswith(b"\x89PNG")
+    with pytest.raises(http_session.DownloadRejected, match="limit"):
+        http_session.fetch_bytes(post['file_url'], len(data) - 1)
+
+
+def test_downloads_reuse_pooled_connections(stub, post):
+    for _ in range(3):
+        http_session.fetch_bytes(post['sample_url'], 1024 * 1024)
+    stats = http_session.connection_stats()[stub.base_url.rsplit(':', 1)[0]]
+    assert stats['requests'] >= 3
+    assert stats['reused'] >= 2
+
+
+def test_fetch_bytes_refuses_non_images(stub):
+    with pytest.raises(http_session.DownloadRejected, match="Content-Type"):
+        http_session.fetch_bytes(stub.base_url + "/stats", 1024 * 1024)
+
+
+def test_oversized_original_falls_back_to_the_sample(stub, post, tmp_path):
+    store = ImageStore(directory=str(tmp_path / "images"), max_download_bytes=100 * 1024)
+    data = store.get(post, target_side=1200)
+    assert Image.open(io.BytesIO(data)).size == (850, 1133)
+    assert stub.stats()['requests']["/images/original.png"] == 1
+    assert stub.stats()['requests']["/images/sample_original.jpg"] == 1
+    # Cached under the sample's size, so the next visitor skips both downloads
+    assert store.get(post, target_side=800) == data
+    assert store.hits == 1
+
+
+def test_dead_variants_fall_back_too(stub, post, tmp_path):
+    store = ImageStore(directory=str(tmp_path / "images"))
+    dead = dict(post, file_url=stub.base_url + "/missing/original.png")
+    data = store.get(dead, target_side=1200)
+    assert Image.open(io.BytesIO(data)).size == (850, 1133)
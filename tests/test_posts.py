@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Offline tests for compact post records and top-k ranking.
+"""
+
+from posts import Post, PostPage, int_or_zero, postcard_score, top_posts
+
+
+def post(i, score=0, rating='general', file_url=True, **fields):
+    return {'id': i, 'md5': f"{i:032x}", 'score': score, 'rating': rating,
+            'file_url': f"https://img.example/{i}.png" if file_url else '', **fields}
+
+
+def test_top_posts_ranks_usable_general_posts():
+    posts = [post(1, 5), post(2, 50), post(3, 500, rating='sensitive'), post(4, 400, file_url=False), post(5, 20)]
+    assert [p.id for p in top_posts(posts, k=2)] == [2, 5]
+    assert [p.id for p in top_posts(posts, k=10)] == [2, 5, 1]
+    assert top_posts([], k=5) == []
+
+
+def test_postcard_score_prefers_big_landscape_solo_posts():
+    ranked = top_posts([
+        post(1, 100, width=600, height=2000),
+        post(2, 100, width=1500, height=1000, tags="1girl solo"),
+        post(3, 100, width=1500, height=1000, tags="2girls"),
+    ], k=3, scorer=postcard_score)
+    assert [p.id for p in ranked] == [2, 3, 1]
+
+
+def test_post_round_trips_and_tolerates_junk_numbers():
+    record = Post.from_dict(post(7, score="12", width="", height=None, tags="megumin solo"))
+    assert (record.score, record.width, record.height) == (12, 0, 0)
+    assert record.has_tag('solo') and not record.has_tag('sol')
+    assert Post.from_dict(record.to_dict()).to_dict() == record.to_dict()
+    assert int_or_zero("abc") == 0
+
+
+def test_post_page_remembers_the_raw_size():
+    assert PostPage([1, 2], raw_count=100).raw_count == 100
+    assert PostPage([1, 2]).raw_count == 2
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the token buckets in ratelimit.py, on a fake clock.
+"""
+
+import email.utils
+
+import pytest
+
+import ratelimit
+from ratelimit import RateLimiter, retry_after_seconds
+
+
+class Response:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+
+def test_burst_then_paced(clock):
+    limiter = RateLimiter(limits={'host:a': (2.0, 3)})
+    assert [limiter.reserve('host:a') for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Each later caller queues behind the one before it
+    assert limiter.reserve('host:a') == pytest.approx(0.5)
+    assert limiter.reserve('host:a') == pytest.approx(1.0)
+
+
+def test_tokens_refill_up_to_burst(clock):
+    limiter = RateLimiter(limits={'host:a': (1.0, 2)})
+    limiter.reserve('host:a')
+    limiter.reserve('host:a')
+    clock.now += 60
+    assert [limiter.reserve('host:a') for _ in range(2)] == [0.0, 0.0]
+    assert limiter.reserve('host:a') == pytest.approx(1.0)
+
+
+def test_unlimited_and_wildcard_keys(clock):
+    limiter = RateLimiter(limits={'model:*:free': (0.5, 1)})
+    assert limiter.reserve('host:unknown') == 0.0
+    assert limiter.reserve('model:vendor/model:free') == 0.0
+    assert limiter.reserve('model:vendor/model:free') == pytest.approx(2.0)
+    assert limiter.reserve('model:vendor/paid') == 0.0
+
+
+def test_max_wait_refuses_without_taking_a_token(clock):
+    limiter = RateLimiter(limits={'host:a': (1.0, 1)})
+    limiter.reserve('host:a')
+    assert limiter.reserve('host:a', max_wait=0.5) is None
+    assert limiter.acquire('host:a', max_wait=0.5) is False
+    # The refused callers did not queue, so the next one only waits for the first refill
+    assert limiter.reserve('host:a', max_wait=1.0) == pytest.approx(1.0)
+
+
+def test_retry_after_blocks_every_caller(clock):
+    limiter = RateLimiter(limits={'host:a': (5.0, 6)})
+    limiter.observe('host:a', Response(429, {'Retry-After': '30'}))
+    assert limiter.reserve('host:a') == pytest.approx(30.0)
+    assert limiter.reserve('host:a', max_wait=10) is None
+    clock.now += 30
+    assert limiter.reserve('host:a') == 0.0
+
+
+def test_retry_after_holds_back_keys_without_a_bucket(clock):
+    limiter = RateLimiter(limits={})
+    assert limiter.reserve('model:gemini-image') == 0.0
+    limiter.observe('model:gemini-image', Response(429, {'Retry-After': '30'}))
+    assert limiter.reserve('model:gemini-image') == pytest.approx(30.0)
+    assert limiter.acquire('model:gemini-image', max_wait=10) is False
+    assert limiter.reserve('host:other') == 0.0
+    clock.now += 30
+    assert limiter.reserve('model:gemini-image') == 0.0
+
+
+def test_observe_ignores_other_responses_and_defaults_the_delay(clock):
+    limiter = RateLimiter(limits={'host:a': (5.0, 6)})
+    limiter.observe('host:a', Response(200, {'Retry-After': '30'}))
+    limiter.observe('host:a', Response(500, {}))
+    assert limiter.reserve('host:a') == 0.0
+
+    class SdkError(Exception):
+        response = Response(503, {})
+
+    limiter.observe('host:a', SdkError())
+    assert limiter.reserve('host:a') == pytest.approx(5.0)
+
+
+def test_state_file_is_shared_between_limiters(clock, tmp_path):
+    if ratelimit.fcntl is None:
+        pytest.skip("no file locking on this platform")
+    path = str(tmp_path / "ratelimit.json")
+    first = RateLimiter(limits={'host:a': (1.0, 1)}, state_path=path)
+    second = RateLimiter(limits={'host:a': (1.0, 1)}, state_path=path)
+    assert first.reserve('host:a') == 0.0
+    assert second.reserve('host:a') == pytest.approx(1.0)
+
+
+def test_retry_after_seconds(clock):
+    assert retry_after_seconds('12') == 12.0
+    assert retry_after_seconds('-3') == 0.0
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds('soon') is None
+    assert retry_after_seconds(email.utils.formatdate(clock.now + 90, usegmt=True)) == pytest.approx(90.0)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Offline tests for ProviderRouter failover and its per-model circuit breakers, on a fake clock.
+"""
+
+import threading
+
+import pytest
+
+from router import CLOSED, HALF_OPEN, OPEN, ProviderRouter, ProviderUnavailable
+
+
+def failing(model, timeout):
+    raise RuntimeError(f"{model} is down")
+
+
+def answering(model, timeout):
+    return f"answer from {model}"
+
+
+def test_fails_over_to_the_next_model(clock):
+    routes = ProviderRouter({'text': ['a', 'b']})
+    assert routes.call('text', lambda model, timeout: failing(model, timeout) if model == 'a' else answering(model, timeout)) == "answer from b"
+    assert routes.health('a').consecutive_failures == 1
+    assert routes.health('b').state == CLOSED
+
+
+def test_empty_response_is_returned_without_tripping_the_circuit(clock):
+    routes = ProviderRouter({'image': ['a', 'b']}, failure_threshold=3)
+    calls = []
+
+    def refused(model, timeout):
+        calls.append(model)
+        return None
+
+    for _ in range(5):
+        assert routes.call('image', refused) is None
+    assert calls == ['a'] * 5
+    assert routes.health('a').state == CLOSED
+    assert routes.health('a').consecutive_failures == 0
+
+
+def test_circuit_opens_after_threshold_and_skips_the_model(clock):
+    routes = ProviderRouter({'text': ['a', 'b']}, failure_threshold=2)
+    calls = []
+
+    def fn(model, timeout):
+        calls.append(model)
+        return failing(model, timeout) if model == 'a' else answering(model, timeout)
+
+    routes.call('text', fn)
+    assert routes.health('a').state == CLOSED
+    routes.call('text', fn)
+    assert routes.health('a').state == OPEN
+    calls.clear()
+    assert routes.call('text', fn) == "answer from b"
+    assert calls == ['b']
+
+
+def test_half_open_probe_closes_on_success(clock):
+    routes = ProviderRouter({'text': ['a']}, failure_threshold=1, reset_timeout=60)
+    with pytest.raises(ProviderUnavailable):
+        routes.call('text', failing)
+    assert routes.health('a').state == OPEN
+
+    clock.now += 30
+    with pytest.raises(ProviderUnavailable, match="circuit open"):
+        routes.call('text', answering)
+
+    clock.now += 30
+    assert routes.call('text', answering) == "answer from a"
+    assert routes.health('a').state == CLOSED
+    assert routes.health('a').consecutive_failures == 0
+
+
+def test_half_open_probe_reopens_on_failure(clock):
+    routes = ProviderRouter({'text': ['a']}, failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        with pytest.raises(ProviderUnavailable):
+            routes.call('text', failing)
+    clock.now += 60
+    with pytest.raises(ProviderUnavailable):
+        routes.call('text', failing)
+    health = routes.health('a')
+    # One failed probe is enough, whatever the threshold, and the timeout starts over
+    assert health.state == OPEN
+    assert health.opened_at == clock.now
+    assert not health.probe_in_flight
+
+
+def test_half_open_lets_one_probe_through(clock):
+    routes = ProviderRouter({'text': ['a', 'b']}, failure_threshold=1, reset_timeout=60)
+    routes.call('text', lambda model, timeout: failing(model, timeout) if model == 'a' else answering(model, timeout))
+    clock.now += 60
+
+    probing = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn(model, timeout):
+        calls.append(model)
+        if model == 'a':
+            probing.set()
+            release.wait(5)
+        return answering(model, timeout)
+
+    probe = threading.Thread(target=routes.call, args=('text', fn))
+    probe.start()
+    assert probing.wait(5)
+    assert routes.health('a').state == HALF_OPEN
+    # While the probe is out, other callers fail over instead of piling onto the recovering model
+    assert routes.call('text', fn) == "answer from b"
+    release.set()
+    probe.join(5)
+    assert calls == ['a', 'b']
+    assert routes.health('a').state == CLOSED
+
+
+def test_rate_limited_probe_frees_the_slot(clock):
+    class NoTokens:
+        def acquire(self, key, max_wait=None):
+            return False
+
+    routes = ProviderRouter({'text': ['a']}, failure_threshold=1, reset_timeout=60)
+    with pytest.raises(ProviderUnavailable):
+        routes.call('text', failing)
+    clock.now += 60
+    routes.rate_limiter = NoTokens()
+    with pytest.raises(ProviderUnavailable, match="rate limited"):
+        routes.call('text', answering)
+    routes.rate_limiter = None
+    assert routes.call('text', answering) == "answer from a"
+
+
+def test_provider_slot_timeout(clock):
+    routes = ProviderRouter({'text': ['a']}, providers={'text': 'upstream'}, concurrency={'upstream': 1})
+    routes._slots['upstream'].acquire()
+    with pytest.raises(ProviderUnavailable, match="slot"):
+        routes.call('text', answering, deadline=0.01)
+    routes._slots['upstream'].release()
+    assert routes.call('text', answering, deadline=1) == "answer from a"
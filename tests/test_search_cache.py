@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the two-tier search cache: LRU, TTLs, the SQLite tier and bypassing it.
+"""
+
+import sqlite3
+
+from gelbooru import GelbooruSearcher
+from posts import Post, PostPage
+from search_cache import SearchCache
+
+
+def page(*ids, raw_count=None):
+    return PostPage([Post.from_dict({'id': i, 'md5': f"{i:032x}", 'rating': 'general',
+                                     'file_url': f"https://img.example/{i}.png"}) for i in ids], raw_count)
+
+
+def ids(posts):
+    return [post.id for post in posts]
+
+
+def rows(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+
+
+def test_key_ignores_tag_order_case_and_spaces():
+    assert SearchCache.make_key(["Megumin", "red eyes"], 100) == SearchCache.make_key("red_eyes megumin", 100)
+    assert SearchCache.make_key(["megumin"], 100) != SearchCache.make_key(["megumin"], 100, 1)
+
+
+def test_memory_tier_evicts_least_recently_used(clock):
+    cache = SearchCache(path=None, max_entries=2)
+    cache.set('a', page(1))
+    cache.set('b', page(2))
+    assert ids(cache.get('a')) == [1]  # Now b is the oldest
+    cache.set('c', page(3))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['memory_entries'] == 2
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = SearchCache(path=None, ttl=60)
+    cache.set('a', page(1))
+    clock.now += 60
+    assert cache.get('a') is not None
+    clock.now += 1
+    assert cache.get('a') is None
+    assert cache.stats()['memory_entries'] == 0
+
+
+def test_empty_results_expire_sooner(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SearchCache(path=path, ttl=3600, empty_ttl=60)
+    cache.set('empty', page())
+    cache.set('full', page(1))
+    clock.now += 61
+    assert cache.get('empty') is None
+    assert SearchCache(path=path, ttl=3600, empty_ttl=60).get('empty') is None
+    assert ids(cache.get('full')) == [1]
+
+
+def test_disk_tier_survives_a_restart(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    SearchCache(path=path).set('a', page(1, 2, raw_count=5))
+    cache = SearchCache(path=path)
+    posts = cache.get('a')
+    assert ids(posts) == [1, 2]
+    assert posts.raw_count == 5
+    assert cache.stats()['disk_hits'] == 1
+    cache.get('a')
+    assert cache.stats()['memory_hits'] == 1
+
+
+def test_expired_rows_are_purged_on_connect_and_while_writing(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    SearchCache(path=path, ttl=60).set('old', page(1))
+    clock.now += 61
+    cache = SearchCache(path=path, ttl=60, purge_every=3)
+    cache.get('anything')
+    assert rows(path) == 0
+
+    cache.set('a', page(1))
+    clock.now += 61
+    cache.set('b', page(2))
+    assert rows(path) == 2
+    cache.set('c', page(3))  # Third write sweeps 'a'
+    assert rows(path) == 2
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SearchCache(path=path, enabled=False)
+    cache.set('a', page(1))
+    assert cache.get('a') is None
+    assert cache.stats()['misses'] == 0
+
+
+def test_search_images_bypasses_the_cache_when_asked(tmp_path):
+    searcher = GelbooruSearcher(cache=SearchCache(path=None), base_url="http://127.0.0.1:9/index.php")
+    fetched = []
+
+    def fetch(tags, tag_string, limit, pid, cache_key, trace):
+        fetched.append(tags)
+        searcher.cache.set(cache_key, page(len(fetched)))
+        return page(len(fetched))
+
+    searcher._fetch_posts = fetch
+    assert searcher.search_images(['megumin'])[0].id == 1
+    assert searcher.search_images(['Megumin'])[0].id == 1
+    assert searcher.search_images(['megumin'], use_cache=False)[0].id == 2
+    assert len(fetched) == 2
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the memory-mapped tag dictionary and for picking the tag line out of an LLM answer.
+"""
+
+import csv
+import os
+
+import pytest
+
+import tag_index
+from tag_index import CHARACTER, COPYRIGHT, GENERAL, TagIndex, clean_tags, tag_line
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    path = tmp_path / "tags.csv"
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'category', 'count', 'aliases'])  # Header lines are skipped
+        writer.writerows([
+            ('megumin', CHARACTER, 10_000, ''),
+            ('kono_subarashii_sekai_ni_shukufuku_wo!', COPYRIGHT, 30_000, 'konosuba,kono_suba'),
+            ('gojou_satoru', CHARACTER, 15_000, 'gojo_satoru'),
+            ('red_eyes', GENERAL, 2_000_000, ''),
+            ('brown_hair', GENERAL, 1_500_000, ''),
+            ('1girl', GENERAL, 6_000_000, ''),
+        ])
+    index = TagIndex.load(str(path))
+    monkeypatch.setattr(tag_index, '_tag_index', index)
+    return index
+
+
+def test_lookup_resolves_aliases(index):
+    assert len(index) == 6 + 3  # Tags plus aliases
+    info = index.lookup("Konosuba")
+    assert (info.name, info.count, info.category) == ('kono_subarashii_sekai_ni_shukufuku_wo!', 30_000, COPYRIGHT)
+    assert index.lookup("red eyes").name == 'red_eyes'
+    assert index.lookup("blue_eyes") is None
+
+
+def test_suggest_extends_truncated_names_and_corrects_typos(index):
+    assert index.suggest("gojou").name == 'gojou_satoru'
+    assert index.correct("red_eyse").name == 'red_eyes'
+    assert index.correct("gojou") is None  # No prefix extension when only correcting
+
+
+def test_clean_fixes_and_drops_llm_tags(index):
+    assert clean_tags("megumin konosuba red_eyse 1girl made_up_tag megumin rating:general") == [
+        'megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!', 'red_eyes', '1girl', 'rating:general']
+    assert clean_tags("made_up_tag") == ['made_up_tag']  # Never an empty query
+
+
+def test_index_is_rebuilt_when_the_dump_changes(index, tmp_path):
+    path = tmp_path / "tags.csv"
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerow(('blue_eyes', GENERAL, 2_100_000, ''))
+    stale = path.with_name("tags.csv.idx")
+    stale.touch()
+    os.utime(stale, (0, 0))
+    assert TagIndex.load(str(path)).lookup("blue_eyes").count == 2_100_000
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("megumin konosuba 1girl\n", "megumin konosuba 1girl"),
+    ("megumin konosuba 1girl", None),  # Still streaming
+    ("```\nmegumin, konosuba, 1girl\n```", "megumin konosuba 1girl"),
+    ("Here are the tags:\n\n`rem_(re:zero) re:zero 1girl`\nThese identify Rem.", "rem_(re:zero) re:zero 1girl"),
+    ("Sure! Tags:\n", None),
+    ("", None),
+])
+def test_tag_line(text, expected):
+    assert tag_line(text) == expected
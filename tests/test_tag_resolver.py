@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Offline tests for TagResolver's local matching against a small tag dump.
+"""
+
+import csv
+
+import pytest
+
+import tag_index
+from tag_index import CHARACTER, COPYRIGHT, GENERAL, TagIndex
+from tag_resolver import TagResolver
+
+# name, category, post_count, aliases
+DUMP = [
+    ('megumin', CHARACTER, 10_000, ''),
+    ('megumi_(konosuba)', CHARACTER, 300, ''),
+    ('kono_subarashii_sekai_ni_shukufuku_wo!', COPYRIGHT, 30_000, 'konosuba'),
+    ('megumi_kato_fanclub', GENERAL, 40, ''),
+    ('fushiguro_megumi', CHARACTER, 9_000, ''),
+    ('jujutsu_kaisen', COPYRIGHT, 60_000, ''),
+    ('gojou_satoru', CHARACTER, 15_000, 'gojo_satoru'),
+    ('rem_(re:zero)', CHARACTER, 20_000, ''),
+    ('ram_(re:zero)', CHARACTER, 12_000, ''),
+    ('re:zero_kara_hajimeru_isekai_seikatsu', COPYRIGHT, 40_000, 're:zero'),
+    ('shinobu_(monogatari)', CHARACTER, 8_000, ''),
+    ('monogatari_(series)', COPYRIGHT, 50_000, 'monogatari'),
+    ('red_eyes', GENERAL, 2_000_000, ''),
+]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    path = tmp_path / "tags.csv"
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(DUMP)
+    index = TagIndex.load(str(path))
+    monkeypatch.setattr(tag_index, '_tag_index', index)
+    return index
+
+
+@pytest.fixture
+def resolver(tmp_path, index):
+    return TagResolver(path=str(tmp_path / "tag_resolver.json"))
+
+
+class LLM:
+    def __init__(self, answer=('llm_tag',)):
+        self.answer = list(answer)
+        self.prompts = []
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        return self.answer
+
+
+def test_exact_names_and_aliases(resolver):
+    assert resolver.match_local("Megumin Konosuba") == ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!']
+    assert resolver.match_local("Gojo Satoru") == ['gojou_satoru']
+    assert resolver.match_local("satoru gojo from jujutsu kaisen") == ['gojou_satoru', 'jujutsu_kaisen']
+
+
+@pytest.mark.parametrize('prompt', [
+    "Megumi Jujutsu Kaisen",  # A prefix of megumi_kato_fanclub, and near megumi_(konosuba)
+    "Ram Re:Zero",  # Only rem_(re:zero) and ram_(re:zero) exist
+    "Megumim Konosuba",  # One letter off megumin, and off megumi_(konosuba)
+    "Konosuba",  # A series alone
+])
+def test_near_misses_go_to_the_llm(resolver, prompt):
+    assert resolver.match_local(prompt) is None
+    assert resolver.match_local(prompt, fuzzy=True) is None
+    llm = LLM()
+    assert resolver.resolve(prompt, llm) == ['llm_tag']
+    assert llm.prompts == [prompt]
+
+
+def test_fuzzy_needs_the_series_in_the_prompt(resolver):
+    assert resolver.match_local("Shinobuu Monogatari") is None
+    assert resolver.match_local("Shinobuu Monogatari", fuzzy=True) == ['shinobu_(monogatari)', 'monogatari_(series)']
+    assert resolver.match_local("Shinobuu", fuzzy=True) is None
+    assert resolver.match_local("Shinobuu Konosuba", fuzzy=True) is None
+
+
+def test_exact_matches_are_remembered_and_fuzzy_ones_are_not(resolver):
+    llm = LLM()
+    assert resolver.resolve("Megumin Konosuba", llm) == ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!']
+    assert resolver.resolve("Shinobuu Monogatari", llm) == ['shinobu_(monogatari)', 'monogatari_(series)']
+    assert llm.prompts == []
+    assert resolver.lookup_memo("megumin konosuba") == ['megumin', 'kono_subarashii_sekai_ni_shukufuku_wo!']
+    assert resolver.lookup_memo("shinobuu monogatari") is None
+
+
+def test_without_a_dump_everything_goes_to_the_llm(tmp_path, monkeypatch):
+    monkeypatch.setattr(tag_index, '_tag_index', None)
+    monkeypatch.setattr(tag_index, 'TAG_DUMP_PATH', str(tmp_path / "missing.csv"))
+    resolver = TagResolver(path=str(tmp_path / "tag_resolver.json"))
+    llm = LLM()
+    assert resolver.resolve("Megumin Konosuba", llm) == ['llm_tag']
+    assert resolver.resolve("  megumin   KONOSUBA.", llm) == ['llm_tag']  # Memo hit after normalizing
+    assert len(llm.prompts) == 1
@@ -0,0 +1,224 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Off by default; TRACING=1 turns on JSON-lines traces and Prometheus-text metrics
+TRACING_ENABLED = os.environ.get("TRACING", "") in ("1", "true", "yes")
+TRACE_PATH = os.environ.get("TRACE_PATH", "traces/trace.jsonl")
+METRICS_PATH = os.environ.get("METRICS_PATH", "traces/metrics.prom")
+METRICS_WRITE_INTERVAL = 10.0
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    """Returned while tracing is off so instrumented code costs an attribute lookup and nothing else"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key, value):
+        pass
+
+    def incr(self, key, amount=1):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'attributes', 'started_at', '_start', '_token')
+
+    def __init__(self, name, attributes):
+        parent = _current.get()
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.started_at = None
+        self._start = None
+        self._token = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def incr(self, key, amount=1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.monotonic() - self._start
+        _current.reset(self._token)
+        if exc is not None:
+            self.attributes['error'] = repr(exc)[:200]
+        collector.record(self, duration)
+        return False
+
+
+def span(name, **attributes):
+    """Context manager timing a block: `with span("search_images", tags=3) as s: s.set("bytes", n)`"""
+    if not TRACING_ENABLED:
+        return NOOP_SPAN
+    return Span(name, attributes)
+
+
+def current_span():
+    """The innermost active span, so callees can attach sizes, retries or cache hits to it"""
+    return (_current.get() or NOOP_SPAN) if TRACING_ENABLED else NOOP_SPAN
+
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit that runs fn in a copy of the caller's context, so its spans join the caller's trace"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def traced(name=None):
+    """Decorator wrapping every call of a function in a span"""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACING_ENABLED:
+                return fn(*args, **kwargs)
+            with Span(span_name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Collector:
+    """Writes finished spans as JSON lines and aggregates per-span latency for Prometheus"""
+
+    def __init__(self, trace_path=TRACE_PATH, metrics_path=METRICS_PATH, window=2048):
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.window = window
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._counts = {}
+        self._sums = {}
+        self._errors = {}
+        self._cache_hits = {}
+        self._bytes = {}
+        self._last_metrics_write = 0.0
+
+    def record(self, span, duration):
+        name = span.name
+        with self._lock:
+            self._durations.setdefault(name, deque(maxlen=self.window)).append(duration)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._sums[name] = self._sums.get(name, 0.0) + duration
+            if 'error' in span.attributes:
+                self._errors[name] = self._errors.get(name, 0) + 1
+            if span.attributes.get('cache_hit'):
+                self._cache_hits[name] = self._cache_hits.get(name, 0) + 1
+            if isinstance(span.attributes.get('bytes'), int):
+                self._bytes[name] = self._bytes.get(name, 0) + span.attributes['bytes']
+
+            record = {
+                'trace_id': span.trace_id,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'name': name,
+                'start': round(span.started_at, 6),
+                'duration_ms': round(duration * 1000, 3),
+                **span.attributes,
+            }
+            try:
+                directory = os.path.dirname(self.trace_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.trace_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+            except OSError as e:
+                print(f"Could not write trace: {e}")
+
+            write_metrics = time.monotonic() - self._last_metrics_write >= METRICS_WRITE_INTERVAL
+            if write_metrics:
+                self._last_metrics_write = time.monotonic()
+        if write_metrics:
+            self.write_metrics()
+
+    def prometheus_text(self):
+        """Prometheus exposition text: a latency summary with p50/p95/p99 plus counters per span name"""
+        lines = [
+            "# HELP nyp_span_duration_seconds Pipeline stage latency",
+            "# TYPE nyp_span_duration_seconds summary",
+        ]
+        with self._lock:
+            names = sorted(self._counts)
+            for name in names:
+                durations = sorted(self._durations[name])
+                for quantile in QUANTILES:
+                    value = durations[min(int(len(durations) * quantile), len(durations) - 1)]
+                    lines.append(f'nyp_span_duration_seconds{{span="{name}",quantile="{quantile}"}} {value:.6f}')
+                lines.append(f'nyp_span_duration_seconds_sum{{span="{name}"}} {self._sums[name]:.6f}')
+                lines.append(f'nyp_span_duration_seconds_count{{span="{name}"}} {self._counts[name]}')
+            for metric, values, help_text in (
+                ("nyp_span_errors_total", self._errors, "Spans that ended with an exception"),
+                ("nyp_span_cache_hits_total", self._cache_hits, "Spans served from a cache"),
+                ("nyp_span_bytes_total", self._bytes, "Payload bytes moved by spans"),
+            ):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for name in names:
+                    lines.append(f'{metric}{{span="{name}"}} {values.get(name, 0)}')
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        try:
+            directory = os.path.dirname(self.metrics_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.metrics_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, self.metrics_path)
+        except OSError as e:
+            print(f"Could not write metrics: {e}")
+
+
+collector = Collector()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = collector.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would drown the console
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve /metrics for Prometheus from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server